@@ -2,18 +2,38 @@ from .conv_layer import ConvLayer
 from .multi_channel_conv_unit import MultiChannelConvUnit
 from .bin_conv_unit import BinConvUnit
 from .conv_unit import ConvUnit
+from .winograd_conv_unit import WinogradConvUnit
 from .fixed_point_multiplier import FixedPointMultiplier
+from .constant_multiplier import ConstantMultiplier
+from .adder_tree import AdderTree
+from .kernel_rom import KernelRom
+from .weight_memory import WeightMemory
 
 from .max_pool_layer import MaxPoolLayer
 from .max_pool_unit import MaxPoolUnit
+from .buffer_layer import BufferLayer
+from .network_top import NetworkTop
+from .layer_controller import LayerController
 
 from .network_parser import NetworkParser
+from .resource_estimator import estimate_resources
+from . import golden_model
+from .simulation import run_regression
+from .scheduler import GenerationError
+from .weight_store import WeightStore, write_weight_store, build_layer_index
 
 from .utils import (
     read_floats,
     float2fixed,
+    float2fixed_array,
+    fixed2float_array,
+    quantize_conv_weights,
+    prune_conv_kernels,
+    batch_norm_folding_error,
     print_info,
     get_file_logger,
     get_std_logger,
     to_vhdl,
+    to_hdl,
+    HdlConverter,
 )
@@ -0,0 +1,185 @@
+import logging
+from functools import reduce
+
+from .utils import print_info, serialize_uniq_by
+from .pipeline import adder_tree_latency, adder_tree_levels, adder_tree_shape
+
+from hwt.code import If
+from hwt.hdl.typeShortcuts import vec
+from hwt.hdl.types.bits import Bits
+from hwt.interfaces.std import Signal, VectSignal
+from hwt.synthesizer.unit import Unit
+
+
+def valid_chain(unit, valid, stages, name="valid"):
+    """
+    This function returns the valid bits of the stages of a pipeline of a
+    unit with clk and rst: the given valid bit of its inputs and its copies
+    delayed by each register of the pipeline. The registers of a stage load
+    only when its valid bit is set.
+    """
+    chain = [valid]
+    for i in range(1, stages):
+        delayed = unit._sig(name=f"{name}_{i}")
+        If(unit.rst, delayed(0)).Else(If(unit.clk._onRisingEdge(), delayed(chain[-1])))
+        chain.append(delayed)
+    return chain
+
+
+@serialize_uniq_by("inputs", "width", "signed", "output_width", "saturate", "pipeline")
+class AdderTree(Unit):
+    """
+    .. hwt-schematic::
+    """
+
+    def __init__(
+        self,
+        inputs=9,
+        width=16,
+        signed=False,
+        output_width=None,
+        saturate=False,
+        pipeline=0,
+        **kwargs,
+    ):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.inputs = inputs
+        self.width = width
+        # the operands are sign extended in each level when they are two's
+        # complement values, zero extended otherwise
+        self.signed = signed
+        # each level has one bit more than the previous, so the sum of all the
+        # inputs never overflows, up to the output width
+        self.levels = adder_tree_levels(inputs)
+        self.sum_width = width + self.levels
+        self.output_width = self.sum_width if output_width is None else output_width
+        # the sums narrower than the output are clamped to its largest or
+        # smallest value instead of wrapping
+        self.saturate = saturate and self.output_width < self.sum_width
+        # a register after every pipeline levels, 0 to a combinational tree
+        self.latency = adder_tree_latency(inputs, pipeline)
+        self.pipeline = pipeline if self.latency else 0
+        self.top_entity = False
+
+        print_info(self, **kwargs)
+        super().__init__()
+
+    def _declr(self):
+        if self.latency:
+            self.clk = Signal()
+            self.rst = Signal()
+            # the inputs are valid, each level of registers loads the sums
+            # of a valid input when it reaches them
+            self.en = Signal()
+        self.input = VectSignal(self.width * self.inputs)
+        self.output = VectSignal(self.output_width)._m()
+
+        name = f"AdderTreeL{self.layer_id}N{self.inputs}W{self.width}"
+        if self.signed:
+            name += "S"
+        if self.saturate:
+            name += f"Q{self.output_width}"
+        if self.pipeline:
+            name += f"P{self.pipeline}"
+        self._name = name
+        self._hdl_module_name = name
+
+    def __extend(self, value, bits, name):
+        # the extended operands are signals, the serializer does not keep the
+        # order of the concatenations inside the additions
+        extension = bits - value._dtype.bit_length()
+        if extension == 0:
+            return value
+        if self.signed:
+            msb = value[value._dtype.bit_length() - 1]
+            extended = reduce(lambda a, b: a._concat(b), [msb] * extension + [value])
+        else:
+            extended = vec(0, extension)._concat(value)
+        operand = self._sig(name=name, dtype=Bits(bit_length=bits, force_vector=True))
+        operand(extended)
+        return operand
+
+    def __register(self, signals, values, valid):
+        If(self.rst, *[signal(0) for signal in signals]).Else(
+            If(
+                self.clk._onRisingEdge(),
+                If(valid, *[signal(value) for signal, value in zip(signals, values)]),
+            )
+        )
+
+    def __saturated(self, result):
+        # the sum fits in the output when its bits above the output are
+        # copies of the sign bit of the output (zeros when unsigned),
+        # otherwise the output is the largest or smallest value
+        sum_width = result._dtype.bit_length()
+        output_type = Bits(bit_length=self.output_width, force_vector=True)
+        top = self.output_width - 1 if self.signed else self.output_width
+        upper = result[sum_width:top]
+        upper_bits = sum_width - top
+        saturated = self._sig(name="sum_saturated", dtype=output_type)
+        if self.signed:
+            sign = result[sum_width - 1]
+            fits = upper._eq(0) | upper._eq(2 ** upper_bits - 1)
+            largest = 2 ** (self.output_width - 1) - 1
+            smallest = 2 ** (self.output_width - 1)
+            If(fits, saturated(result[self.output_width :])).Elif(
+                sign, saturated(smallest)
+            ).Else(saturated(largest))
+        else:
+            If(upper._eq(0), saturated(result[self.output_width :])).Else(
+                saturated(2 ** self.output_width - 1)
+            )
+        return saturated
+
+    def _impl(self):
+        signals = [
+            self.input[self.width * (i + 1) : self.width * i] for i in range(self.inputs)
+        ]
+        shapes = adder_tree_shape(
+            self.inputs, self.width, self.pipeline, self.output_width, self.saturate
+        )
+        valid = iter(valid_chain(self, self.en, self.latency) if self.latency else [])
+
+        for level, shape in enumerate(shapes):
+            level_width = Bits(bit_length=shape["width"], force_vector=True)
+            operands = [
+                self.__extend(signal, shape["width"], f"operand_{level}_{i}")
+                for i, signal in enumerate(signals)
+            ]
+            values = [
+                operands[2 * i] + operands[2 * i + 1] for i in range(shape["adders"])
+            ]
+            # the last signal of an odd level goes to the next one
+            if len(operands) % 2:
+                values.append(operands[-1])
+
+            signals = [
+                self._sig(name=f"sum_{level}_{i}", dtype=level_width)
+                for i in range(shape["signals"])
+            ]
+            if shape["registered"]:
+                self.__register(signals, values, next(valid))
+            else:
+                for signal, value in zip(signals, values):
+                    signal(value)
+
+        result = signals[0]
+        if result._dtype.bit_length() < self.output_width:
+            result = self.__extend(result, self.output_width, "sum_extended")
+        if self.saturate:
+            result = self.__saturated(result)
+        self.output(result[self.output_width :])
+
+
+if __name__ == "__main__":
+    from sys import argv
+    from utils import to_vhdl, get_std_logger
+
+    if len(argv) > 1:
+        path = argv[1]
+
+        get_std_logger()
+        unit = AdderTree(inputs=9, width=16, signed=True, pipeline=2)
+        to_vhdl(unit, path)
+    else:
+        print("file.py <outputpath>")
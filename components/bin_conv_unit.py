@@ -1,29 +1,46 @@
 import logging
 
-from .utils import print_info
+from .utils import print_info, serialize_uniq_by
+from .adder_tree import AdderTree
+from .pipeline import adder_tree_latency
 
-from hwt.code import If
+from hwt.code import Concat
+from hwt.hdl.typeShortcuts import vec
 from hwt.hdl.types.bits import Bits
 from hwt.interfaces.std import Signal, VectSignal
-from hwt.serializer.mode import serializeOnce
 from hwt.synthesizer.unit import Unit
 from hwt.interfaces.utils import propagateClkRst, addClkRst
 
 
-@serializeOnce
+@serialize_uniq_by("layer_id")
 class BinConvUnit(Unit):
     """
     .. hwt-schematic::
     """
 
-    def __init__(self, size=9, width=16, bin_input=False, **kwargs):
+    def __init__(
+        self,
+        size=9,
+        width=16,
+        bin_input=False,
+        lower_output_bit=None,
+        adder_pipeline=0,
+        **kwargs,
+    ):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.width = width
-        self.lower_output_bit = int(width - width / 2)
+        if lower_output_bit is None:
+            lower_output_bit = int(width - width / 2)
+        self.lower_output_bit = lower_output_bit
         # set input and output width
         self.INPUT_WIDTH = 1 if bin_input else self.width
         self.SIGNAL_BIT = self.INPUT_WIDTH - 1
         self.SIZE = size
+        # levels of the adder tree between registers, 0 to a combinational tree
+        self.adder_pipeline = adder_pipeline
+        # bits of the number of input signs that differ from the kernel signs
+        self.COUNT_WIDTH = size.bit_length()
+        self.latency = adder_tree_latency(size, adder_pipeline)
         self.top_entity = False
         print_info(self, **kwargs)
         super().__init__()
@@ -36,39 +53,57 @@ class BinConvUnit(Unit):
         self.output = VectSignal(self.width, signed=True)._m()
         self.kernel_abs = VectSignal(self.width)
         self.kernel_sig = VectSignal(self.SIZE)
+        # popcount of the signs that differ from the kernel, one bit wider in
+        # each level up to the bits of the kernel size
+        self.adder_tree = AdderTree(
+            inputs=self.SIZE,
+            width=1,
+            output_width=self.COUNT_WIDTH,
+            pipeline=self.adder_pipeline,
+            layer_id=self.layer_id,
+            unit_id=self.unit_id,
+            channel_id=self.channel_id,
+            process_id=self.process_id,
+            log_level=self.log_level + 1,
+        )
 
         name = f"BinConvUnitL{self.layer_id}"
         self._name = name
         self._hdl_module_name = name
 
-    def __calc_xor_inputs(self, data_width, kernel):
-        xor_list = [self._sig(name=f"xor_{i}", dtype=data_width) for i in range(9)]
-        const_one = self._sig(name="one", dtype=data_width, def_val=1)
-        for i in range(self.SIZE):
-            If(
-                ~(self.input[self.INPUT_WIDTH * (i + 1) - 1] ^ kernel[i]),
-                xor_list[i](~const_one + const_one),
-            ).Else(xor_list[i](const_one))
-        return xor_list
-
-    def __calc_tree_adders(self, xor_list, signal_width):
-        first_sum = [
-            self._sig(name=f"first_sum_{i}", dtype=signal_width) for i in range(4)
-        ]
-        first_sum[0](xor_list[0] + xor_list[1])
-        first_sum[1](xor_list[2] + xor_list[3])
-        first_sum[2](xor_list[4] + xor_list[5])
-        first_sum[3](xor_list[6] + xor_list[7])
-
-        second_sum = [
-            self._sig(name=f"second_sum_{i}", dtype=signal_width) for i in range(2)
-        ]
-        second_sum[0](first_sum[0] + first_sum[1])
-        second_sum[1](first_sum[2] + first_sum[3])
-
-        third_sum = self._sig(name="third_sum", dtype=signal_width)
-        third_sum(second_sum[0] + second_sum[1] + xor_list[8])
-        return third_sum
+    def __packed_signs(self):
+        # the binary inputs are already a packed vector of signs
+        if self.INPUT_WIDTH == 1:
+            return self.input
+        signs = self._sig(name="signs", dtype=Bits(bit_length=self.SIZE, force_vector=True))
+        signs(
+            Concat(
+                *[
+                    self.input[self.INPUT_WIDTH * (i + 1) - 1]
+                    for i in reversed(range(self.SIZE))
+                ]
+            )
+        )
+        return signs
+
+    def __calc_delta(self, data_width, mismatches):
+        # the sum of the +1/-1 values of the kernel elements is the number of
+        # signs that differ from the kernel minus the number of equal ones,
+        # en_mult marks the valid windows of the input
+        if self.latency:
+            self.adder_tree.en(self.en_mult)
+        self.adder_tree.input(mismatches)
+        count = self.adder_tree.output
+        padding = self.width - self.COUNT_WIDTH - 1
+        if padding > 0:
+            count = Concat(vec(0, padding), count)
+        elif padding < 0:
+            count = count[self.width - 1 :]
+        doubled = self._sig(name="doubled", dtype=Bits(bit_length=self.width))
+        doubled(Concat(count, vec(0, 1)))
+        delta = self._sig(name="delta", dtype=data_width)
+        delta(doubled - self.SIZE)
+        return delta
 
     def _impl(self):
         propagateClkRst(self)
@@ -76,20 +111,21 @@ class BinConvUnit(Unit):
         bit_adders_width = Bits(bit_length=self.width, signed=True)
         mult_width = Bits(bit_length=2 * self.width, signed=True)
         # declaring registers
-        delta = self._sig(name="delta", dtype=bit_adders_width)
         mult = self._sig(name="mult", dtype=bit_adders_width)
         # declaring kernel constant
         kernel = self.kernel_abs
         # declaring signal casting multiplication
         cast = self._sig(name="cast_mult", dtype=mult_width)
 
-        xor_list = self.__calc_xor_inputs(bit_adders_width, self.kernel_sig)
-        tree_adders_result = self.__calc_tree_adders(xor_list, bit_adders_width)
+        mismatches = self._sig(
+            name="mismatches", dtype=Bits(bit_length=self.SIZE, force_vector=True)
+        )
+        mismatches(self.__packed_signs() ^ self.kernel_sig)
+        delta = self.__calc_delta(bit_adders_width, mismatches)
 
         signed_kernel = kernel._convSign(True)
         cast(delta * signed_kernel)
         # resized_cast = cast[self.lower_output_bit + self.width : self.lower_output_bit]
-        delta(tree_adders_result)
         mult[self.width - 1](cast[2 * self.width - 1])
         mult[self.width - 1 : 0](
             cast[self.lower_output_bit + self.width - 1 : self.lower_output_bit]
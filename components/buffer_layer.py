@@ -0,0 +1,234 @@
+import logging
+
+from .utils import print_info
+
+from hwt.code import If
+from hwt.hdl.types.bits import Bits
+from hwt.interfaces.std import Signal, VectSignal
+from hwt.synthesizer.unit import Unit
+
+
+def buffer_layer_padding(size=3, stride=1):
+    """
+    This function returns the zero columns streamed after each row of the
+    feature map of a buffer layer and the zero rows streamed after its last
+    row: the rows and columns of a window after its center, so the window
+    of each pixel of the zero padded feature map ends in a pixel of the
+    stream. The windows of the max pool layers (with a stride) are inside
+    the feature map and have no padding.
+    """
+    return (size - 1) // 2 if stride == 1 else 0
+
+
+class BufferLayer(Unit):
+    """
+    .. hwt-schematic::
+    """
+
+    def __init__(
+        self,
+        width=16,
+        channels=0,
+        image_width=416,
+        image_height=None,
+        size=3,
+        stride=1,
+        binary=False,
+        **kwargs,
+    ):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.width = width if not binary else 1
+        self.channels = channels
+        # pixels of each row and rows of the streamed feature map, a square
+        # feature map unless its height is given
+        self.image_width = image_width
+        self.image_height = image_width if image_height is None else image_height
+        # the windows are size x size, each one of the size - 1 previous rows
+        # is kept in a line memory
+        self.size = size
+        # with a stride, valid is only set for the windows inside the stream
+        # whose first row and column are multiples of the stride (the 2x2
+        # windows of a max pool do not overlap)
+        self.stride = stride
+        self.binary = binary
+        self.pixel_width = self.width * self.channels
+        # each row of the stream has the zero columns of the padding after the
+        # pixels of the feature map, and each frame its zero rows after the
+        # rows of the feature map (the pixels of the stream in these columns
+        # and rows are replaced by zeros, so they only need an enable)
+        self.padding = buffer_layer_padding(size, stride)
+        self.row_length = image_width + self.padding
+        self.frame_rows = self.image_height + self.padding
+        self.column_width = max(self.row_length - 1, 1).bit_length()
+        self.row_width = max(self.frame_rows - 1, 1).bit_length()
+        # the window is registered, it is read one cycle after its last pixel
+        self.latency = 1
+        self.top_entity = False
+        print_info(self, **kwargs)
+        super().__init__()
+
+    def _declr(self):
+        self.clk = Signal()
+        self.rst = Signal()
+        self.en = Signal()
+        self.input = VectSignal(self.pixel_width)
+        self.output = VectSignal(self.size ** 2 * self.pixel_width)._m()
+        self.valid = Signal()._m()
+
+        name = f"BufferLayerL{self.layer_id}"
+        self._name = name
+        self._hdl_module_name = name
+
+    def __register(self, *statements):
+        If(self.rst, *[signal(0) for signal, _ in statements]).Else(
+            If(
+                self.clk._onRisingEdge(),
+                *[signal(value) for signal, value in statements],
+            )
+        )
+
+    def __line_taps(self, column, row, pixel_in):
+        # one line memory per previous row: line_0 keeps the last row, each
+        # one shifts its pixel at the current column to the next one
+        pixel = Bits(bit_length=self.pixel_width, force_vector=True)
+        lines = [
+            self._sig(name=f"line_{i}", dtype=pixel[self.row_length])
+            for i in range(self.size - 1)
+        ]
+        writes = [lines[0][column](pixel_in)]
+        writes += [lines[i][column](lines[i - 1][column]) for i in range(1, len(lines))]
+        If(self.clk._onRisingEdge(), If(self.en, *writes))
+
+        # the taps of rows before the first one of the frame are zero
+        taps = []
+        for r in range(self.size - 1):
+            tap = self._sig(name=f"tap_{r}", dtype=pixel)
+            line = self.size - 2 - r
+            If(row > line, tap(lines[line][column])).Else(tap(0))
+            taps.append(tap)
+        taps.append(pixel_in)
+        return taps
+
+    def __on_stride(self, column, row, last_column, last_row):
+        # the phases are zero in the rows and columns of the windows on the
+        # stride grid, starting with the first window inside each frame
+        start = -(self.size - 1) % self.stride
+        phase_width = Bits(bit_length=max(self.stride - 1, 1).bit_length(), force_vector=True)
+        row_phase = self._sig(name="row_phase", dtype=phase_width)
+        column_phase = self._sig(name="column_phase", dtype=phase_width)
+
+        def step(phase):
+            return If(phase._eq(self.stride - 1), phase(0)).Else(phase(phase + 1))
+
+        If(self.rst, row_phase(start), column_phase(start)).Else(
+            If(
+                self.clk._onRisingEdge(),
+                If(
+                    self.en,
+                    If(
+                        last_column,
+                        column_phase(start),
+                        If(last_row, row_phase(start)).Else(step(row_phase)),
+                    ).Else(step(column_phase)),
+                ),
+            )
+        )
+        on_stride = row_phase._eq(0) & column_phase._eq(0)
+        if self.size > 1:
+            on_stride = on_stride & (row >= self.size - 1) & (column >= self.size - 1)
+        return on_stride
+
+    def _impl(self):
+        size = self.size
+        pixel = Bits(bit_length=self.pixel_width, force_vector=True)
+        window = [
+            [self._sig(name=f"window_{r}_{c}", dtype=pixel) for c in range(size)]
+            for r in range(size)
+        ]
+        if size > 1 or self.stride > 1:
+            column = self._sig(
+                name="column", dtype=Bits(bit_length=self.column_width, force_vector=True)
+            )
+            row = self._sig(name="row", dtype=Bits(bit_length=self.row_width, force_vector=True))
+            last_column = column._eq(self.row_length - 1)
+            last_row = row._eq(self.frame_rows - 1)
+            If(self.rst, column(0), row(0)).Else(
+                If(
+                    self.clk._onRisingEdge(),
+                    If(
+                        self.en,
+                        If(
+                            last_column,
+                            column(0),
+                            If(last_row, row(0)).Else(row(row + 1)),
+                        ).Else(column(column + 1)),
+                    ),
+                )
+            )
+
+        pixel_in = self.input
+        if self.padding:
+            # the columns and rows of the padding are zero
+            pixel_in = self._sig(name="pixel_in", dtype=pixel)
+            inside = (column < self.image_width) & (row < self.image_height)
+            If(inside, pixel_in(self.input)).Else(pixel_in(0))
+
+        if size > 1:
+            new_column = column._eq(0)
+            taps = self.__line_taps(column, row, pixel_in)
+        else:
+            new_column = None
+            taps = [pixel_in]
+
+        # the windows of the stride grid, or the ones that end after the
+        # first columns and rows of the padding (the windows whose center
+        # is a pixel of the feature map)
+        valid_window = self.en
+        if self.stride > 1:
+            valid_window = self.en & self.__on_stride(column, row, last_column, last_row)
+        elif self.padding:
+            valid_window = self.en & (row >= self.padding) & (column >= self.padding)
+        valid = self._sig(name="valid_reg")
+        self.__register((valid, valid_window))
+        self.valid(valid)
+
+        # the window shifts one column to the left for each pixel, the
+        # columns of the previous row are cleared at the start of a row
+        registers = [signal for row in window for signal in row]
+        shift = []
+        for r in range(size):
+            shift += [window[r][c](window[r][c + 1]) for c in range(size - 1)]
+            shift.append(window[r][size - 1](taps[r]))
+        if new_column is not None:
+            clear = []
+            for r in range(size):
+                clear += [window[r][c](0) for c in range(size - 1)]
+                clear.append(window[r][size - 1](taps[r]))
+            shift = [If(new_column, *clear).Else(*shift)]
+        If(self.rst, *[signal(0) for signal in registers]).Else(
+            If(self.clk._onRisingEdge(), If(self.en, *shift))
+        )
+
+        # channel j of the output has the size x size elements of its window
+        # in row major order, as the input of a ConvLayer
+        for j in range(self.channels):
+            for r in range(size):
+                for c in range(size):
+                    i = j * size ** 2 + r * size + c
+                    self.output[(i + 1) * self.width : i * self.width](
+                        window[r][c][(j + 1) * self.width : j * self.width]
+                    )
+
+
+if __name__ == "__main__":
+    from sys import argv
+    from utils import to_vhdl, get_std_logger
+
+    if len(argv) > 1:
+        path = argv[1]
+
+        get_std_logger()
+        unit = BufferLayer(width=16, channels=3, image_width=416, size=3)
+        to_vhdl(unit, path)
+    else:
+        print("file.py <outputpath>")
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from .weight_store import resolve_weight_slices
+
+MANIFEST_FILE = "manifest.json"
+
+
+def generator_version():
+    """
+    This function returns a hash of the source code of the components
+    package, so any change in the generators invalidates the built files.
+    """
+    package_path = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for file_name in sorted(os.listdir(package_path)):
+        if file_name.endswith(".py"):
+            digest.update(file_name.encode())
+            with open(os.path.join(package_path, file_name), "rb") as source:
+                digest.update(source.read())
+    return digest.hexdigest()
+
+
+def _qualified_name(obj):
+    return f"{obj.__module__}.{obj.__qualname__}"
+
+
+def _update_digest(digest, value):
+    # arrays and lists of floats are hashed by content, everything else by its
+    # json representation
+    if isinstance(value, np.ndarray) or (
+        isinstance(value, list) and value and isinstance(value[0], float)
+    ):
+        digest.update(np.ascontiguousarray(value, dtype=np.float64).tobytes())
+    elif isinstance(value, type) or hasattr(value, "__qualname__"):
+        digest.update(_qualified_name(value).encode())
+    elif callable(value):
+        # instances of convert classes are hashed by their class and options
+        digest.update(_qualified_name(type(value)).encode())
+        digest.update(json.dumps(vars(value), sort_keys=True, default=str).encode())
+    else:
+        digest.update(json.dumps(value, sort_keys=True, default=str).encode())
+
+
+class BuildManifest:
+    """
+    Record of the jobs built in the output path. Each job is identified by
+    its output path and file name and stores a hash of its class, args,
+    weight slices, converter function and generator version, together with
+    the file written by the converter.
+    """
+
+    def __init__(self, output_path="."):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.file_path = f"{output_path}/{MANIFEST_FILE}"
+        self.version = generator_version()
+        self.jobs = {}
+
+        if os.path.exists(self.file_path):
+            with open(self.file_path) as stream:
+                self.jobs = json.load(stream).get("jobs", {})
+
+    def job_key(self, layer):
+        return f"{layer['path']}/{layer['filename']}"
+
+    def job_hash(self, layer, convert_function):
+        digest = hashlib.sha256()
+        digest.update(self.version.encode())
+        _update_digest(digest, layer["class"])
+        _update_digest(digest, convert_function)
+        _update_digest(digest, [layer["path"], layer["filename"]])
+
+        args = dict(layer["args"])
+        if "weights_store" in args:
+            # hash the weights of the part instead of the weights store path
+            args.update(
+                resolve_weight_slices(
+                    args.pop("weights_store"),
+                    args.pop("weights_slice"),
+                    args.pop("variables_slice"),
+                )
+            )
+        for name in sorted(args):
+            digest.update(name.encode())
+            _update_digest(digest, args[name])
+        return digest.hexdigest()
+
+    def is_up_to_date(self, layer, job_hash):
+        job = self.jobs.get(self.job_key(layer))
+        if job is None or job["hash"] != job_hash:
+            return False
+        return os.path.exists(job["file"])
+
+    def update(self, layer, job_hash, file):
+        self.jobs[self.job_key(layer)] = {"hash": job_hash, "file": file}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        temp_file_path = f"{self.file_path}.tmp"
+        with open(temp_file_path, "w") as stream:
+            json.dump({"version": self.version, "jobs": self.jobs}, stream, indent=2)
+        os.replace(temp_file_path, self.file_path)
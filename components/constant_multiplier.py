@@ -0,0 +1,168 @@
+import logging
+
+from .utils import print_info, serialize_uniq_by
+from .adder_tree import AdderTree, valid_chain
+from .pipeline import adder_tree_latency, constant_multiplier_terms
+
+from hwt.code import Concat, If
+from hwt.hdl.typeShortcuts import vec
+from hwt.hdl.types.bits import Bits
+from hwt.interfaces.std import Signal, VectSignal
+from hwt.synthesizer.unit import Unit
+
+
+@serialize_uniq_by("coefficient", "width", "lower_output_bit", "adder_pipeline", "latency")
+class ConstantMultiplier(Unit):
+    """
+    .. hwt-schematic::
+    """
+
+    def __init__(
+        self,
+        coefficient=0,
+        width=16,
+        lower_output_bit=None,
+        adder_pipeline=0,
+        latency=0,
+        **kwargs,
+    ):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.coefficient = coefficient
+        self.width = width
+        if lower_output_bit is None:
+            lower_output_bit = int(width - width / 2)
+        self.lower_output_bit = lower_output_bit
+        self.adder_pipeline = adder_pipeline
+        # the bits of the products below the last output bit
+        self.term_width = lower_output_bit + width - 1
+        self.terms = constant_multiplier_terms(coefficient, width, lower_output_bit)
+        # the negative terms are inverted and one is added for each of them
+        self.n_negative = sum(1 for _, digit in self.terms if digit < 0)
+        self.tree_inputs = len(self.terms) + (1 if self.n_negative else 0)
+        # clock cycles of the adder tree and of the registers that delay its
+        # result to the latency of the other multipliers of the unit
+        self.tree_latency = adder_tree_latency(self.tree_inputs, adder_pipeline)
+        self.latency = max(latency, self.tree_latency)
+        self.top_entity = False
+
+        print_info(self, **kwargs)
+        super().__init__()
+
+    def _declr(self):
+        self.clk = Signal()
+        self.rst = Signal()
+        if self.latency:
+            # the operand is valid, the registers load it through the pipeline
+            self.en = Signal()
+        self.param_a = VectSignal(self.width)
+        self.product = VectSignal(self.width)._m()
+
+        if self.tree_inputs > 1:
+            self.adder_tree = AdderTree(
+                inputs=self.tree_inputs,
+                width=self.term_width,
+                output_width=self.term_width,
+                pipeline=self.adder_pipeline,
+                layer_id=self.layer_id,
+                unit_id=self.unit_id,
+                channel_id=self.channel_id,
+                process_id=self.process_id,
+                log_level=self.log_level + 1,
+            )
+
+        name = f"ConstantMultiplierL{self.layer_id}W{self.width}C{self.coefficient}"
+        if self.latency:
+            name += f"D{self.latency}"
+        self._name = name
+        self._hdl_module_name = name
+
+    def __shifted(self, data_a, shift):
+        # data_a shifted to the left and truncated to the width of the terms
+        bits = min(self.width - 1, self.term_width - shift)
+        parts = [data_a[bits:]]
+        if shift:
+            parts.append(vec(0, shift))
+        if self.term_width - shift > bits:
+            parts.insert(0, vec(0, self.term_width - shift - bits))
+        return Concat(*parts)
+
+    def _impl(self):
+        term_type = Bits(bit_length=self.term_width, force_vector=True)
+        data_a = self._sig(name="data_a", dtype=Bits(self.width - 1, force_vector=True))
+        non_zero_a = self._sig(name="non_zero_a", dtype=Bits(1))
+        data_a(self.param_a[self.width - 1 :])
+        If(data_a._eq(0), non_zero_a(0)).Else(non_zero_a(1))
+
+        terms = []
+        for i, (shift, digit) in enumerate(self.terms):
+            term = self._sig(name=f"term_{i}", dtype=term_type)
+            shifted = self.__shifted(data_a, shift)
+            term(shifted if digit > 0 else ~shifted)
+            terms.append(term)
+        if self.n_negative:
+            terms.append(vec(self.n_negative, self.term_width))
+
+        # valid bits of the registers of the tree, of the delay and of the sign
+        valid = valid_chain(self, self.en, self.latency) if self.latency else []
+        sum_terms = self._sig(name="sum_terms", dtype=term_type)
+        if self.tree_inputs > 1:
+            if self.tree_latency:
+                self.adder_tree.clk(self.clk)
+                self.adder_tree.rst(self.rst)
+                self.adder_tree.en(self.en)
+            self.adder_tree.input(Concat(*reversed(terms)))
+            sum_terms(self.adder_tree.output)
+        elif terms:
+            # a power of two is only a shift of the input
+            sum_terms(terms[0])
+        else:
+            sum_terms(0)
+
+        for i in range(self.latency - self.tree_latency):
+            delay_reg = self._sig(name=f"delay_reg_{i}", dtype=term_type)
+            If(self.rst, delay_reg(0)).Else(
+                If(
+                    self.clk._onRisingEdge(),
+                    If(valid[self.tree_latency + i], delay_reg(sum_terms)),
+                )
+            )
+            sum_terms = delay_reg
+
+        # the sign of the constant is known, the product is zero when one of
+        # the magnitudes is zero
+        data_b = self.coefficient & (2 ** (self.width - 1) - 1)
+        sign_b = (self.coefficient >> (self.width - 1)) & 1
+        if data_b == 0:
+            sign = vec(0, 1)
+        elif sign_b:
+            sign = ~self.param_a[self.width - 1] & non_zero_a
+        else:
+            sign = self.param_a[self.width - 1] & non_zero_a
+        # the sign waits for the registers of the adder tree
+        for i in range(self.latency):
+            sign_reg = self._sig(name=f"sign_reg_{i}", dtype=Bits(1))
+            If(self.rst, sign_reg(0)).Else(
+                If(self.clk._onRisingEdge(), If(valid[i], sign_reg(sign)))
+            )
+            sign = sign_reg
+
+        self.product(
+            Concat(
+                sign,
+                sum_terms[self.lower_output_bit + self.width - 1 : self.lower_output_bit],
+            )
+        )
+
+
+if __name__ == "__main__":
+    from sys import argv
+    from utils import to_vhdl, get_std_logger
+
+    if len(argv) > 1:
+        path = argv[1]
+
+        get_std_logger()
+        unit = ConstantMultiplier(coefficient=0x0d5a, width=16)
+        to_vhdl(unit, path)
+    else:
+        print("file.py <outputpath>")
@@ -1,16 +1,120 @@
 import logging
-from math import sqrt
 
-from .utils import print_info, float2fixed
+from .utils import (
+    fixed_point_format,
+    memory_words,
+    print_info,
+    prune_conv_kernels,
+    quantize_conv_weights,
+    winograd_kernels,
+)
+from .bin_conv_unit import BinConvUnit
+from .kernel_rom import KernelRom
 from .multi_channel_conv_unit import MultiChannelConvUnit
+from .pipeline import adder_tree_latency, kernel_rom_latency, multi_channel_conv_unit_latency
+from .weight_memory import WeightMemory
 
+from hwt.code import Concat, If
 from hwt.interfaces.std import Signal, VectSignal
 from hwt.synthesizer.unit import Unit
 from hwt.hdl.types.bits import Bits
+from hwt.hdl.typeShortcuts import vec
 from hwt.synthesizer.hObjList import HObjList
 from hwt.interfaces.utils import propagateClkRst, addClkRst
 
 
+# bits of the data bus of the avalon slave of the weight memories
+WEIGHTS_DATA_WIDTH = 32
+
+
+def coefficient_layout(
+    size=3,
+    width=16,
+    channels=3,
+    filters=16,
+    binary=False,
+    parallelism=1,
+    adder_pipeline=0,
+    fold_batch_norm=False,
+    multiplier_latency=None,
+    winograd=False,
+    filter_folding=1,
+    **kwargs,
+):
+    """
+    This function returns the coefficients read by each stage of the pipeline
+    of a part of a conv layer, from the args of the layer: a sorted list of
+    (cycles, fields), each field with its unit, port, codes (the name of
+    their array in the part and their index) and bits. The unit i reads the
+    filters i, i + units, ... of the part: the kernels with the input
+    window, the kernel_abs of the binary units after their adder tree and
+    ssi and bn with the output (all of them in the first stage when the
+    filters are not folded).
+    """
+    window = size * size
+    winograd = winograd and not binary and size == 3
+    fold_batch_norm = fold_batch_norm and not binary
+    filters = int(filters / parallelism)
+    units = int(filters / filter_folding)
+    latency = multi_channel_conv_unit_latency(
+        channels, window, binary, adder_pipeline, multiplier_latency, winograd
+    )
+    tree_latency = adder_tree_latency(window, adder_pipeline)
+    kernel_width = width + 4 if winograd else width
+    kernel_window = 16 if winograd else window
+    stages = {}
+
+    def add(cycles, *field):
+        stages.setdefault(cycles if filter_folding > 1 else 0, []).append(field)
+
+    for i in range(units):
+        unit_filters = list(range(i, filters, units))
+        if not fold_batch_norm:
+            add(latency, i, "ssi_coef", "ssi_codes", (unit_filters,), width)
+        add(latency, i, "bn_coef", "bn_codes", (unit_filters,), width)
+        for j in range(channels):
+            if binary:
+                add(0, i, f"kernel_sig_{j}", "kernel_sig_codes", (unit_filters, j), window)
+                add(tree_latency, i, f"kernel_abs_{j}", "kernel_codes", (unit_filters, j, 0), width)
+                continue
+            for k in range(kernel_window):
+                port = f"kernel_{j*kernel_window+k}"
+                add(0, i, port, "kernel_codes", (unit_filters, j, k), kernel_width)
+    return sorted(stages.items())
+
+
+def weight_memory_map(filter_folding=1, parallelism=1, top_entity=False, **kwargs):
+    """
+    This function returns the address map of the avalon slave of the weight
+    memories of a conv layer, from the args of the layer: one memory for each
+    stage of coefficient_layout, with a word for each filter select written
+    in beats of WEIGHTS_DATA_WIDTH bits. The address of a beat has the index
+    of the memory, the filter select and the beat, from the most significant
+    bits, and the top entity of the layer adds the index of the part above
+    them.
+    """
+    layout = coefficient_layout(filter_folding=filter_folding, parallelism=parallelism, **kwargs)
+    select_width = (filter_folding - 1).bit_length()
+    memories = []
+    for cycles, fields in layout:
+        width = sum(field[-1] for field in fields)
+        beats = -(-width // WEIGHTS_DATA_WIDTH)
+        memories.append(
+            {"stage": cycles, "width": width, "beats": beats, "beat_width": (beats - 1).bit_length()}
+        )
+    memory_width = max(max(select_width + memory["beat_width"] for memory in memories), 1)
+    part_width = memory_width + (len(memories) - 1).bit_length()
+    address_width = part_width
+    if top_entity:
+        address_width += (parallelism - 1).bit_length()
+    return {
+        "memories": memories,
+        "memory_width": memory_width,
+        "part_width": part_width,
+        "address_width": address_width,
+    }
+
+
 class ConvLayer(Unit):
     """
     .. hwt-schematic::
@@ -32,13 +136,81 @@ class ConvLayer(Unit):
         variance=[],
         top_entity=False,
         parallelism=1,
+        integer_portion=None,
+        decimal_portion=None,
+        adder_pipeline=0,
+        constant_kernels=False,
+        prune_kernels=False,
+        fold_batch_norm=False,
+        multiplier_latency=None,
+        winograd=False,
+        filter_folding=1,
+        kernel_rom=False,
+        weight_memory=False,
+        input_format=None,
         **kwargs,
     ):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.size = size * size
+        # the 3x3 non binary layers may take 4x4 tiles of the feature map and
+        # give the 2x2 outputs of each filter with Winograd units, their
+        # kernels are always driven into the kernel ports
+        self.winograd = winograd and not binary and size == 3
+        self.window = 16 if self.winograd else self.size
+        self.tile = 4 if self.winograd else 1
         self.channels = channels
         self.filters = filters
+        # each multi channel conv unit computes filter_folding filters of the
+        # part in sequence, filter_select chooses the filters of each window
+        # and their coefficients are read from roms
+        self.filter_folding = filter_folding
+        self.units = int(filters / filter_folding)
+        self.select_width = (filter_folding - 1).bit_length()
         self.width = width
+        # fixed point format chosen by the parser for this layer, the units
+        # keep their default lower output bit without it
+        self.integer_portion = integer_portion
+        self.decimal_portion = decimal_portion
+        # format (width, integer_portion, decimal_portion) of the input codes
+        # when the previous conv layer has another one, the parts shift and
+        # saturate each input code to the format of this layer
+        if decimal_portion is None:
+            integer_portion, decimal_portion = fixed_point_format(width)
+        self.input_format = None
+        if input_format is not None and not bin_input:
+            if tuple(input_format) != (width, integer_portion, decimal_portion):
+                self.input_format = tuple(input_format)
+        self.input_shift = 0
+        if self.input_format is not None:
+            self.input_shift = decimal_portion - self.input_format[2]
+        # levels of the adder trees of the units between registers
+        self.adder_pipeline = adder_pipeline
+        # the kernels of the non binary layers are elaborated in constant
+        # multipliers instead of being driven into the kernel ports
+        folded = filter_folding > 1
+        self.constant_kernels = constant_kernels and not binary and not self.winograd and not folded
+        # the conv units with zero kernels are removed and the binary ones
+        # with the same kernels are shared by the filters of the part
+        self.prune_kernels = prune_kernels and not self.winograd and not folded
+        # the coefficients of the part are read from WeightMemories written
+        # by the host through an avalon slave
+        self.weight_memory = weight_memory and not self.constant_kernels and not self.prune_kernels
+        # or from KernelRoms, whose words are written in initialization files
+        # instead of constants
+        kernel_rom = kernel_rom and not weight_memory
+        self.kernel_rom = kernel_rom and not self.constant_kernels and not self.prune_kernels
+        # the ssi coefficients of the non binary layers are folded into their
+        # kernels, removing the batch normalization multipliers
+        self.fold_batch_norm = fold_batch_norm and not binary
+        # the same multiplier latency for all the units of the layer, the
+        # constant multipliers of each unit depend on its kernels otherwise
+        self.multiplier_latency = multiplier_latency
+        # clock cycles from the input windows to the output of the filters
+        self.units_latency = multi_channel_conv_unit_latency(
+            channels, self.size, binary, adder_pipeline, multiplier_latency, self.winograd
+        )
+        self.rom_latency = kernel_rom_latency(self.kernel_rom, self.weight_memory)
+        self.latency = self.units_latency + self.rom_latency
         self.binary = binary
         self.bin_input = bin_input
         self.bin_output = bin_output
@@ -49,9 +221,31 @@ class ConvLayer(Unit):
         self.mean = mean
         self.scale = scale
         self.variance = variance
+        # the parts read their coefficients from roms or memories in the
+        # stages of the layout, with the address map of the memories
+        self.coefficient_memories = bool(self.select_width or self.kernel_rom or self.weight_memory)
+        layout_args = {
+            "size": size,
+            "width": width,
+            "channels": channels,
+            "filters": filters,
+            "binary": binary,
+            "parallelism": parallelism,
+            "adder_pipeline": adder_pipeline,
+            "fold_batch_norm": fold_batch_norm,
+            "multiplier_latency": multiplier_latency,
+            "winograd": winograd,
+            "filter_folding": filter_folding,
+        }
+        if not top_entity and self.coefficient_memories:
+            self.layout = coefficient_layout(**layout_args)
+        if self.weight_memory:
+            self.memory_map = weight_memory_map(top_entity=top_entity, **layout_args)
 
         # set input and output width
         self.INPUT_WIDTH = 1 if bin_input else self.width
+        if self.input_format is not None:
+            self.INPUT_WIDTH = self.input_format[0]
         self.OUTPUT_WIDTH = 1 if bin_output else self.width
 
         print_info(self, **kwargs)
@@ -59,21 +253,31 @@ class ConvLayer(Unit):
 
     def _declr(self):
         addClkRst(self)
+        self.en_window = Signal()
         self.en_mult = Signal()
         self.en_sum = Signal()
         self.en_channel = Signal()
         self.en_batch = Signal()
         self.en_act = Signal()
-        self.input = VectSignal(self.size * self.channels * self.INPUT_WIDTH)
-        self.output = VectSignal(self.filters * self.OUTPUT_WIDTH)._m()
+        self.input = VectSignal(self.window * self.channels * self.INPUT_WIDTH)
+        self.output = VectSignal(self.units * self.tile * self.OUTPUT_WIDTH)._m()
+        if self.select_width:
+            self.filter_select = VectSignal(self.select_width)
+        if self.weight_memory:
+            # write only avalon slave of the weight memories
+            self.avs_weights_address = VectSignal(self.memory_map["address_width"])
+            self.avs_weights_write = Signal()
+            self.avs_weights_writedata = VectSignal(WEIGHTS_DATA_WIDTH)
 
         if self.top_entity:
-            output_width = int(self.filters / self.parallelism) * self.OUTPUT_WIDTH
+            output_width = int(self.units / self.parallelism) * self.tile * self.OUTPUT_WIDTH
             # instantiate empty ConvLayerPart
             self.conv_layer_part = HObjList(
                 ConvLayerPart(
-                    input_width=self.size * self.channels * self.INPUT_WIDTH,
+                    input_width=self.window * self.channels * self.INPUT_WIDTH,
                     output_width=output_width,
+                    select_width=self.select_width,
+                    weights_address_width=self.memory_map["part_width"] if self.weight_memory else 0,
                     layer_id=self.layer_id,
                     process_id=i,
                     log_level=0,
@@ -82,12 +286,24 @@ class ConvLayer(Unit):
             )
             name = f"ConvLayerL{self.layer_id}"
         else:
+            # convert all the weights of this part to fixed point at once
+            self.__quantize_weights()
+            if self.prune_kernels:
+                self.__prune_kernels()
             # instantiate dynamically multichannel units
             self.conv_layer_part = HObjList(
                 MultiChannelConvUnit(
                     layer_id=self.layer_id,
                     unit_id=i,
                     width=self.width,
+                    lower_output_bit=self.decimal_portion,
+                    adder_pipeline=self.adder_pipeline,
+                    kernels=self.kernel_codes[i].tolist() if self.constant_kernels else None,
+                    active_channels=self.active_channels[i],
+                    shared_units=self.prune_kernels and self.binary,
+                    fold_batch_norm=self.fold_batch_norm,
+                    multiplier_latency=self.multiplier_latency,
+                    winograd=self.winograd,
                     channels=self.channels,
                     binary=self.binary,
                     size=self.size,
@@ -96,89 +312,308 @@ class ConvLayer(Unit):
                     process_id=self.process_id,
                     log_level=self.log_level + 1,
                 )
-                for i in range(self.filters)
+                for i in range(self.units)
             )
+            if self.coefficient_memories:
+                self.coefficient_stages = self.__coefficient_stages()
+            if self.weight_memory:
+                self.weight_memories = HObjList(
+                    WeightMemory(
+                        words=memory_words([(codes, bits) for _, _, codes, bits in fields]),
+                        width=sum(bits for _, _, _, bits in fields),
+                        stage=cycles,
+                        data_width=WEIGHTS_DATA_WIDTH,
+                        layer_id=self.layer_id,
+                        process_id=self.process_id,
+                        log_level=self.log_level + 1,
+                    )
+                    for cycles, fields in self.coefficient_stages
+                )
+            if self.kernel_rom:
+                self.kernel_roms = HObjList(
+                    KernelRom(
+                        words=memory_words([(codes, bits) for _, _, codes, bits in fields]),
+                        width=sum(bits for _, _, _, bits in fields),
+                        stage=cycles,
+                        layer_id=self.layer_id,
+                        process_id=self.process_id,
+                        log_level=self.log_level + 1,
+                    )
+                    for cycles, fields in self.coefficient_stages
+                )
             name = f"ConvLayerL{self.layer_id}P{self.process_id}"
         self._hdl_module_name = name
         self._name = name
 
+    def __quantize_weights(self):
+        codes = quantize_conv_weights(
+            weights=self.weights,
+            biases=self.biases,
+            mean=self.mean,
+            scale=self.scale,
+            variance=self.variance,
+            filters=self.filters,
+            channels=self.channels,
+            size=self.size,
+            width=self.width,
+            binary=self.binary,
+            integer_portion=self.integer_portion,
+            decimal_portion=self.decimal_portion,
+            fold_batch_norm=self.fold_batch_norm,
+        )
+        self.ssi_codes = codes["ssi"]
+        self.bn_codes = codes["bn"]
+        self.kernel_codes = codes["kernel"]
+        # the sign of the first weight is the most significant bit
+        self.kernel_sig_codes = codes["kernel_sig"]
+        if self.winograd:
+            # the kernels are transformed at the generation of the part
+            self.kernel_codes = winograd_kernels(self.kernel_codes, self.width)
+        self.active_channels = [range(self.channels)] * self.filters
+
+    def __prune_kernels(self):
+        self.pruning = prune_conv_kernels(
+            {"kernel": self.kernel_codes, "kernel_sig": self.kernel_sig_codes},
+            binary=self.binary,
+            width=self.width,
+        )
+        self.active_channels = self.pruning["active"]
+        self.logger.info(
+            f"Layer {self.layer_id} part {self.process_id}: "
+            f"{self.pruning['zero']} zero and {self.pruning['duplicate']} duplicate "
+            f"conv units removed of {self.pruning['total']}"
+        )
+        if self.binary:
+            # the binary conv units of the part, shared by the filters
+            self.shared_units = HObjList(
+                BinConvUnit(
+                    layer_id=self.layer_id,
+                    unit_id=i,
+                    channel_id=j,
+                    bin_input=self.bin_input,
+                    width=self.width,
+                    size=self.size,
+                    lower_output_bit=self.decimal_portion,
+                    adder_pipeline=self.adder_pipeline,
+                    process_id=self.process_id,
+                    log_level=self.log_level + 1,
+                )
+                for i, j in self.pruning["units"]
+            )
+
+    def __map_shared_units(self):
+        channel_width = self.size * self.INPUT_WIDTH
+        for (i, j), unit in zip(self.pruning["units"], self.shared_units):
+            unit.en_mult(self.en_mult)
+            unit.en_sum(self.en_sum)
+            unit.input(self.input[(j + 1) * channel_width : j * channel_width])
+            unit.kernel_abs(int(self.kernel_codes[i, j, 0]))
+            unit.kernel_sig(int(self.kernel_sig_codes[i, j]))
+
+    def __filter_select(self, cycles):
+        # filter_select delayed to a stage of the pipeline, all the windows
+        # go through one stage each cycle
+        selects = self.filter_selects
+        while len(selects) <= cycles:
+            delay = self._sig(
+                name=f"filter_select_{len(selects)}",
+                dtype=Bits(bit_length=self.select_width, force_vector=True),
+            )
+            If(self.rst, delay(0)).Else(If(self.clk._onRisingEdge(), delay(selects[-1])))
+            selects.append(delay)
+        return selects[cycles]
+
+    def __coefficient_stages(self):
+        # the codes of the fields of each stage of the layout of the part
+        return [
+            (
+                cycles,
+                [(i, port, getattr(self, codes)[index], bits) for i, port, codes, index, bits in fields],
+            )
+            for cycles, fields in self.layout
+        ]
+
+    def __map_weight_memories(self):
+        # the index of each memory is above its write address, the writes to
+        # the addresses out of a memory are ignored
+        memory_width = self.memory_map["memory_width"]
+        address = self.avs_weights_address
+        for k, memory in enumerate(self.weight_memories):
+            write = self.avs_weights_write
+            if len(self.weight_memories) > 1:
+                write = write & address[self.memory_map["part_width"] : memory_width]._eq(k)
+            if memory.write_address_width < memory_width:
+                write = write & address[memory_width : memory.write_address_width]._eq(0)
+            memory.write(write)
+            memory.write_address(address[memory.write_address_width : 0])
+            memory.write_data(self.avs_weights_writedata)
+
+    def weight_words(self):
+        """
+        This function returns the words of the weight memories of the part in
+        the order of their addresses (see weight_memory_map), zero out of the
+        memories, so the host loads the weights of the part writing them in
+        one burst through its avalon slave.
+        """
+        import numpy as np
+
+        self.__quantize_weights()
+        mask = 2 ** WEIGHTS_DATA_WIDTH - 1
+        words = np.zeros(2 ** self.memory_map["part_width"], dtype=np.uint32)
+        stages = zip(self.__coefficient_stages(), self.memory_map["memories"])
+        for k, ((_, fields), memory) in enumerate(stages):
+            base = k << self.memory_map["memory_width"]
+            for select, word in enumerate(memory_words([(codes, bits) for _, _, codes, bits in fields])):
+                value = int(word, 16)
+                for beat in range(memory["beats"]):
+                    address = base + (select << memory["beat_width"]) + beat
+                    words[address] = (value >> (beat * WEIGHTS_DATA_WIDTH)) & mask
+        return words
+
+    def __map_coefficient_roms(self):
+        # one word of each rom has the coefficients of all the units for a
+        # filter_select, the roms of kernel_rom and the weight memories are
+        # read one cycle after their address
+        for k, (cycles, fields) in enumerate(self.coefficient_stages):
+            word_width = sum(bits for _, _, _, bits in fields)
+            address = self.__filter_select(cycles) if self.select_width else 0
+            if self.weight_memory:
+                memory = self.weight_memories[k]
+                memory.addr(address)
+                word = memory.data
+            elif self.kernel_rom:
+                rom = self.kernel_roms[k]
+                rom.addr(address)
+                word = rom.data
+            else:
+                words = memory_words([(codes, bits) for _, _, codes, bits in fields])
+                rom = self._sig(
+                    name=f"coefficients_rom_{cycles}",
+                    dtype=Bits(bit_length=word_width, force_vector=True)[self.filter_folding],
+                    def_val=[int(word, 16) for word in words],
+                )
+                word = self._sig(
+                    name=f"coefficients_{cycles}",
+                    dtype=Bits(bit_length=word_width, force_vector=True),
+                )
+                word(rom[address])
+            offset = 0
+            for i, name, _, bits in fields:
+                getattr(self.conv_layer_part[i], name)(word[offset + bits : offset])
+                offset += bits
+
+    def __requantize(self, window):
+        # each code is shifted by the difference of the decimal portions of
+        # both formats, sign extended to the width of the layer or saturated
+        # when its upper bits are not copies of the sign
+        source_width = self.input_format[0]
+        shift = self.input_shift
+        bits = source_width + shift
+        codes = []
+        for k in range(self.window * self.channels):
+            code = window[(k + 1) * source_width : k * source_width]
+            shifted = self._sig(
+                name=f"input_shifted_{k}", dtype=Bits(bit_length=bits, force_vector=True)
+            )
+            if shift > 0:
+                shifted(Concat(code, vec(0, shift)))
+            else:
+                shifted(code[source_width:-shift])
+            sign = shifted[bits - 1]
+            requantized = self._sig(
+                name=f"input_requantized_{k}", dtype=Bits(bit_length=self.width, force_vector=True)
+            )
+            if bits > self.width:
+                upper = shifted[bits : self.width - 1]
+                fits = upper._eq(0) | upper._eq(2 ** (bits - self.width + 1) - 1)
+                If(fits, requantized(shifted[self.width :])).Elif(
+                    sign, requantized(2 ** (self.width - 1))
+                ).Else(requantized(2 ** (self.width - 1) - 1))
+            elif bits < self.width:
+                requantized(Concat(*[sign] * (self.width - bits), shifted))
+            else:
+                requantized(shifted)
+            codes.append(requantized)
+        return Concat(*reversed(codes))
+
     def _impl(self):
         propagateClkRst(self)
         if self.top_entity:
-            offset = int(self.filters / self.parallelism) * self.OUTPUT_WIDTH
+            offset = int(self.units / self.parallelism) * self.tile * self.OUTPUT_WIDTH
             range_limit = self.parallelism
         else:
             self.logger.debug(f"weights in this part {len(self.weights)}")
-            # multi channel instantiation
-            self.bucket_weights = []
-            offset = self.size * self.channels
-            for i in range(self.filters):
-                weight_part = self.weights[i * offset : (i + 1) * offset]
-                self.bucket_weights.append(weight_part)
+            offset = self.tile * self.OUTPUT_WIDTH
+            range_limit = self.units
+            if self.prune_kernels and self.binary:
+                self.__map_shared_units()
+            if self.select_width:
+                self.filter_selects = [self.filter_select]
+            if self.coefficient_memories:
+                self.__map_coefficient_roms()
+            if self.weight_memory:
+                self.__map_weight_memories()
 
-            offset = self.OUTPUT_WIDTH
-            range_limit = self.filters
+        window = self.input
+        window_width = Bits(
+            bit_length=self.window * self.channels * (1 if self.bin_input else self.width),
+            force_vector=True,
+        )
+        if self.input_format is not None and not self.top_entity:
+            requantized = self._sig(name="input_requantized", dtype=window_width)
+            requantized(self.__requantize(window))
+            window = requantized
+        if self.rom_latency and not self.top_entity:
+            # the windows meet the words read from the roms
+            delayed = self._sig(name="input_delay", dtype=window_width)
+            If(self.rst, delayed(0)).Else(If(self.clk._onRisingEdge(), delayed(window)))
+            window = delayed
 
-        # print(range_limit, len(self.scale), len(self.biases))
         for i in range(range_limit):
             conv_layer_part = self.conv_layer_part[i]
+            conv_layer_part.en_window(self.en_window)
             conv_layer_part.en_mult(self.en_mult)
             conv_layer_part.en_sum(self.en_sum)
             conv_layer_part.en_channel(self.en_channel)
             conv_layer_part.en_batch(self.en_batch)
             conv_layer_part.en_act(self.en_act)
-            conv_layer_part.input(self.input)
+            conv_layer_part.input(window)
+
+            if self.weight_memory and self.top_entity:
+                # the index of the part is above its addresses
+                part_width = self.memory_map["part_width"]
+                address = self.avs_weights_address
+                write = self.avs_weights_write
+                if self.parallelism > 1:
+                    write = write & address[self.memory_map["address_width"] : part_width]._eq(i)
+                conv_layer_part.avs_weights_write(write)
+                conv_layer_part.avs_weights_address(address[part_width:0])
+                conv_layer_part.avs_weights_writedata(self.avs_weights_writedata)
 
-            if not self.top_entity:
+            if self.select_width and self.top_entity:
+                conv_layer_part.filter_select(self.filter_select)
+            elif not self.top_entity and not self.coefficient_memories:
                 # multi channel conv units instantiation
-                weights = self.bucket_weights[i]
-                integer_portion = 4 if self.width == 16 else 3
-                decimal_portion = 11 if self.width == 16 else 4
-                self.logger.debug("bucket list length " f"{len(self.bucket_weights)}")
-                self.logger.debug(f"weights list length {len(weights)}")
-                ssi_coef = self.scale[i] / sqrt(self.variance[i])
-                bn_coef = self.biases[i] / ssi_coef - self.mean[i]
-                # print(ssi_coef, bn_coef)
-                ssi_coef = float2fixed(
-                    weights=[ssi_coef],
-                    integer_portion=integer_portion,
-                    decimal_portion=decimal_portion,
-                )[0]
-                bn_coef = float2fixed(
-                    weights=[bn_coef],
-                    integer_portion=integer_portion,
-                    decimal_portion=decimal_portion,
-                )[0]
-                # print(ssi_coef, bn_coef)
-
-                conv_layer_part.ssi_coef(ssi_coef)
-                conv_layer_part.bn_coef(bn_coef)
-
-                for j in range(self.channels):
-                    channel_weights = weights[j * self.size : (j + 1) * self.size]
-                    self.logger.debug("weights by channel " f"{len(channel_weights)}")
-
-                    sum_weights = sum(channel_weights)
-                    avg_weights = 0 if not sum_weights else sum_weights / self.size
-                    convert_list = [avg_weights] if self.binary else channel_weights
-
-                    kernel = float2fixed(
-                        weights=convert_list,
-                        integer_portion=integer_portion,
-                        decimal_portion=decimal_portion,
-                    )
-                    kernel_sig_list = [str(int(w < 0)) for w in channel_weights]
-                    kernel_sig = int("".join(kernel_sig_list), 2)
+                if not self.fold_batch_norm:
+                    conv_layer_part.ssi_coef(int(self.ssi_codes[i]))
+                conv_layer_part.bn_coef(int(self.bn_codes[i]))
 
-                    if self.binary:
-                        getattr(conv_layer_part, f"kernel_abs_{j}")(kernel[0])
+                for j in self.active_channels[i]:
+                    if self.prune_kernels and self.binary:
+                        unit = self.shared_units[int(self.pruning["shared"][i, j])]
+                        getattr(conv_layer_part, f"conv_output_{j}")(unit.output)
+                    elif self.binary:
+                        kernel_sig = int(self.kernel_sig_codes[i, j])
+                        getattr(conv_layer_part, f"kernel_abs_{j}")(
+                            int(self.kernel_codes[i, j, 0])
+                        )
                         getattr(conv_layer_part, f"kernel_sig_{j}")(kernel_sig)
-                    else:
-                        for k in range(self.size):
+                    elif not self.constant_kernels:
+                        for k in range(self.window):
                             kernel_port = getattr(
-                                conv_layer_part, f"kernel_{j*self.size+k}"
+                                conv_layer_part, f"kernel_{j*self.window+k}"
                             )
-                            kernel_port(kernel[k])
+                            kernel_port(int(self.kernel_codes[i, j, k]))
 
             self.output[(i + 1) * offset : i * offset](conv_layer_part.output)
 
@@ -188,6 +623,8 @@ class ConvLayerPart(Unit):
         self,
         input_width=9,
         output_width=1,
+        select_width=0,
+        weights_address_width=0,
         layer_id=0,
         width=16,
         process_id=0,
@@ -195,6 +632,8 @@ class ConvLayerPart(Unit):
     ):
         self.input_width = input_width
         self.output_width = output_width
+        self.select_width = select_width
+        self.weights_address_width = weights_address_width
 
         super().__init__()
         name = f"ConvLayerL{layer_id}P{process_id}"
@@ -204,6 +643,7 @@ class ConvLayerPart(Unit):
     def _declr(self):
         self.clk = Signal()
         self.rst = Signal()
+        self.en_window = Signal()
         self.en_mult = Signal()
         self.en_sum = Signal()
         self.en_channel = Signal()
@@ -211,6 +651,12 @@ class ConvLayerPart(Unit):
         self.en_act = Signal()
         self.input = VectSignal(self.input_width)
         self.output = VectSignal(self.output_width)._m()
+        if self.select_width:
+            self.filter_select = VectSignal(self.select_width)
+        if self.weights_address_width:
+            self.avs_weights_address = VectSignal(self.weights_address_width)
+            self.avs_weights_write = Signal()
+            self.avs_weights_writedata = VectSignal(WEIGHTS_DATA_WIDTH)
 
     def _impl(self):
         self.output(
@@ -1,26 +1,54 @@
 import logging
 
-from .utils import print_info
+from .utils import print_info, serialize_uniq_by
+from .adder_tree import AdderTree
+from .constant_multiplier import ConstantMultiplier
+from .pipeline import adder_tree_latency, constant_multiplier_latency
 from .fixed_point_multiplier import FixedPointMultiplier
 
-from hwt.code import If
+from hwt.code import Concat, If
 from hwt.hdl.types.bits import Bits
 from hwt.interfaces.std import Signal, VectSignal
 from hwt.synthesizer.unit import Unit
 from hwt.synthesizer.hObjList import HObjList
-from hwt.serializer.mode import serializeParamsUniq
 
 
-@serializeParamsUniq
+@serialize_uniq_by("layer_id")
 class ConvUnit(Unit):
     """
     .. hwt-schematic::
     """
 
-    def __init__(self, size=9, width=16, **kwargs):
+    def __init__(
+        self,
+        size=9,
+        width=16,
+        lower_output_bit=None,
+        adder_pipeline=0,
+        kernels=None,
+        multiplier_latency=None,
+        **kwargs,
+    ):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.size = size
         self.width = width
+        self.lower_output_bit = lower_output_bit
+        # levels of the adder trees between registers, 0 to combinational trees
+        self.adder_pipeline = adder_pipeline
+        # codes of the kernel known at elaboration, the unit has constant
+        # multipliers instead of kernel ports when they are given
+        self.kernels = None if kernels is None else [int(code) for code in kernels]
+        if multiplier_latency is None:
+            if self.kernels is None:
+                multiplier_latency = adder_tree_latency(15, adder_pipeline)
+            else:
+                multiplier_latency = constant_multiplier_latency(
+                    self.kernels, width, lower_output_bit, adder_pipeline
+                )
+        self.multiplier_latency = multiplier_latency
+        # clock cycles from the inputs to the output, with the product and
+        # output registers
+        self.latency = multiplier_latency + adder_tree_latency(size, adder_pipeline) + 2
         self.top_entity = False
 
         print_info(self, **kwargs)
@@ -29,50 +57,72 @@ class ConvUnit(Unit):
     def _declr(self):
         self.clk = Signal()
         self.rst = Signal()
+        # en_window marks the valid windows of the input for the pipelines of
+        # the multipliers, en_mult loads their products and en_sum the sum
+        self.en_window = Signal()
         self.en_mult = Signal()
         self.en_sum = Signal()
         self.input = VectSignal(self.width * self.size)
         self.output = VectSignal(self.width, signed=True)._m()
 
-        for i in range(self.size):
-            setattr(self, f"kernel_{i}", VectSignal(self.width))
-
-        self.multiplier = HObjList(
-            FixedPointMultiplier(
-                width=self.width,
-                layer_id=self.layer_id,
-                unit_id=self.unit_id,
-                channel_id=self.channel_id,
-                process_id=self.process_id,
-                pixel_id=i,
-                log_level=self.log_level + 1,
+        if self.kernels is None:
+            for i in range(self.size):
+                setattr(self, f"kernel_{i}", VectSignal(self.width))
+
+            self.multiplier = HObjList(
+                FixedPointMultiplier(
+                    width=self.width,
+                    lower_output_bit=self.lower_output_bit,
+                    adder_pipeline=self.adder_pipeline,
+                    layer_id=self.layer_id,
+                    unit_id=self.unit_id,
+                    channel_id=self.channel_id,
+                    process_id=self.process_id,
+                    pixel_id=i,
+                    log_level=self.log_level + 1,
+                )
+                for i in range(self.size)
             )
-            for i in range(self.size)
+        else:
+            self.multiplier = HObjList(
+                ConstantMultiplier(
+                    coefficient=self.kernels[i],
+                    width=self.width,
+                    lower_output_bit=self.lower_output_bit,
+                    adder_pipeline=self.adder_pipeline,
+                    latency=self.multiplier_latency,
+                    layer_id=self.layer_id,
+                    unit_id=self.unit_id,
+                    channel_id=self.channel_id,
+                    process_id=self.process_id,
+                    log_level=self.log_level + 1,
+                )
+                for i in range(self.size)
+            )
+        # the products are two's complement values, the tree keeps all the
+        # bits of their sum and saturates it to their width and format
+        self.adder_tree = AdderTree(
+            inputs=self.size,
+            width=self.width,
+            signed=True,
+            output_width=self.width,
+            saturate=True,
+            pipeline=self.adder_pipeline,
+            layer_id=self.layer_id,
+            unit_id=self.unit_id,
+            channel_id=self.channel_id,
+            process_id=self.process_id,
+            log_level=self.log_level + 1,
         )
 
         name = f"ConvUnitL{self.layer_id}"
+        if self.kernels is not None:
+            # each unit with constant kernels has its own entity
+            name += f"P{self.process_id}U{self.unit_id}C{self.channel_id}"
+            self._serializeDecision = None
         self._name = name
         self._hdl_module_name = name
 
-    def __calc_tree_adders(self, signal_list, signal_width):
-        first_sum = [
-            self._sig(name=f"first_sum_{i}", dtype=signal_width) for i in range(4)
-        ]
-        first_sum[0](signal_list[0] + signal_list[1])
-        first_sum[1](signal_list[2] + signal_list[3])
-        first_sum[2](signal_list[4] + signal_list[5])
-        first_sum[3](signal_list[6] + signal_list[7])
-
-        second_sum = [
-            self._sig(name=f"second_sum_{i}", dtype=signal_width) for i in range(2)
-        ]
-        second_sum[0](first_sum[0] + first_sum[1])
-        second_sum[1](first_sum[2] + first_sum[3])
-
-        third_sum = self._sig(name="third_sum", dtype=signal_width)
-        third_sum(second_sum[0] + second_sum[1] + signal_list[8])
-        return third_sum
-
     def _impl(self):
         signal_width = Bits(bit_length=self.width)
         product_list = [
@@ -83,8 +133,11 @@ class ConvUnit(Unit):
             multiplier = self.multiplier[i]
             multiplier.clk(self.clk)
             multiplier.rst(self.rst)
+            if multiplier.latency:
+                multiplier.en(self.en_window)
             multiplier.param_a(self.input[self.width * (i + 1) : self.width * i])
-            multiplier.param_b(getattr(self, f"kernel_{i}"))
+            if self.kernels is None:
+                multiplier.param_b(getattr(self, f"kernel_{i}"))
 
             If(self.rst, product_list[i](0)).Else(
                 If(
@@ -93,19 +146,23 @@ class ConvUnit(Unit):
                 )
             )
 
-        if self.size == 9:
-            third_sum = self.__calc_tree_adders(product_list, signal_width)
-
-            If(self.rst, self.output(0)).Else(
-                If(self.clk._onRisingEdge(), If(self.en_sum, self.output(third_sum)))
+        if self.adder_tree.latency:
+            # the products are valid in the cycle after en_mult
+            products_valid = self._sig(name="products_valid")
+            If(self.rst, products_valid(0)).Else(
+                If(self.clk._onRisingEdge(), products_valid(self.en_mult))
             )
-        else:
-            If(self.rst, self.output(0)).Else(
-                If(
-                    self.clk._onRisingEdge(),
-                    If(self.en_sum, self.output(product_list[0])),
-                )
+            self.adder_tree.clk(self.clk)
+            self.adder_tree.rst(self.rst)
+            self.adder_tree.en(products_valid)
+        self.adder_tree.input(Concat(*reversed(product_list)))
+
+        If(self.rst, self.output(0)).Else(
+            If(
+                self.clk._onRisingEdge(),
+                If(self.en_sum, self.output(self.adder_tree.output)),
             )
+        )
 
 
 if __name__ == '__main__':
@@ -1,26 +1,35 @@
 import logging
 
-from .utils import print_info
+from .utils import print_info, serialize_uniq_by
+from .adder_tree import AdderTree, valid_chain
+from .pipeline import adder_tree_latency
 
-from hwt.code import If
+from hwt.code import Concat, If
 from hwt.hdl.types.bits import Bits
 from hwt.interfaces.std import Signal, VectSignal
 from hwt.synthesizer.unit import Unit
 from hwt.synthesizer.hObjList import HObjList
-from hwt.serializer.mode import serializeParamsUniq
 
 
-@serializeParamsUniq
+@serialize_uniq_by("layer_id")
 class FixedPointMultiplier(Unit):
     """
     .. hwt-schematic::
     """
 
-    def __init__(self, width=16, pixel_id=0, **kwargs):
+    def __init__(
+        self, width=16, pixel_id=0, lower_output_bit=None, adder_pipeline=0, **kwargs
+    ):
         self.logger = logging.getLogger(self.__class__.__name__)
 
         self.width = width
-        self.lower_output_bit = int(width - width / 2)
+        # bits of the product below the output, the decimal portion of the
+        # fixed point format
+        if lower_output_bit is None:
+            lower_output_bit = int(width - width / 2)
+        self.lower_output_bit = lower_output_bit
+        self.adder_pipeline = adder_pipeline
+        self.latency = adder_tree_latency(15, adder_pipeline)
         self.pixel_id = pixel_id
         self.top_entity = False
 
@@ -30,6 +39,10 @@ class FixedPointMultiplier(Unit):
     def _declr(self):
         self.clk = Signal()
         self.rst = Signal()
+        if self.latency:
+            # the operands are valid, the registers load them through the
+            # pipeline
+            self.en = Signal()
         self.param_a = VectSignal(self.width)
         self.param_b = VectSignal(self.width)
         self.product = VectSignal(self.width)._m()
@@ -47,42 +60,23 @@ class FixedPointMultiplier(Unit):
             )
             for i in range(15)
         )
+        # the partial products are summed modulo 2 ** (2 * width - 1)
+        self.adder_tree = AdderTree(
+            inputs=15,
+            width=self.width * 2 - 1,
+            output_width=self.width * 2 - 1,
+            pipeline=self.adder_pipeline,
+            layer_id=self.layer_id,
+            unit_id=self.unit_id,
+            channel_id=self.channel_id,
+            process_id=self.process_id,
+            log_level=self.log_level + 1,
+        )
 
         name = f"FixedPointMultiplierL{self.layer_id}"
         self._name = name
         self._hdl_module_name = name
 
-    def __calc_tree_adders(self, input_list):
-        signal_width = Bits(self.width * 2 - 1)
-        first_sum = [
-            self._sig(name=f"first_sum_{i}", dtype=signal_width) for i in range(7)
-        ]
-        first_sum[0](input_list[0] + input_list[1])
-        first_sum[1](input_list[2] + input_list[3])
-        first_sum[2](input_list[4] + input_list[5])
-        first_sum[3](input_list[6] + input_list[7])
-        first_sum[4](input_list[8] + input_list[9])
-        first_sum[5](input_list[10] + input_list[11])
-        first_sum[6](input_list[12] + input_list[13])
-
-        second_sum = [
-            self._sig(name=f"second_sum_{i}", dtype=signal_width) for i in range(4)
-        ]
-        second_sum[0](first_sum[0] + first_sum[1])
-        second_sum[1](first_sum[2] + first_sum[3])
-        second_sum[2](first_sum[4] + first_sum[5])
-        second_sum[3](first_sum[6] + input_list[14])
-
-        third_sum = [
-            self._sig(name=f"third_sum_{i}", dtype=signal_width) for i in range(2)
-        ]
-        third_sum[0](second_sum[0] + second_sum[1])
-        third_sum[1](second_sum[2] + second_sum[3])
-
-        fourth_sum = self._sig(name="fourth_sum", dtype=signal_width)
-        fourth_sum(third_sum[0] + third_sum[1])
-        return fourth_sum
-
     def _impl(self):
         concat_type = Bits(bit_length=self.width * 2 - 1, force_vector=True)
         concat_inputs = [
@@ -102,16 +96,32 @@ class FixedPointMultiplier(Unit):
             self.concat_units[i].param_a(data_a)
             self.concat_units[i].param_b(data_b)
             concat_inputs[i](self.concat_units[i].output)
-        fourth_sum = self.__calc_tree_adders(concat_inputs)
+        if self.latency:
+            self.adder_tree.clk(self.clk)
+            self.adder_tree.rst(self.rst)
+            self.adder_tree.en(self.en)
+        self.adder_tree.input(Concat(*reversed(concat_inputs)))
+        sum_tree = self.adder_tree.output
 
         If(data_a._eq(0), non_zero_a(0)).Else(non_zero_a(1))
         If(data_b._eq(0), non_zero_b(0)).Else(non_zero_b(1))
 
         xor_signal(self.param_a[self.width - 1] ^ self.param_b[self.width - 1])
 
-        self.product[self.width - 1](xor_signal & non_zero_a & non_zero_b)
+        # the sign waits for the registers of the adder tree, loaded with the
+        # same valid bits
+        sign = xor_signal & non_zero_a & non_zero_b
+        valid = valid_chain(self, self.en, self.latency, "sign_valid") if self.latency else []
+        for i in range(self.latency):
+            sign_reg = self._sig(name=f"sign_reg_{i}", dtype=Bits(1))
+            If(self.rst, sign_reg(0)).Else(
+                If(self.clk._onRisingEdge(), If(valid[i], sign_reg(sign)))
+            )
+            sign = sign_reg
+
+        self.product[self.width - 1](sign)
         self.product[self.width - 1 :](
-            fourth_sum[self.lower_output_bit + self.width - 1 : self.lower_output_bit]
+            sum_tree[self.lower_output_bit + self.width - 1 : self.lower_output_bit]
         )
 
 
@@ -0,0 +1,552 @@
+import numpy as np
+
+from .buffer_layer import buffer_layer_padding
+from .utils import fixed_point_format, quantize_conv_weights, winograd_kernels
+from .weight_store import resolve_weight_slices
+
+# number of window elements computed at once by the layer models
+CHUNK_ELEMENTS = 2 ** 22
+
+
+def _mask(bits):
+    return (1 << bits) - 1
+
+
+def to_signed(values, bits=16):
+    """
+    This function interprets unsigned codes of the given number of bits as
+    two's complement values.
+    """
+    values = np.asarray(values, dtype=np.int64) & _mask(bits)
+    return values - ((values >> (bits - 1)) << bits)
+
+
+def _lower_output_bit(width=16, lower_output_bit=None):
+    if lower_output_bit is None:
+        return int(width - width / 2)
+    return lower_output_bit
+
+
+def _truncate_product(product, width=16, lower_output_bit=None):
+    # sign bit of the 2 * width product followed by its bits from the lower
+    # output bit, as the product of the conv units and the batch normalization
+    lower_output_bit = _lower_output_bit(width, lower_output_bit)
+    product = product & _mask(2 * width)
+    sign = product >> (2 * width - 1)
+    return (sign << (width - 1)) | ((product >> lower_output_bit) & _mask(width - 1))
+
+
+def fixed_point_multiplier(param_a, param_b, width=16, lower_output_bit=None):
+    """
+    Model of FixedPointMultiplier. The width - 1 lower bits of param_b are
+    sign extended from its bit width - 2 and multiplied by the width - 1
+    lower bits of param_a through the 15 ConcatValues partial products and
+    their adder tree (2 * width - 1 bits). The product sign is the xor of the
+    input signs when both magnitudes are not zero. The lower output bit is
+    width - width / 2 unless the layer has its own fixed point format.
+    """
+    param_a = np.asarray(param_a, dtype=np.int64)
+    param_b = np.asarray(param_b, dtype=np.int64)
+    lower_output_bit = _lower_output_bit(width, lower_output_bit)
+    # only the 15 bits of data_a reach the partial products
+    data_a = param_a & _mask(min(width - 1, 15))
+    data_b = param_b & _mask(min(width - 1, 15))
+
+    extension = _mask(width - 1) << (width - 1)
+    extended_b = np.where((data_b >> (width - 2)) & 1, data_b + extension, data_b)
+    sum_tree = (data_a * extended_b) & _mask(2 * width - 1)
+
+    sign = ((param_a ^ param_b) >> (width - 1)) & 1
+    sign = sign & (data_a != 0) & (data_b != 0)
+    return (sign << (width - 1)) | ((sum_tree >> lower_output_bit) & _mask(width - 1))
+
+
+def adder_tree(inputs, width=16, signed=False, output_width=None, saturate=False):
+    """
+    Model of AdderTree, the inputs are in the last axis. Each level is one bit
+    wider than the previous one, so the sum of the inputs (two's complement
+    values when signed) never overflows, and the output keeps its
+    output_width lower bits, or the sum clamped to the largest and smallest
+    output values with saturate. The pipeline registers only delay the
+    output.
+    """
+    inputs = np.asarray(inputs, dtype=np.int64) & _mask(width)
+    if signed:
+        inputs = to_signed(inputs, width)
+    if output_width is None:
+        output_width = width + (inputs.shape[-1] - 1).bit_length()
+    total = np.sum(inputs, axis=-1)
+    if saturate:
+        if signed:
+            limit = 2 ** (output_width - 1)
+            total = np.clip(total, -limit, limit - 1)
+        else:
+            total = np.clip(total, 0, 2 ** output_width - 1)
+    return total & _mask(output_width)
+
+
+def conv_unit(inputs, kernels, width=16, lower_output_bit=None):
+    """
+    Model of ConvUnit, the inputs and kernels have the kernel elements in the
+    last axis. The adder tree sums the products of any kernel size and the
+    output is the sum saturated to the width of the products.
+    """
+    products = fixed_point_multiplier(inputs, kernels, width, lower_output_bit)
+    return adder_tree(products, width, signed=True, output_width=width, saturate=True)
+
+
+def winograd_conv_unit(inputs, kernels, width=16, lower_output_bit=None):
+    """
+    Model of WinogradConvUnit, the inputs are 4x4 tiles and the kernels the
+    transforms returned by winograd_kernels, both in row major order in the
+    last axis. The tile and the kernel are transformed and multiplied
+    without rounding, so the 2x2 outputs (row major in the last axis) are 4
+    times the sums of the products of each 3x3 window, shifted right by 2
+    and the lower output bit, keeping their width lower bits.
+    """
+    lower_output_bit = _lower_output_bit(width, lower_output_bit)
+    inputs = to_signed(inputs, width)
+    kernels = to_signed(kernels, width + 4)
+    tiles = inputs.reshape(inputs.shape[:-1] + (4, 4))
+    input_transform = np.array([[1, 0, -1, 0], [0, 1, 1, 0], [0, -1, 1, 0], [0, 1, 0, -1]])
+    output_transform = np.array([[1, 1, 1, 0], [0, 1, -1, -1]])
+
+    kernels = kernels.reshape(kernels.shape[:-1] + (4, 4))
+    products = (input_transform @ tiles @ input_transform.T) * kernels
+    outputs = output_transform @ products @ output_transform.T
+    outputs = outputs.reshape(outputs.shape[:-2] + (4,))
+    return (outputs >> (lower_output_bit + 2)) & _mask(width)
+
+
+def bin_conv_unit(
+    inputs, kernel_abs, kernel_sig, width=16, bin_input=False, lower_output_bit=None
+):
+    """
+    Model of BinConvUnit, the inputs have the kernel elements in the last
+    axis. Each element adds -1 when the input sign is equal to the bit of
+    kernel_sig with the same index (the first weight is the most significant
+    bit) and +1 otherwise: the popcount of the different signs is doubled
+    and the size is subtracted. The sum is multiplied by kernel_abs.
+    """
+    inputs = np.asarray(inputs, dtype=np.int64)
+    size = inputs.shape[-1]
+    signal_bit = 0 if bin_input else width - 1
+
+    input_sig = (inputs >> signal_bit) & 1
+    kernel_bits = (np.asarray(kernel_sig, dtype=np.int64)[..., np.newaxis] >> np.arange(size)) & 1
+    count = adder_tree(input_sig ^ kernel_bits, 1, output_width=size.bit_length())
+    delta = (2 * count - size) & _mask(width)
+
+    cast = to_signed(delta, width) * to_signed(kernel_abs, width)
+    return _truncate_product(cast, width, lower_output_bit)
+
+
+def channel_adder_tree(outputs, width=16):
+    """
+    Model of the adder tree of MultiChannelConvUnit, the outputs of the conv
+    units are in the last axis. The output is the sum saturated to width
+    bits, a single channel goes through the tree.
+    """
+    return adder_tree(outputs, width, signed=True, output_width=width, saturate=True)
+
+
+def multi_channel_conv_unit(
+    inputs,
+    ssi_coef,
+    bn_coef,
+    kernels=None,
+    kernel_abs=None,
+    kernel_sig=None,
+    width=16,
+    binary=False,
+    bin_input=False,
+    bin_output=False,
+    lower_output_bit=None,
+    fold_batch_norm=False,
+    winograd=False,
+):
+    """
+    Model of MultiChannelConvUnit, the inputs have the channels and the kernel
+    elements in the two last axes. The sum of the channels goes through the
+    batch normalization and activation (see batch_activation). The clocked
+    logic of the unit is commented out, so the output does not depend on
+    the enables. With fold_batch_norm (only for non binary units), ssi_coef
+    is folded into the kernels and is not multiplied. With winograd, the
+    inputs are 4x4 tiles, the kernels their transforms and the 2x2 outputs
+    are in the last axis.
+    """
+    if binary:
+        conv_outputs = bin_conv_unit(
+            inputs, kernel_abs, kernel_sig, width, bin_input, lower_output_bit
+        )
+    elif winograd:
+        conv_outputs = winograd_conv_unit(inputs, kernels, width, lower_output_bit)
+        # the outputs of the tile have their own channel trees
+        conv_outputs = np.swapaxes(conv_outputs, -1, -2)
+        ssi_coef = np.asarray(ssi_coef, dtype=np.int64)[..., np.newaxis]
+        bn_coef = np.asarray(bn_coef, dtype=np.int64)[..., np.newaxis]
+    else:
+        conv_outputs = conv_unit(inputs, kernels, width, lower_output_bit)
+    accumulator = channel_adder_tree(conv_outputs, width)
+    if fold_batch_norm and not binary:
+        ssi_coef = None
+    return batch_activation(
+        accumulator, ssi_coef, bn_coef, width, bin_output, lower_output_bit
+    )
+
+
+def batch_activation(
+    accumulator, ssi_coef, bn_coef, width=16, bin_output=False, lower_output_bit=None
+):
+    """
+    Model of the output of MultiChannelConvUnit from the sum of its channels:
+    the sum is multiplied by ssi_coef (unless it is None, when it is folded
+    into the kernels) and added to bn_coef, the negative results are shifted
+    right by 3 bits with their sign (or only the sign is kept with
+    bin_output).
+    """
+    batch = np.asarray(accumulator, dtype=np.int64)
+    if ssi_coef is not None:
+        mult = to_signed(accumulator, width) * to_signed(ssi_coef, width)
+        batch = _truncate_product(mult, width, lower_output_bit)
+    batch = batch + np.asarray(bn_coef, dtype=np.int64)
+    batch = batch & _mask(width)
+
+    sign = batch >> (width - 1)
+    if bin_output:
+        return sign
+    shifted = (to_signed(batch, width) >> 3) & _mask(width)
+    return np.where(sign, shifted, batch)
+
+
+def max_pool_unit(inputs, width=16, binary=False):
+    """
+    Model of MaxPoolUnit, the 4 inputs of the window are in the last axis.
+    The inputs are compared as unsigned values, the binary comparison keeps
+    the first value when the and of both is not zero.
+    """
+    inputs = np.asarray(inputs, dtype=np.int64) & _mask(width)
+
+    def comparison(param_a, param_b):
+        if binary:
+            return np.where((param_a & param_b) != 0, param_a, param_b)
+        return np.where(param_a > param_b, param_a, param_b)
+
+    first_pool0 = comparison(inputs[..., 0], inputs[..., 1])
+    first_pool1 = comparison(inputs[..., 2], inputs[..., 3])
+    return comparison(first_pool0, first_pool1)
+
+
+def conv_windows(feature_map, size=3):
+    """
+    This function returns the windows of a feature map (height, width,
+    channels) for a kernel of size x size, stride 1 and zero padding, with
+    the window elements in row major order in the last axis.
+    """
+    height, width = feature_map.shape[:2]
+    pad = size // 2
+    padded = np.pad(feature_map, ((pad, pad), (pad, pad), (0, 0)))
+    windows = [
+        padded[dy : dy + height, dx : dx + width]
+        for dy in range(size)
+        for dx in range(size)
+    ]
+    return np.stack(windows, axis=-1)
+
+
+def winograd_tiles(feature_map):
+    """
+    This function returns the 4x4 tiles of a feature map (height, width,
+    channels) for the 2x2 outputs of a 3x3 kernel with zero padding, with
+    the tile elements in row major order in the last axis. The tile (y, x)
+    has the windows of the outputs (2y, 2x) to (2y + 1, 2x + 1), the
+    feature map is padded to even sizes.
+    """
+    height, width = feature_map.shape[:2]
+    tile_rows = -(-height // 2)
+    tile_columns = -(-width // 2)
+    padding = ((1, 2 * tile_rows + 1 - height), (1, 2 * tile_columns + 1 - width), (0, 0))
+    padded = np.pad(feature_map, padding)
+    tiles = [
+        padded[dy : dy + 2 * tile_rows : 2, dx : dx + 2 * tile_columns : 2]
+        for dy in range(4)
+        for dx in range(4)
+    ]
+    return np.stack(tiles, axis=-1)
+
+
+def winograd_conv_layer(
+    feature_map, codes, width=16, bin_output=False, lower_output_bit=None, fold_batch_norm=False
+):
+    """
+    Model of a conv layer of 3x3 kernels with Winograd units over a whole
+    feature map, with the same arguments and output as conv_layer.
+    """
+    feature_map = np.asarray(feature_map, dtype=np.int64)
+    height, map_width, channels = feature_map.shape
+    filters = len(codes["ssi"])
+    kernels = winograd_kernels(codes["kernel"], width)
+
+    rows = max(1, CHUNK_ELEMENTS // (4 * map_width * filters * channels * 16))
+    output = np.zeros((2 * (-(-height // 2)), 2 * (-(-map_width // 2)), filters), dtype=np.int64)
+    for row in range(0, height, 2 * rows):
+        # the tiles of the rows of this chunk with the neighbour rows they need
+        start = max(row - 1, 0)
+        end = min(row + 2 * rows + 1, height)
+        tiles = winograd_tiles(feature_map[start:end])
+        tiles = tiles[(row - start) // 2 : (row - start) // 2 + rows, :, np.newaxis]
+        tiles = multi_channel_conv_unit(
+            tiles,
+            codes["ssi"],
+            codes["bn"],
+            kernels=kernels,
+            width=width,
+            bin_output=bin_output,
+            lower_output_bit=lower_output_bit,
+            fold_batch_norm=fold_batch_norm,
+            winograd=True,
+        )
+        # (tile rows, tile columns, filters, 2, 2) to rows and columns
+        tiles = tiles.reshape(tiles.shape[:3] + (2, 2)).transpose(0, 3, 1, 4, 2)
+        chunk = tiles.reshape(2 * tiles.shape[0], 2 * tiles.shape[2], filters)
+        output[row : row + len(chunk)] = chunk
+    return output[:height, :map_width]
+
+
+def conv_layer(
+    feature_map,
+    codes,
+    size=3,
+    width=16,
+    binary=False,
+    bin_input=False,
+    bin_output=False,
+    lower_output_bit=None,
+    fold_batch_norm=False,
+    winograd=False,
+):
+    """
+    Model of a conv layer over a whole feature map (height, width, channels)
+    of fixed point codes, returning the output codes of all filters
+    (height, width, filters). The codes are the ones returned by
+    quantize_conv_weights for all the filters of the layer. The rows are
+    processed in chunks to bound the memory of the broadcasted products.
+    """
+    if winograd:
+        return winograd_conv_layer(
+            feature_map, codes, width, bin_output, lower_output_bit, fold_batch_norm
+        )
+    feature_map = np.asarray(feature_map, dtype=np.int64)
+    height, map_width, channels = feature_map.shape
+    filters = len(codes["ssi"])
+    kernel_size = size * size
+
+    rows = max(1, CHUNK_ELEMENTS // (map_width * filters * channels * kernel_size))
+    output = np.zeros((height, map_width, filters), dtype=np.int64)
+    for row in range(0, height, rows):
+        # windows of the rows of this chunk with the neighbour rows they need
+        start = max(row - size // 2, 0)
+        end = min(row + rows + size // 2, height)
+        windows = conv_windows(feature_map[start:end], size)
+        windows = windows[row - start : row - start + rows]
+        windows = windows[:, :, np.newaxis]
+
+        output[row : row + rows] = multi_channel_conv_unit(
+            windows,
+            codes["ssi"],
+            codes["bn"],
+            kernels=codes["kernel"],
+            kernel_abs=codes["kernel"][..., 0],
+            kernel_sig=codes["kernel_sig"],
+            width=width,
+            binary=binary,
+            bin_input=bin_input,
+            bin_output=bin_output,
+            lower_output_bit=lower_output_bit,
+            fold_batch_norm=fold_batch_norm,
+        )
+    return output
+
+
+def max_pool_layer(feature_map, width=16, binary=False):
+    """
+    Model of a max pool layer over a whole feature map (height, width,
+    filters), with 2x2 windows and stride 2.
+    """
+    feature_map = np.asarray(feature_map, dtype=np.int64)
+    height, map_width = feature_map.shape[:2]
+    feature_map = feature_map[: height - height % 2, : map_width - map_width % 2]
+    windows = np.stack(
+        [
+            feature_map[0::2, 0::2],
+            feature_map[0::2, 1::2],
+            feature_map[1::2, 0::2],
+            feature_map[1::2, 1::2],
+        ],
+        axis=-1,
+    )
+    return max_pool_unit(windows, 1 if binary else width, binary)
+
+
+def buffer_layer(feature_map, size=3, stride=1):
+    """
+    Model of the windows of a buffer layer streaming a feature map (height,
+    width, channels) with the zero columns and rows of its padding (see
+    buffer_layer_padding): the windows of conv_windows in the order of the
+    stream, only the ones whose first row and column are multiples of the
+    stride inside the feature map with a stride.
+    """
+    windows = conv_windows(feature_map, size)
+    if stride == 1:
+        return windows
+    height, width = windows.shape[:2]
+    # the center of the first window inside the feature map and the rows and
+    # columns of a window after its center
+    first = size // 2
+    after = (size - 1) // 2
+    return windows[first : height - after : stride, first : width - after : stride]
+
+
+def buffer_layer_valid(height, width, size=3, stride=1):
+    """
+    Model of the valid output of a buffer layer for each pixel of the stream
+    of a feature map (height, width) with the zero columns and rows of its
+    padding: the windows that end after the first columns and rows of the
+    padding with stride 1, otherwise the windows inside the feature map
+    whose first row and column are multiples of the stride.
+    """
+    padding = buffer_layer_padding(size, stride)
+    rows = np.arange(height + padding)
+    columns = np.arange(width + padding)
+    if stride == 1:
+        rows_valid = rows >= padding
+        columns_valid = columns >= padding
+    else:
+        rows_valid = (rows >= size - 1) & ((rows - (size - 1)) % stride == 0)
+        columns_valid = (columns >= size - 1) & ((columns - (size - 1)) % stride == 0)
+    return (rows_valid[:, None] & columns_valid[None, :]).astype(np.int64)
+
+
+def layer_controller(start, enables, latency=0):
+    """
+    Model of the outputs of a layer controller in each clock cycle: each
+    enable and valid are the start of the windows delayed by their cycles.
+    """
+    start = np.asarray(start, dtype=np.int64)
+
+    def delayed(cycles):
+        return np.concatenate([np.zeros(cycles, dtype=np.int64), start])[: len(start)]
+
+    outputs = {enable: delayed(cycles) for enable, cycles in enables.items()}
+    outputs["valid"] = delayed(latency)
+    return outputs
+
+
+def layer_format(args, width=16):
+    """
+    This function returns the fixed point format (width, integer_portion,
+    decimal_portion) of a conv layer from its args, the default format of
+    its width when the parser did not choose one.
+    """
+    width = args.get("width", width)
+    if args.get("decimal_portion") is None:
+        return (width, *fixed_point_format(width))
+    return (width, args["integer_portion"], args["decimal_portion"])
+
+
+def input_format(layers, width=16):
+    """
+    This function returns the fixed point format of the input feature map of
+    a network, the format of its first conv layer.
+    """
+    for layer in layers:
+        if layer["class"].__name__ == "ConvLayer":
+            return layer_format(layer["args"], width)
+    return (width, *fixed_point_format(width))
+
+
+def rescale_codes(codes, source_format, target_format):
+    """
+    Model of the requantization of the input of a conv layer (see
+    ConvLayer), converting fixed point codes between two formats (width,
+    integer_portion, decimal_portion) with an arithmetic shift of the
+    difference of their decimal portions and saturating the values that do
+    not fit in the target width.
+    """
+    source_width, _, source_decimal = source_format
+    target_width, _, target_decimal = target_format
+    values = to_signed(codes, source_width)
+    shift = target_decimal - source_decimal
+    values = values << shift if shift >= 0 else values >> -shift
+    limit = 2 ** (target_width - 1)
+    return np.clip(values, -limit, limit - 1) & _mask(target_width)
+
+
+def run_network(layers, feature_map, width=16, callback=None):
+    """
+    This function runs the golden model of a network over an input feature
+    map of fixed point codes, in the format of its first conv layer (see
+    input_format). The layers are the ones returned by
+    NetworkParser.parse_network: the weights of each conv layer are read and
+    quantized part by part, with the same slices as the generated parts,
+    and the layer runs when its top entity is reached. When consecutive conv
+    layers have different fixed point formats, the feature map is rescaled
+    to the format of the next layer, as its parts requantize their inputs.
+    The callback is called with each layer dict, its output feature map
+    and the format of its codes.
+    """
+    parts = []
+    fixed_format = input_format(layers, width)
+    for layer in layers:
+        args = layer["args"]
+        if layer["class"].__name__ in ["NetworkTop", "LayerController"]:
+            # the stream of the layers computes the same feature maps and the
+            # controllers only drive their enables
+            continue
+        if layer["class"].__name__ == "ConvLayer" and not args.get("top_entity"):
+            weights = resolve_weight_slices(
+                args["weights_store"], args["weights_slice"], args["variables_slice"]
+            )
+            layer_width, integer_portion, decimal_portion = layer_format(args, width)
+            parts.append(
+                quantize_conv_weights(
+                    filters=args["filters"],
+                    channels=args["channels"],
+                    size=args["size"] ** 2,
+                    width=layer_width,
+                    binary=args["binary"],
+                    integer_portion=integer_portion,
+                    decimal_portion=decimal_portion,
+                    fold_batch_norm=args.get("fold_batch_norm", False),
+                    **weights,
+                )
+            )
+            continue
+
+        if layer["class"].__name__ == "ConvLayer":
+            codes = {
+                name: np.concatenate([part[name] for part in parts])
+                for name in ["ssi", "bn", "kernel", "kernel_sig"]
+            }
+            parts = []
+            conv_format = layer_format(args, width)
+            if conv_format != fixed_format and not args["bin_input"]:
+                feature_map = rescale_codes(feature_map, fixed_format, conv_format)
+            fixed_format = conv_format
+            feature_map = conv_layer(
+                feature_map,
+                codes,
+                size=args["size"],
+                width=fixed_format[0],
+                binary=args["binary"],
+                bin_input=args["bin_input"],
+                bin_output=args["bin_output"],
+                lower_output_bit=args.get("decimal_portion"),
+                fold_batch_norm=args.get("fold_batch_norm", False),
+                winograd=args.get("winograd", False),
+            )
+        elif layer["class"].__name__ == "MaxPoolLayer":
+            feature_map = max_pool_layer(feature_map, fixed_format[0], args["binary"])
+        if callback is not None:
+            callback(layer, feature_map, fixed_format)
+    return feature_map
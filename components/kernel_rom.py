@@ -0,0 +1,139 @@
+import logging
+import os
+
+from .utils import print_info, write_memory_files
+
+from hwt.code import If
+from hwt.hdl.types.bits import Bits
+from hwt.interfaces.std import Signal, VectSignal
+from hwt.synthesizer.unit import Unit
+
+VHDL_TEMPLATE = """LIBRARY IEEE;
+USE IEEE.std_logic_1164.ALL;
+USE IEEE.numeric_std.ALL;
+
+ENTITY {name} IS
+    PORT(
+        addr : IN STD_LOGIC_VECTOR({address_msb} DOWNTO 0);
+        clk : IN STD_LOGIC;
+        data : OUT STD_LOGIC_VECTOR({data_msb} DOWNTO 0)
+    );
+END ENTITY;
+
+ARCHITECTURE rtl OF {name} IS
+    TYPE rom_t IS ARRAY (0 TO {last_address}) OF STD_LOGIC_VECTOR({data_msb} DOWNTO 0);
+    SIGNAL rom : rom_t;
+    ATTRIBUTE ram_init_file : STRING;
+    ATTRIBUTE ram_init_file OF rom : SIGNAL IS "{init_file}";
+BEGIN
+    assig_process_data: PROCESS(clk)
+    BEGIN
+        IF RISING_EDGE(clk) THEN
+            data <= rom(TO_INTEGER(UNSIGNED(addr)));
+        END IF;
+    END PROCESS;
+END ARCHITECTURE;
+"""
+
+VERILOG_TEMPLATE = """module {name} (
+    input [{address_msb}:0] addr,
+    input  clk,
+    output reg[{data_msb}:0] data
+);
+    reg[{data_msb}:0] rom[0:{last_address}];
+    always @(posedge clk) begin: assig_process_data
+        data <= rom[addr];
+    end
+
+    initial begin
+        $readmemh("{init_file}", rom);
+    end
+
+endmodule
+"""
+
+# entity of the rom and initialization file it reads in each language, the
+# systemc roms keep the words of the model written by hwt
+ROM_FILES = {
+    ".vhd": (VHDL_TEMPLATE, ".mif"),
+    ".v": (VERILOG_TEMPLATE, ".hex"),
+}
+
+
+class KernelRom(Unit):
+    """
+    .. hwt-schematic::
+    """
+
+    def __init__(self, words=None, width=1, stage=0, **kwargs):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        # hexadecimal words of each address (see memory_words)
+        self.words = [] if words is None else words
+        self.width = width
+        self.depth = len(self.words)
+        self.address_width = max(self.depth - 1, 1).bit_length()
+        # stage of the pipeline of the conv layer part that reads the rom
+        self.stage = stage
+        self.top_entity = False
+
+        print_info(self, **kwargs)
+        super().__init__()
+
+    def _declr(self):
+        self.clk = Signal()
+        self.addr = VectSignal(self.address_width)
+        self.data = VectSignal(self.width)._m()
+
+        name = f"KernelRomL{self.layer_id}P{self.process_id}S{self.stage}"
+        self._name = name
+        self._hdl_module_name = name
+
+    def _impl(self):
+        # the model of the rom in the simulations, the entity written by hwt is
+        # replaced by save with one that reads its initialization file
+        rom = self._sig(
+            name="rom",
+            dtype=Bits(bit_length=self.width, force_vector=True)[self.depth],
+            def_val=[int(word, 16) for word in self.words],
+        )
+        If(self.clk._onRisingEdge(), self.data(rom[self.addr]))
+
+    def save(self, path=".", file_extension=".vhd"):
+        """
+        This function writes the entity of the rom in the language of the
+        file extension, that reads its words from the initialization file
+        (.mif in vhdl, .hex with $readmemh in verilog), and this file in the
+        given path. Returns the paths of the written files, none for the
+        languages without a template.
+        """
+        if file_extension not in ROM_FILES:
+            return []
+        template, init_extension = ROM_FILES[file_extension]
+        files = write_memory_files(
+            path, self._hdl_module_name, self.words, self.width, [init_extension]
+        )
+        rom_file = os.path.join(path, f"{self._hdl_module_name}{file_extension}")
+        with open(rom_file, "w") as file:
+            file.write(
+                template.format(
+                    name=self._hdl_module_name,
+                    address_msb=self.address_width - 1,
+                    data_msb=self.width - 1,
+                    last_address=self.depth - 1,
+                    init_file=os.path.basename(files[0]),
+                )
+            )
+        return [rom_file] + files
+
+
+if __name__ == "__main__":
+    from sys import argv
+
+    if len(argv) > 1:
+        path = argv[1]
+
+        unit = KernelRom(words=["0123", "4567", "89AB", "CDEF"], width=16)
+        unit._loadDeclarations()
+        print(unit.save(path))
+    else:
+        print("file.py <outputpath>")
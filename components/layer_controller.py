@@ -0,0 +1,127 @@
+import logging
+
+from .utils import print_info
+from .pipeline import adder_tree_latency, kernel_rom_latency, multi_channel_conv_unit_latency
+
+from hwt.code import If
+from hwt.interfaces.std import Signal
+from hwt.synthesizer.unit import Unit
+
+# enables of each kind of layer, in the order of the registers they load
+LAYER_ENABLES = {
+    "ConvLayer": ["en_window", "en_mult", "en_sum", "en_channel", "en_batch", "en_act"],
+    "MaxPoolLayer": ["en_pool"],
+}
+
+
+def layer_schedule(layer):
+    """
+    This function returns the schedule of the enables of a conv or max pool
+    layer returned by NetworkParser.parse_network: the cycle of each enable
+    after the one of the input window, from the pipeline of its units, and
+    the latency of the layer. en_window marks the input window for the
+    pipelines of the multipliers. In non binary layers, en_mult loads the
+    products of ConvUnit after the multipliers and en_sum its output after
+    the adder tree (the Winograd units load them in consecutive cycles).
+    The accumulator, batch normalization and activation of
+    MultiChannelConvUnit are not registered, their enables are set in the
+    cycle of the output of the layer, after the tree of the channels. The
+    register of the windows of the layers with kernel_rom or weight_memory
+    delays all of them.
+    """
+    args = layer["args"]
+    kind = layer["class"].__name__
+    if kind == "MaxPoolLayer":
+        return {"enables": {"en_pool": 0}, "latency": 1}
+
+    adder_pipeline = args.get("adder_pipeline", 0)
+    multiplier_latency = args.get("multiplier_latency")
+    tree_latency = adder_tree_latency(args["size"] ** 2, adder_pipeline)
+    latency = multi_channel_conv_unit_latency(
+        args["channels"],
+        args["size"] ** 2,
+        args["binary"],
+        adder_pipeline,
+        multiplier_latency,
+        args.get("winograd", False),
+    )
+    if args.get("winograd"):
+        enables = {"en_mult": 0, "en_sum": 1}
+    elif args["binary"]:
+        # the binary units only have the registers of their adder trees
+        enables = {"en_mult": 0, "en_sum": tree_latency}
+    else:
+        if multiplier_latency is None:
+            multiplier_latency = adder_tree_latency(15, adder_pipeline)
+        enables = {
+            "en_mult": multiplier_latency,
+            "en_sum": multiplier_latency + 1 + tree_latency,
+        }
+    enables.update({"en_window": 0, "en_channel": latency, "en_batch": latency, "en_act": latency})
+    rom_latency = kernel_rom_latency(args.get("kernel_rom", False), args.get("weight_memory", False))
+    enables = {name: cycle + rom_latency for name, cycle in enables.items()}
+    return {"enables": enables, "latency": latency + rom_latency}
+
+
+class LayerController(Unit):
+    """
+    .. hwt-schematic::
+    """
+
+    def __init__(self, kind="ConvLayer", enables=None, latency=0, **kwargs):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.kind = kind
+        # cycle of each enable after the start of a window, each window has
+        # its own valid bit in the pipeline, so the windows can start in
+        # consecutive cycles
+        self.enables = {} if enables is None else enables
+        self.latency = latency
+        self.depth = max([latency, *self.enables.values()])
+        self.top_entity = False
+        print_info(self, **kwargs)
+        super().__init__()
+
+    def _declr(self):
+        self.clk = Signal()
+        self.rst = Signal()
+        self.start = Signal()
+        for enable in LAYER_ENABLES[self.kind]:
+            setattr(self, enable, Signal()._m())
+        self.valid = Signal()._m()
+
+        name = f"{self.kind}L{self.layer_id}Controller"
+        self._name = name
+        self._hdl_module_name = name
+
+    def _impl(self):
+        stages = [self.start]
+        for i in range(self.depth):
+            stage = self._sig(name=f"stage_{i}")
+            If(self.rst, stage(0)).Else(If(self.clk._onRisingEdge(), stage(stages[-1])))
+            stages.append(stage)
+
+        for enable in LAYER_ENABLES[self.kind]:
+            getattr(self, enable)(stages[self.enables[enable]])
+        self.valid(stages[self.latency])
+
+
+if __name__ == "__main__":
+    from sys import argv
+    from utils import to_vhdl, get_std_logger
+
+    if len(argv) > 1:
+        path = argv[1]
+
+        get_std_logger()
+        enables = {
+            "en_window": 0,
+            "en_mult": 0,
+            "en_sum": 1,
+            "en_channel": 4,
+            "en_batch": 4,
+            "en_act": 4,
+        }
+        unit = LayerController(kind="ConvLayer", enables=enables, latency=4)
+        to_vhdl(unit, path)
+    else:
+        print("file.py <outputpath>")
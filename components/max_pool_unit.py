@@ -1,15 +1,14 @@
 import logging
 
-from .utils import print_info
+from .utils import print_info, serialize_uniq_by
 
 from hwt.code import If
 from hwt.hdl.types.bits import Bits
 from hwt.interfaces.std import Signal, VectSignal
 from hwt.synthesizer.unit import Unit
-from hwt.serializer.mode import serializeParamsUniq
 
 
-@serializeParamsUniq
+@serialize_uniq_by("layer_id")
 class MaxPoolUnit(Unit):
     """
     .. hwt-schematic::
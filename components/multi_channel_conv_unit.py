@@ -1,21 +1,26 @@
 import logging
-from math import log, ceil
 
-from .utils import print_info
+from .utils import print_info, serialize_uniq_by
+from .adder_tree import AdderTree
+from .pipeline import (
+    adder_tree_latency,
+    constant_multiplier_latency,
+    multi_channel_conv_unit_latency,
+)
 from .bin_conv_unit import BinConvUnit
 from .conv_unit import ConvUnit
+from .winograd_conv_unit import WinogradConvUnit
 from .fixed_point_multiplier import FixedPointMultiplier
 
-from hwt.code import If
+from hwt.code import Concat, If
 from hwt.hdl.types.bits import Bits
 from hwt.interfaces.std import Signal, VectSignal
 from hwt.synthesizer.unit import Unit
 from hwt.interfaces.utils import propagateClkRst, addClkRst
 from hwt.synthesizer.hObjList import HObjList
-from hwt.serializer.mode import serializeOnce
 
 
-@serializeOnce
+@serialize_uniq_by("layer_id", "kernels", "active_channels", "shared_units")
 class MultiChannelConvUnit(Unit):
     """
     .. hwt-schematic::
@@ -29,6 +34,14 @@ class MultiChannelConvUnit(Unit):
         binary=True,
         bin_input=False,
         bin_output=False,
+        lower_output_bit=None,
+        adder_pipeline=0,
+        kernels=None,
+        active_channels=None,
+        shared_units=False,
+        fold_batch_norm=False,
+        multiplier_latency=None,
+        winograd=False,
         **kwargs,
     ):
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -37,37 +50,81 @@ class MultiChannelConvUnit(Unit):
         self.width = width
         self.bin_input = bin_input
         self.binary = binary
-        self.lower_output_bit = int(width - width / 2)
+        if lower_output_bit is None:
+            lower_output_bit = int(width - width / 2)
+        self.lower_output_bit = lower_output_bit
         self.top_entity = False
 
-        # set coeficients to build the tree adders
-        if self.channels & (self.channels - 1) == 0:
-            self.tree_cond = 0
-            self.acc_id = self.channels - 1
+        # levels of the adder trees between registers, 0 to combinational trees
+        self.adder_pipeline = adder_pipeline
+        # codes of the kernels of each channel known at elaboration, the conv
+        # units have constant multipliers instead of kernel ports with them
+        if kernels is not None and not binary:
+            kernels = tuple(tuple(int(code) for code in channel) for channel in kernels)
         else:
-            self.tree_cond = 1
-            self.acc_id = 2 ** ceil(log(self.channels) / log(2)) - 1
-        self.half_elements = int((self.acc_id + 1) / 2)
+            kernels = None
+        self.kernels = kernels
+        # channels with a conv unit, the outputs of the others are always zero
+        # (see prune_conv_kernels)
+        if active_channels is None:
+            active_channels = range(channels)
+        self.active_channels = tuple(active_channels)
+        # the outputs of the conv units are the conv_output ports, driven by
+        # the units shared by the filters of a conv layer part
+        self.shared_units = shared_units
+        # the ssi coefficient is folded into the kernels of the non binary
+        # units, the sum of the channels is only added to bn_coef
+        self.fold_batch_norm = fold_batch_norm and not binary
+        # the non binary 3x3 units compute 2x2 outputs from 4x4 tiles with
+        # Winograd units, the kernel ports have the transformed kernels
+        self.winograd = winograd and not binary
+        self.window = 16 if self.winograd else size
+        self.tile = 4 if self.winograd else 1
 
         # set input and output width
         self.INPUT_WIDTH = 1 if bin_input else self.width
         self.OUTPUT_WIDTH = 1 if bin_output else self.width
 
+        # clock cycles from the inputs to the output, the latency of the
+        # multipliers may be given to align the units of a whole layer
+        if multiplier_latency is not None:
+            self.multiplier_latency = multiplier_latency
+        elif self.kernels is not None:
+            # the products of all the channels are aligned
+            self.multiplier_latency = constant_multiplier_latency(
+                [code for i in self.active_channels for code in self.kernels[i]],
+                width,
+                lower_output_bit,
+                adder_pipeline,
+            )
+        else:
+            self.multiplier_latency = adder_tree_latency(15, adder_pipeline)
+        # the channel tree of the removed channels is delayed to the latency
+        # of the tree of all the channels
+        self.channel_latency = adder_tree_latency(channels, adder_pipeline)
+        self.latency = multi_channel_conv_unit_latency(
+            channels, size, self.binary, adder_pipeline, self.multiplier_latency, self.winograd
+        )
+
         print_info(self, **kwargs)
         super().__init__()
 
     def _declr(self):
         addClkRst(self)
+        self.en_window = Signal()
         self.en_mult = Signal()
         self.en_sum = Signal()
         self.en_channel = Signal()
         self.en_batch = Signal()
         self.en_act = Signal()
-        self.input = VectSignal(self.size * self.channels * self.INPUT_WIDTH)
-        self.output = VectSignal(self.OUTPUT_WIDTH, signed=True)._m()
+        self.input = VectSignal(self.window * self.channels * self.INPUT_WIDTH)
+        self.output = VectSignal(self.tile * self.OUTPUT_WIDTH, signed=True)._m()
 
-        self.ssi_coef = VectSignal(self.INPUT_WIDTH)
-        self.bn_coef = VectSignal(self.INPUT_WIDTH)
+        # the coefficients have the width of the datapath, also with binary
+        # inputs
+        if not self.fold_batch_norm:
+            self.ssi_coef = VectSignal(self.width)
+        self.bn_coef = VectSignal(self.width)
 
         # self.multiplier = FixedPointMultiplier(
         #     width=self.width,
@@ -80,9 +137,12 @@ class MultiChannelConvUnit(Unit):
         # )
 
         conv_units_list = []
-        # instantiate binary conv unit if it is setted
-        if self.binary:
-            for i in range(self.channels):
+        for i in self.active_channels:
+            if self.shared_units:
+                setattr(self, f'conv_output_{i}', VectSignal(self.width, signed=True))
+                continue
+            # instantiate binary conv unit if it is setted
+            if self.binary:
                 setattr(self, f'kernel_abs_{i}', VectSignal(self.width))
                 setattr(self, f'kernel_sig_{i}', VectSignal(self.size))
                 conv_unit = BinConvUnit(
@@ -92,14 +152,27 @@ class MultiChannelConvUnit(Unit):
                     bin_input=self.bin_input,
                     width=self.width,
                     size=self.size,
+                    lower_output_bit=self.lower_output_bit,
+                    adder_pipeline=self.adder_pipeline,
                     process_id=self.process_id,
                     log_level=self.log_level + 1,
                 )
-                conv_units_list.append(conv_unit)
-        else:
-            for i in range(self.channels):
-                for j in range(self.size):
-                    setattr(self, f'kernel_{i*self.size+j}', VectSignal(self.width))
+            elif self.winograd:
+                for j in range(16):
+                    setattr(self, f'kernel_{i*16+j}', VectSignal(self.width + 4))
+                conv_unit = WinogradConvUnit(
+                    layer_id=self.layer_id,
+                    channel_id=i,
+                    unit_id=self.unit_id,
+                    width=self.width,
+                    lower_output_bit=self.lower_output_bit,
+                    process_id=self.process_id,
+                    log_level=self.log_level + 1,
+                )
+            else:
+                if self.kernels is None:
+                    for j in range(self.size):
+                        setattr(self, f'kernel_{i*self.size+j}', VectSignal(self.width))
                 conv_unit = ConvUnit(
                     layer_id=self.layer_id,
                     channel_id=i,
@@ -107,30 +180,83 @@ class MultiChannelConvUnit(Unit):
                     bin_input=self.bin_input,
                     width=self.width,
                     size=self.size,
+                    lower_output_bit=self.lower_output_bit,
+                    adder_pipeline=self.adder_pipeline,
+                    kernels=None if self.kernels is None else self.kernels[i],
+                    multiplier_latency=self.multiplier_latency,
                     process_id=self.process_id,
                     log_level=self.log_level + 1,
                 )
-                conv_units_list.append(conv_unit)
+            conv_units_list.append(conv_unit)
         self.conv_units = HObjList(conv_units_list)
+        # sum of the outputs of the conv units of all the channels, saturated
+        # to their width, one tree for each output of the Winograd tiles
+        if self.active_channels and self.winograd:
+            self.tile_adder_trees = HObjList(
+                AdderTree(
+                    inputs=len(self.active_channels),
+                    width=self.width,
+                    signed=True,
+                    output_width=self.width,
+                    saturate=True,
+                    pipeline=self.adder_pipeline,
+                    layer_id=self.layer_id,
+                    unit_id=self.unit_id,
+                    process_id=self.process_id,
+                    log_level=self.log_level + 1,
+                )
+                for t in range(self.tile)
+            )
+        elif self.active_channels:
+            self.adder_tree = AdderTree(
+                inputs=len(self.active_channels),
+                width=self.width,
+                signed=True,
+                output_width=self.width,
+                saturate=True,
+                pipeline=self.adder_pipeline,
+                layer_id=self.layer_id,
+                unit_id=self.unit_id,
+                process_id=self.process_id,
+                log_level=self.log_level + 1,
+            )
 
         name = f"MultiChannelConvUnitL{self.layer_id}"
+        if self.kernels is not None or len(self.active_channels) < self.channels:
+            # the units with other kernels or channels are different entities,
+            # named after the first unit of the part with them
+            name += f"P{self.process_id}U{self.unit_id}"
+        elif self.shared_units:
+            name += "S"
+        elif self.winograd:
+            name += "W"
         self._name = name
         self._hdl_module_name = name
 
     def __map_conv_signals(self, data_width):
         output_list = []
+        if self.winograd:
+            data_width = Bits(bit_length=self.tile * self.width, force_vector=True)
 
-        for i in range(self.channels):
-            conv_unit = self.conv_units[i]
+        for k, i in enumerate(self.active_channels):
+            output = self._sig(name=f"wire_outputs_{i}", dtype=data_width)
+            if self.shared_units:
+                output(getattr(self, f"conv_output_{i}"))
+                output_list.append(output)
+                continue
+
+            conv_unit = self.conv_units[k]
+            if not self.binary and not self.winograd:
+                conv_unit.en_window(self.en_window)
             conv_unit.en_mult(self.en_mult)
             conv_unit.en_sum(self.en_sum)
             conv_unit.input(
                 self.input[
                     (i + 1)
                     * self.INPUT_WIDTH
-                    * self.size : i
+                    * self.window : i
                     * self.INPUT_WIDTH
-                    * self.size
+                    * self.window
                 ]
             )
 
@@ -139,84 +265,82 @@ class MultiChannelConvUnit(Unit):
                 kernel_sig = getattr(self, f"kernel_sig_{i}")
                 conv_unit.kernel_abs(kernel_abs)
                 conv_unit.kernel_sig(kernel_sig)
-            else:
-                for j in range(self.size):
+            elif self.kernels is None:
+                for j in range(self.window):
                     conv_kernel_port = getattr(conv_unit, f'kernel_{j}')
-                    parent_kernel_port = getattr(self, f'kernel_{i*self.size+j}')
+                    parent_kernel_port = getattr(self, f'kernel_{i*self.window+j}')
                     conv_kernel_port(parent_kernel_port)
 
-            output = self._sig(name=f"wire_outputs_{i}", dtype=data_width)
             output(conv_unit.output)
             output_list.append(output)
         return output_list
 
-    def __tree_conv_adders(self, data_width, conv_outputs):
-        acc = [
-            self._sig(name=f"acc_{i}", dtype=data_width, def_val=0)
-            for i in range(self.acc_id + 1)
-        ]
-
-        if self.tree_cond:
-            for i in range(self.half_elements):
-                if self.acc_id - 1 - i < self.channels and self.acc_id - 1 - i != i:
-                    acc[i](conv_outputs[i] + conv_outputs[self.acc_id - 1 - i])
-                else:
-                    acc[i](conv_outputs[i])
-        else:
-            for i in range(self.half_elements):
-                acc[i](conv_outputs[i] + conv_outputs[self.channels - 1 - i])
-
-        n_elements = self.half_elements
-        output_index = self.half_elements
-        input_index = 0
-
-        while n_elements > 0:
-            for i in range(int(n_elements / 2)):
-                acc[output_index + i](
-                    acc[input_index + i] + acc[input_index + n_elements - i - 1]
-                )
-            n_elements = int(n_elements / 2)
-            input_index = output_index
-            output_index += n_elements
-
-        return acc[self.acc_id - 1]
-
-    def __right_shift(self, signed_value, shift_offset):
-        mask_dtype = Bits(bit_length=self.width, force_vector=True)
-        mask_value = 2 ** (self.width - 1) - 2 ** (shift_offset)
-        shift_mask = self._sig(name="shift_mask", dtype=mask_dtype, def_val=mask_value)
-        shift_value = self._sig(name="shift_value", dtype=mask_dtype)
-
-        negative_fill_value = 2 ** (self.width) - 2 ** (self.width - shift_offset - 1)
-        negative_fill = self._sig(
-            name="negative_fill", dtype=mask_dtype, def_val=negative_fill_value
+    def __outputs_valid(self):
+        # the outputs of the binary units are valid with en_sum, the others
+        # are registered by en_sum and valid in the next cycle
+        if self.binary:
+            return self.en_sum
+        outputs_valid = self._sig(name="outputs_valid")
+        If(self.rst, outputs_valid(0)).Else(
+            If(self.clk._onRisingEdge(), outputs_valid(self.en_sum))
         )
-        unsigned_mask = shift_mask._convSign(False)
+        return outputs_valid
+
+    def __channel_sum(self, conv_outputs, data_width, outputs_valid, tile=None):
+        # without active channels there are no adder trees and the sum is 0
+        if not conv_outputs:
+            return 0
+        if tile is None:
+            adder_tree = self.adder_tree
+            suffix = ""
+        else:
+            adder_tree = self.tile_adder_trees[tile]
+            suffix = f"_{tile}"
+        if adder_tree.latency:
+            adder_tree.en(outputs_valid)
+        adder_tree.input(Concat(*reversed(conv_outputs)))
+        channel_sum = adder_tree.output
+        # the tree of the active channels has less levels than the one of
+        # all the channels when some were removed
+        for i in range(self.channel_latency - adder_tree.latency):
+            delay = self._sig(name=f"channel_delay{suffix}_{i}", dtype=data_width)
+            If(self.rst, delay(0)).Else(
+                If(self.clk._onRisingEdge(), delay(channel_sum))
+            )
+            channel_sum = delay
+        return channel_sum
+
+    def __right_shift(self, signed_value, shift_offset, suffix=""):
+        # arithmetic shift of the negative values (a leaky slope of 1 /
+        # 2 ** shift_offset), the same fraction of the value in any fixed
+        # point format of the layer
+        shift_dtype = Bits(bit_length=self.width, force_vector=True)
+        shift_value = self._sig(name=f"shift_value{suffix}", dtype=shift_dtype)
         unsigned_value = signed_value._convSign(False)
-        unsigned_fill = negative_fill._convSign(False)
-        shift_value((unsigned_mask & unsigned_value) + unsigned_fill)
+        sign = unsigned_value[self.width - 1]
+        shift_value(Concat(*[sign] * shift_offset, unsigned_value[self.width : shift_offset]))
         return shift_value
 
-    def _impl(self):
-        propagateClkRst(self)
+    def __batch_activation(self, channel_sum, output, suffix=""):
         data_width = Bits(bit_length=self.width, signed=True)
         double_width = Bits(bit_length=self.width * 2, signed=True)
-        conv_outputs = self.__map_conv_signals(data_width)
-
-        reg_batch = self._sig(name="reg_batch", dtype=data_width)
-        reg_accumulator = self._sig(name="reg_accumulator", dtype=data_width)
+        reg_batch = self._sig(name=f"reg_batch{suffix}", dtype=data_width)
+        reg_accumulator = self._sig(name=f"reg_accumulator{suffix}", dtype=data_width)
 
-        bn_product = self._sig(name="bn_product", dtype=data_width)
+        bn_product = self._sig(name=f"bn_product{suffix}", dtype=data_width)
 
         # self.multiplier.param_a(reg_accumulator)
         # self.multiplier.param_b(self.ssi_coef)
         # bn_product(self.multiplier.product)
-        mult = self._sig(name="mult", dtype=double_width)
-        mult(reg_accumulator * self.ssi_coef._convSign(True))
-        bn_product[self.width - 1](mult[2 * self.width - 1])
-        bn_product[self.width - 1 : 0](
-            mult[self.lower_output_bit + self.width - 1 : self.lower_output_bit]
-        )
+        if self.fold_batch_norm:
+            bn_product(reg_accumulator)
+        else:
+            mult = self._sig(name=f"mult{suffix}", dtype=double_width)
+            mult(reg_accumulator * self.ssi_coef._convSign(True))
+            bn_product[self.width - 1](mult[2 * self.width - 1])
+            bn_product[self.width - 1 : 0](
+                mult[self.lower_output_bit + self.width - 1 : self.lower_output_bit]
+            )
 
         # If(self.rst, reg_batch(0), reg_accumulator(0)).Else(
         #     If(
@@ -227,7 +351,7 @@ class MultiChannelConvUnit(Unit):
         # ),
         # If(
         # self.en_channel,
-        reg_accumulator(self.__tree_conv_adders(data_width, conv_outputs))
+        reg_accumulator(channel_sum)
         #         ),
         #     )
         # )
@@ -237,7 +361,7 @@ class MultiChannelConvUnit(Unit):
             #     If(
             #         self.clk._onRisingEdge(),
             # If(self.en_act,
-            self.output(reg_batch[self.width - 1])
+            output(reg_batch[self.width - 1])
             # ),
         #     )
         # )
@@ -247,13 +371,38 @@ class MultiChannelConvUnit(Unit):
             #         self.clk._onRisingEdge(),
             #         If(
             #             self.en_act,
-            If(~reg_batch[self.width - 1], self.output(reg_batch)).Else(
-                self.output(self.__right_shift(reg_batch, 3))
+            If(~reg_batch[self.width - 1], output(reg_batch)).Else(
+                output(self.__right_shift(reg_batch, 3, suffix))
             )
         #         ),
         #     )
         # )
 
+    def _impl(self):
+        propagateClkRst(self)
+        data_width = Bits(bit_length=self.width, signed=True)
+        conv_outputs = self.__map_conv_signals(data_width)
+        outputs_valid = None
+        if conv_outputs and adder_tree_latency(len(conv_outputs), self.adder_pipeline):
+            outputs_valid = self.__outputs_valid()
+        if not self.winograd:
+            channel_sum = self.__channel_sum(conv_outputs, data_width, outputs_valid)
+            self.__batch_activation(channel_sum, self.output)
+            return
+
+        # the output t of the tiles of all the channels
+        for t in range(self.tile):
+            tile_outputs = [
+                output[(t + 1) * self.width : t * self.width] for output in conv_outputs
+            ]
+            channel_sum = self.__channel_sum(tile_outputs, data_width, outputs_valid, t)
+            tile_output = self._sig(
+                name=f"tile_output_{t}",
+                dtype=Bits(bit_length=self.OUTPUT_WIDTH, signed=True, force_vector=True),
+            )
+            self.__batch_activation(channel_sum, tile_output, f"_{t}")
+            self.output[(t + 1) * self.OUTPUT_WIDTH : t * self.OUTPUT_WIDTH](tile_output)
+
 
 if __name__ == '__main__':
     from sys import argv
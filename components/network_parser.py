@@ -1,9 +1,42 @@
+import os
 import yaml
 import logging
 
-from .conv_layer import ConvLayer
+import numpy as np
+
+from .buffer_layer import BufferLayer
+from .conv_layer import WEIGHTS_DATA_WIDTH, ConvLayer, weight_memory_map
 from .max_pool_layer import MaxPoolLayer
-from .utils import read_floats
+from .network_top import NetworkTop, stream_stages
+from .layer_controller import LayerController, layer_schedule
+from .build_manifest import BuildManifest
+from .profiler import enable_profiling, write_profile
+from .scheduler import STATS_FILE, CostModel, GenerationError, JobScheduler, job_record
+from .golden_model import conv_unit, layer_format, to_signed, winograd_conv_unit
+from .pipeline import constant_multiplier_latency
+from .utils import (
+    batch_norm_folding_error,
+    conv_coefficients,
+    float2fixed_array,
+    prune_conv_kernels,
+    quantize_conv_weights,
+    read_floats,
+    select_fixed_point_format,
+    winograd_kernels,
+)
+from .weight_store import (
+    build_layer_index,
+    open_weight_store,
+    resolve_weight_slices,
+    weight_store_current,
+    write_weight_store,
+)
+
+# random input tiles of each part in the error report of the winograd layers
+WINOGRAD_TILES = 64
+# packed image of the weight memories and its address map
+WEIGHTS_IMAGE_FILE = "weights_image.bin"
+WEIGHTS_MAP_FILE = "weights_image.json"
 
 
 class NetworkParser:
@@ -12,38 +45,87 @@ class NetworkParser:
         with open(network_file) as stream:
             network = yaml.load(stream, Loader=yaml.FullLoader)
 
+        self.output_path = network["output_path"]
+        self.input_channels = network["channels"]
+        self.layer_groups = network["layer_groups"]
+        self.width = network["width"]
+        self.project = network.get("project", "darknet_hdl.qsf")
+        self.weights_store_file = network.get("weights_store_path")
+        self.memory_budget = network.get("memory_budget")
+        # jobs of each worker process before it is replaced, all by default
+        self.max_tasks_per_worker = network.get("max_tasks_per_worker")
+        self.fixed_point = network.get("fixed_point")
+        # top entity streaming the frames through all the layers
+        self.stream_top = network.get("stream_top", False)
+        # controllers of the enables of the conv and max pool layers
+        self.layer_controllers = network.get("layer_controllers", False) or self.stream_top
+
+        if not self.weights_store_file:
+            # the pickle files are converted once to a weights store, so the
+            # workers (and this process) map the same read only file instead
+            # of receiving the weights through the pool pipes
+            self.__read_pickle_files(network)
+        self.__read_weights_store()
+
+    def __read_weights_store(self):
+        # map the weights store file, the arrays are views over the mapping
+        self.logger.info(f"Mapping weights store {self.weights_store_file}...")
+        self.weights_store = open_weight_store(file_path=self.weights_store_file)
+        self.weights = self.weights_store["weights"]
+        self.variance = self.weights_store["variance"]
+        self.mean = self.weights_store["mean"]
+        self.scale = self.weights_store["scale"]
+        self.biases = self.weights_store["biases"]
+        self.logger.info(f"{len(self.weights)} float weights were mapped")
+
+    def __read_pickle_files(self, network):
         self.weight_file = network["weights_path"]
         self.variance_file = network["variance_path"]
         self.mean_file = network["mean_path"]
         self.scale_file = network["scale_path"]
         self.biases_file = network["biases_path"]
 
-        self.output_path = network["output_path"]
-        self.input_channels = network["channels"]
-        self.layer_groups = network["layer_groups"]
-        self.width = network["width"]
-        self.project = network.get("project", "darknet_hdl.qsf")
+        # the store of a previous run is kept while it is newer than the
+        # pickle files it was converted from
+        self.weights_store_file = f"{self.output_path}/weights_store.ywst"
+        sources = {
+            "weights": os.path.abspath(self.weight_file),
+            "variance": os.path.abspath(self.variance_file),
+            "mean": os.path.abspath(self.mean_file),
+            "scale": os.path.abspath(self.scale_file),
+            "biases": os.path.abspath(self.biases_file),
+        }
+        if weight_store_current(self.weights_store_file, sources):
+            self.logger.info(f"Weights store {self.weights_store_file} is up to date")
+            return
 
         # parse the float files
         self.logger.info("Reading weights...")
-        self.weights = read_floats(file_path=self.weight_file)
-        self.logger.info(f"{len(self.weights)} float values were readed")
+        weights = read_floats(file_path=self.weight_file)
+        self.logger.info(f"{len(weights)} float values were readed")
         self.logger.info("Reading variance...")
-        self.variance = read_floats(file_path=self.variance_file)
-        self.logger.info(f"{len(self.variance)} float values were readed")
+        variance = read_floats(file_path=self.variance_file)
+        self.logger.info(f"{len(variance)} float values were readed")
         self.logger.info("Reading mean...")
-        self.mean = read_floats(file_path=self.mean_file)
-        self.logger.info(f"{len(self.mean)} float values were readed")
+        mean = read_floats(file_path=self.mean_file)
+        self.logger.info(f"{len(mean)} float values were readed")
         self.logger.info("Reading scale...")
-        self.scale = read_floats(file_path=self.scale_file)
-        self.logger.info(f"{len(self.scale)} float values were readed")
+        scale = read_floats(file_path=self.scale_file)
+        self.logger.info(f"{len(scale)} float values were readed")
         self.logger.info("Reading biases...")
-        self.biases = read_floats(file_path=self.biases_file)
-        self.logger.info(f"{len(self.biases)} float values were readed")
-
-        # initialize index of buckets to each conv layer
-        self.weights_reference = 0
-        self.layer_variables_reference = 0
+        biases = read_floats(file_path=self.biases_file)
+        self.logger.info(f"{len(biases)} float values were readed")
+
+        os.makedirs(self.output_path, exist_ok=True)
+        self.logger.info(f"Writing weights store {self.weights_store_file}...")
+        arrays = {
+            "weights": weights,
+            "variance": variance,
+            "mean": mean,
+            "scale": scale,
+            "biases": biases,
+        }
+        write_weight_store(self.weights_store_file, arrays, sources=sources)
 
     def __parse_layer(self, index, layer, filters, channels):
         self.logger.info(f"Parsing {layer['type']}: {layer}")
@@ -63,21 +145,90 @@ class NetworkParser:
         bin_output = layer["bin_output"]
         parallelism = layer.get("parallelism", 8)
         process_filters = int(filters / parallelism)
-
-        for process_id in range(parallelism):
-            # update start and end indexes of weights
-            weights_index = self.weights_reference
-            weights_offset = (size ** 2) * channels * process_filters
-            weights_offset += weights_index
-
-            layer_variables_index = self.layer_variables_reference
-            layer_variables_offset = process_filters + layer_variables_index
-
-            layer_weights = self.weights[weights_index:weights_offset]
-            layer_biases = self.biases[layer_variables_index:layer_variables_offset]
-            layer_scale = self.scale[layer_variables_index:layer_variables_offset]
-            layer_mean = self.mean[layer_variables_index:layer_variables_offset]
-            layer_variance = self.variance[layer_variables_index:layer_variables_offset]
+        datapath_args = {"width": layer["width"]} if "width" in layer else {}
+        if self.fixed_point is not None:
+            datapath_args = self.__select_fixed_point(index, layer, process_filters, channels)
+        # the parts requantize the codes of the previous conv layer when they
+        # have another format (width, integer_portion, decimal_portion)
+        conv_format = layer_format(datapath_args)
+        if self.conv_format not in [None, conv_format] and not bin_input:
+            datapath_args["input_format"] = self.conv_format
+            self.logger.info(
+                f"Layer {index}: the inputs are requantized from the {self.conv_format} "
+                f"format to {conv_format}"
+            )
+        self.conv_format = conv_format
+        # the max pool layers have the width of the previous conv layer
+        self.datapath_width = datapath_args.get("width")
+        # levels of the adder trees between registers
+        if "adder_pipeline" in layer:
+            datapath_args["adder_pipeline"] = layer["adder_pipeline"]
+        # ssi folded into the kernels of the non binary layers
+        if layer.get("fold_batch_norm") and not binary:
+            datapath_args["fold_batch_norm"] = True
+            self.__report_folding(index, layer, process_filters, channels, datapath_args)
+        # each multi channel conv unit computes filter_folding filters of the
+        # part in sequence, with their coefficients in roms
+        folding = layer.get("filter_folding", 1)
+        if folding > 1:
+            unsupported = ["constant_kernels", "prune_kernels"]
+            if process_filters % folding or any(layer.get(key) for key in unsupported):
+                raise ValueError(
+                    f"Layer {index}: filter_folding needs a divisor of the {process_filters} "
+                    "filters of each part, without constant_kernels and prune_kernels"
+                )
+            datapath_args["filter_folding"] = folding
+            self.logger.info(
+                f"Layer {index}: {process_filters // folding} multi channel conv units "
+                f"for the {process_filters} filters of each part"
+            )
+        # coefficients of each part in memories written by the host through
+        # an avalon slave, loaded from the packed image of the weights
+        if layer.get("weight_memory"):
+            unsupported = ["constant_kernels", "prune_kernels", "kernel_rom"]
+            if any(layer.get(key) for key in unsupported):
+                raise ValueError(
+                    f"Layer {index}: weight_memory needs a layer without constant_kernels, "
+                    "prune_kernels and kernel_rom"
+                )
+            datapath_args["weight_memory"] = True
+        # coefficients of each part read from synchronous roms, written with
+        # their initialization files
+        if layer.get("kernel_rom"):
+            unsupported = ["constant_kernels", "prune_kernels"]
+            if any(layer.get(key) for key in unsupported):
+                raise ValueError(
+                    f"Layer {index}: kernel_rom needs a layer without constant_kernels "
+                    "and prune_kernels"
+                )
+            datapath_args["kernel_rom"] = True
+        # multipliers specialized for the kernel codes of each conv unit
+        if layer.get("constant_kernels"):
+            datapath_args["constant_kernels"] = True
+            if not binary and datapath_args.get("adder_pipeline"):
+                datapath_args["multiplier_latency"] = self.__constant_kernels_latency(
+                    index, layer, process_filters, channels, datapath_args
+                )
+        # conv units with zero kernels removed and binary ones shared
+        if layer.get("prune_kernels"):
+            datapath_args["prune_kernels"] = True
+            self.__report_pruning(index, layer, process_filters, channels, datapath_args)
+        # 2x2 outputs of each 4x4 tile with the Winograd conv units
+        if layer.get("winograd"):
+            unsupported = ["constant_kernels", "prune_kernels"]
+            if binary or bin_input or size != 3 or any(layer.get(key) for key in unsupported):
+                raise ValueError(
+                    f"Layer {index}: winograd needs a non binary 3x3 layer without "
+                    "bin_input, constant_kernels and prune_kernels"
+                )
+            datapath_args["winograd"] = True
+            self.__report_winograd(index, layer, process_filters, channels, datapath_args)
+
+        for part in self.layer_index[index]:
+            # get start and end indexes of the weights of this part
+            process_id = part["process_id"]
+            weights_index, weights_offset = part["weights"]
+            layer_variables_index, layer_variables_offset = part["variables"]
 
             layer = {
                 "class": ConvLayer,
@@ -90,18 +241,15 @@ class NetworkParser:
                     "binary": binary,
                     "bin_input": bin_input,
                     "bin_output": bin_output,
-                    "weights": layer_weights,
-                    "biases": layer_biases,
-                    "scale": layer_scale,
-                    "mean": layer_mean,
-                    "variance": layer_variance,
+                    "weights_store": self.weights_store_file,
+                    "weights_slice": (weights_index, weights_offset),
+                    "variables_slice": (layer_variables_index, layer_variables_offset),
                     "layer_id": index,
                     "process_id": process_id,
+                    **datapath_args,
                 },
             }
             self.layers.append(layer)
-            self.weights_reference = weights_offset + 1
-            self.layer_variables_reference = layer_variables_offset + 1
 
         layer = {
             "class": ConvLayer,
@@ -117,13 +265,217 @@ class NetworkParser:
                 "layer_id": index,
                 "parallelism": parallelism,
                 "top_entity": True,
+                **datapath_args,
             },
         }
         self.layers.append(layer)
+        self.feature_channels = filters
+
+    def __select_fixed_point(self, index, layer, process_filters, channels):
+        # the format of a layer is chosen from the coefficients of all its
+        # parts, as they are quantized by the conv layers
+        values = []
+        for part in self.layer_index[index]:
+            weights = resolve_weight_slices(
+                self.weights_store_file, part["weights"], part["variables"]
+            )
+            coefficients = conv_coefficients(
+                filters=process_filters,
+                channels=channels,
+                size=layer["size"] ** 2,
+                binary=layer["binary"],
+                fold_batch_norm=layer.get("fold_batch_norm", False),
+                **weights,
+            )
+            values += [coefficients[name].ravel() for name in ["ssi", "bn", "kernel"]]
+
+        widths = self.fixed_point.get("widths", [8, 16])
+        if "width" in layer:
+            widths = [layer["width"]]
+        error_budget = self.fixed_point.get("error_budget", 0.01)
+        width, integer_portion, decimal_portion, error = select_fixed_point_format(
+            np.concatenate(values), widths, error_budget
+        )
+        if error > error_budget:
+            self.logger.warning(
+                f"Layer {index}: the error {error:.5f} of the {width} bits format "
+                f"exceeds the budget {error_budget}"
+            )
+        self.logger.info(
+            f"Layer {index}: {width} bits, Q{integer_portion}.{decimal_portion} "
+            f"format (error {error:.5f})"
+        )
+        return {
+            "width": width,
+            "integer_portion": integer_portion,
+            "decimal_portion": decimal_portion,
+        }
+
+    def __constant_kernels_latency(
+        self, index, layer, process_filters, channels, datapath_args
+    ):
+        # the latency of the deepest constant multiplier of all the parts of
+        # a layer, so the outputs of all its filters are aligned
+        codes = []
+        for part in self.layer_index[index]:
+            weights = resolve_weight_slices(
+                self.weights_store_file, part["weights"], part["variables"]
+            )
+            part_codes = quantize_conv_weights(
+                filters=process_filters,
+                channels=channels,
+                size=layer["size"] ** 2,
+                width=datapath_args.get("width", 16),
+                binary=False,
+                integer_portion=datapath_args.get("integer_portion"),
+                decimal_portion=datapath_args.get("decimal_portion"),
+                fold_batch_norm=datapath_args.get("fold_batch_norm", False),
+                **weights,
+            )
+            codes.append(np.unique(part_codes["kernel"]))
+        return constant_multiplier_latency(
+            np.unique(np.concatenate(codes)),
+            datapath_args.get("width", 16),
+            datapath_args.get("decimal_portion"),
+            datapath_args["adder_pipeline"],
+        )
+
+    def __report_folding(self, index, layer, process_filters, channels, datapath_args):
+        # the requantization error of the folded kernels of a layer, the mean
+        # of the errors of its parts (all of them have the same filters)
+        folded_errors = []
+        errors = []
+        for part in self.layer_index[index]:
+            weights = resolve_weight_slices(
+                self.weights_store_file, part["weights"], part["variables"]
+            )
+            folded_error, error = batch_norm_folding_error(
+                filters=process_filters,
+                channels=channels,
+                size=layer["size"] ** 2,
+                width=datapath_args.get("width", 16),
+                integer_portion=datapath_args.get("integer_portion"),
+                decimal_portion=datapath_args.get("decimal_portion"),
+                **weights,
+            )
+            folded_errors.append(folded_error)
+            errors.append(error)
+
+        folding = {
+            "error": float(np.mean(folded_errors)),
+            "unfolded_error": float(np.mean(errors)),
+        }
+        self.folding[f"ConvLayerL{index}"] = folding
+        self.logger.info(
+            f"Layer {index}: batch normalization folded into the kernels with "
+            f"error {folding['error']:.5f} (unfolded {folding['unfolded_error']:.5f})"
+        )
+
+    def __report_pruning(self, index, layer, process_filters, channels, datapath_args):
+        # the conv units removed from all the parts of a layer, found in the
+        # same way as the conv layers prune them
+        width = datapath_args.get("width", 16)
+        savings = {"total": 0, "zero": 0, "duplicate": 0}
+        for part in self.layer_index[index]:
+            weights = resolve_weight_slices(
+                self.weights_store_file, part["weights"], part["variables"]
+            )
+            codes = quantize_conv_weights(
+                filters=process_filters,
+                channels=channels,
+                size=layer["size"] ** 2,
+                width=width,
+                binary=layer["binary"],
+                integer_portion=datapath_args.get("integer_portion"),
+                decimal_portion=datapath_args.get("decimal_portion"),
+                **weights,
+            )
+            pruning = prune_conv_kernels(codes, binary=layer["binary"], width=width)
+            for key in savings:
+                savings[key] += pruning[key]
+
+        self.pruning[f"ConvLayerL{index}"] = savings
+        self.logger.info(
+            f"Layer {index}: {savings['zero']} zero and {savings['duplicate']} "
+            f"duplicate conv units removed of {savings['total']}"
+        )
+
+    def __report_winograd(self, index, layer, process_filters, channels, datapath_args):
+        # the outputs of the Winograd and direct conv units of all the parts
+        # for random tiles, against the exact sums of the products of their
+        # 3x3 windows (the quantized kernels and inputs, without rounding)
+        width, integer_portion, decimal_portion = layer_format(datapath_args)
+        rng = np.random.default_rng(index)
+        errors = {"winograd": [], "direct": []}
+        difference = 0
+        for part in self.layer_index[index]:
+            weights = resolve_weight_slices(
+                self.weights_store_file, part["weights"], part["variables"]
+            )
+            kernels = quantize_conv_weights(
+                filters=process_filters,
+                channels=channels,
+                size=9,
+                width=width,
+                binary=False,
+                integer_portion=integer_portion,
+                decimal_portion=decimal_portion,
+                fold_batch_norm=datapath_args.get("fold_batch_norm", False),
+                **weights,
+            )["kernel"]
+            # tiles x filters x channels x 16 and the 3x3 windows of their
+            # 2x2 outputs, the inputs are scaled so no window sum overflows
+            weights_sum = np.max(np.sum(np.abs(to_signed(kernels, width)), axis=-1))
+            limit = 2.0 ** integer_portion * min(1.0, 2.0 ** decimal_portion / max(weights_sum, 1))
+            tiles = float2fixed_array(
+                rng.uniform(-limit, limit, (WINOGRAD_TILES, 1, channels, 16)),
+                integer_portion,
+                decimal_portion,
+            )
+            grid = tiles.reshape(tiles.shape[:-1] + (4, 4))
+            windows = np.stack(
+                [
+                    grid[..., r : r + 3, c : c + 3].reshape(tiles.shape[:-1] + (9,))
+                    for r in range(2)
+                    for c in range(2)
+                ],
+                axis=-2,
+            )
+
+            exact = np.sum(
+                to_signed(windows, width) * to_signed(kernels, width)[:, :, None, :], axis=-1
+            ) / 2.0 ** (2 * decimal_portion)
+            direct = conv_unit(windows, kernels[:, :, None, :], width, decimal_portion)
+            winograd = winograd_conv_unit(
+                tiles, winograd_kernels(kernels, width), width, decimal_portion
+            )
+            rms = np.sqrt(np.mean(exact ** 2)) or 1.0
+            for name, outputs in [("winograd", winograd), ("direct", direct)]:
+                values = to_signed(outputs, width) / 2.0 ** decimal_portion
+                errors[name].append(np.sqrt(np.mean((values - exact) ** 2)) / rms)
+            difference = max(
+                difference, int(np.max(np.abs(to_signed(winograd - direct, width))))
+            )
+
+        report = {
+            "error": float(np.mean(errors["winograd"])),
+            "direct_error": float(np.mean(errors["direct"])),
+            "max_difference": difference,
+        }
+        self.winograd[f"ConvLayerL{index}"] = report
+        self.logger.info(
+            f"Layer {index}: Winograd conv units with error {report['error']:.5f} "
+            f"(direct {report['direct_error']:.5f}, outputs differ by up to "
+            f"{report['max_difference']} codes)"
+        )
 
     def __parse_max_pool_layer(self, index, layer, filters, channels):
         binary = layer["binary"]
-        self.width /= 2
+        self.image_width //= 2
+        # the 2x2 windows of a max pool do not overlap, the buffer layer
+        # before it only validates one of each four windows
+        if self.layers and self.layers[-1]["class"] is BufferLayer:
+            self.layers[-1]["args"]["stride"] = 2
 
         layer = {
             "class": MaxPoolLayer,
@@ -131,6 +483,27 @@ class NetworkParser:
             "path": f"{self.output_path}",
             "args": {"filters": filters, "binary": binary, "layer_id": index},
         }
+        if self.datapath_width is not None:
+            layer["args"]["width"] = self.datapath_width
+        self.layers.append(layer)
+
+    def __parse_buffer_layer(self, index, layer, filters, channels):
+        binary = layer["binary"]
+
+        layer = {
+            "class": BufferLayer,
+            "filename": f"BufferLayerL{index}",
+            "path": f"{self.output_path}",
+            "args": {
+                "channels": self.feature_channels,
+                "image_width": self.image_width,
+                "size": layer["scattering"],
+                "binary": binary,
+                "layer_id": index,
+            },
+        }
+        if self.datapath_width is not None:
+            layer["args"]["width"] = self.datapath_width
         self.layers.append(layer)
 
     def parse_network(self):
@@ -139,57 +512,261 @@ class NetworkParser:
         channels = self.input_channels
         # intialize array of layers
         self.layers = []
+        self.datapath_width = None
+        # fixed point format of the previous conv layer
+        self.conv_format = None
+        # pixels of each row of the feature map, halved by each max pool
+        self.image_width = self.width
+        # conv units removed from each layer with prune_kernels
+        self.pruning = {}
+        # requantization error of each layer with fold_batch_norm
+        self.folding = {}
+        # fixed point error of each layer with winograd
+        self.winograd = {}
+        # initialize index of buckets to each conv layer
+        self.layer_index = build_layer_index(self.input_channels, self.layer_groups)
+        if self.weights_store.layers:
+            if self.weights_store.layers != self.layer_index:
+                raise ValueError(
+                    f"The layer index of {self.weights_store_file} does not "
+                    "match the layer groups of the network config"
+                )
         index = 0
 
         for group in self.layer_groups:
             # get the number of outputs of the current group
             filters = group["filters"]
+            # channels of the feature map before the first conv layer
+            self.feature_channels = channels
             for layer in group["layers"]:
                 self.__parse_layer(index, layer, filters, channels)
                 index += 1
             # update number of inputs of the next layers
             channels = filters
+
+        stages = stream_stages(self.layers) if self.stream_top else None
+        if self.layer_controllers:
+            self.__parse_layer_controllers()
+        if self.stream_top:
+            self.layers.append(
+                {
+                    "class": NetworkTop,
+                    "filename": "NetworkTop",
+                    "path": f"{self.output_path}",
+                    "args": {"stages": stages, "top_entity": True},
+                }
+            )
         return self.layers
 
-    def build_project(self, layers):
-        text = "\n"
-        for i in range(len(layers) - 1, -1, -1):
-            filename = f"{layers[i]['filename']}.vhd"
-            path = f"{layers[i]['path']}"
+    def __parse_layer_controllers(self):
+        # one controller for each conv and max pool layer, after all the
+        # layers, with the latency of their final args
+        controllers = []
+        for layer in self.layers:
+            kind = layer["class"].__name__
+            if kind == "MaxPoolLayer" or (kind == "ConvLayer" and layer["args"].get("top_entity")):
+                controllers.append(
+                    {
+                        "class": LayerController,
+                        "filename": f"{layer['filename']}Controller",
+                        "path": f"{self.output_path}",
+                        "args": {
+                            "kind": kind,
+                            "layer_id": layer["args"]["layer_id"],
+                            **layer_schedule(layer),
+                        },
+                    }
+                )
+        self.layers += controllers
+
+    def build_project(self, layers, summary=None):
+        """
+        Appends the generated files to the quartus project. When the summary
+        returned by generate is given, the files written by the converter
+        are used instead of the default vhdl file names.
+        """
+        files = [f"{layer['path']}/{layer['filename']}.vhd" for layer in layers]
+        if summary is not None:
+            files = summary["files"]
 
+        text = "\n"
+        for i in range(len(files) - 1, -1, -1):
             text += "set_global_assignment -name VHDL_FILE "
-            text += f"{path}/{filename}\n"
+            text += f"{files[i]}\n"
 
         with open(self.project, "a+") as file:
             file.write(text)
 
-    def generate(self, layers, convert_function):
+    def write_weights_image(self, layers=None):
+        """
+        Writes the packed image of the weight memories of the conv layers
+        with weight_memory in the output path, so the host loads all the
+        weights in one burst: the little endian 32 bits words of the address
+        space of the avalon slave of NetworkTop, with each layer in a slot as
+        large as the largest one (the slaves of the layers are placed at the
+        same addresses without stream_top), and a json file with the name,
+        base byte address and address width of each layer. Returns the paths
+        of both files, or an empty list without weight memories.
+        """
+        import json
+
+        layers = self.layers if layers is None else layers
+        layer_tops = []
+        for layer in layers:
+            args = layer["args"]
+            if layer["class"] is ConvLayer and args.get("top_entity") and args.get("weight_memory"):
+                layer_tops.append(layer)
+        if not layer_tops:
+            return []
+        memory_maps = [weight_memory_map(**layer["args"]) for layer in layer_tops]
+        slot_width = max(memory_map["address_width"] for memory_map in memory_maps)
+        image = np.zeros(len(layer_tops) << slot_width, dtype="<u4")
+        slots = []
+        for slot, (layer_top, memory_map) in enumerate(zip(layer_tops, memory_maps)):
+            base = slot << slot_width
+            layer_id = layer_top["args"]["layer_id"]
+            for layer in layers:
+                args = dict(layer["args"])
+                if layer["class"] is not ConvLayer or args.get("top_entity"):
+                    continue
+                if args["layer_id"] != layer_id:
+                    continue
+                args.update(
+                    resolve_weight_slices(
+                        args.pop("weights_store"),
+                        args.pop("weights_slice"),
+                        args.pop("variables_slice"),
+                    )
+                )
+                words = ConvLayer(**args).weight_words()
+                offset = base + (args["process_id"] << memory_map["part_width"])
+                image[offset : offset + len(words)] = words
+            slots.append(
+                {
+                    "layer": layer_top["filename"],
+                    "base": 4 * base,
+                    "address_width": memory_map["address_width"],
+                }
+            )
+            self.logger.info(
+                f"{layer_top['filename']}: weights at 0x{4 * base:x}, "
+                f"{1 << memory_map['address_width']} words"
+            )
+
+        image_file = f"{self.output_path}/{WEIGHTS_IMAGE_FILE}"
+        map_file = f"{self.output_path}/{WEIGHTS_MAP_FILE}"
+        os.makedirs(self.output_path, exist_ok=True)
+        image.tofile(image_file)
+        with open(map_file, "w") as file:
+            weights_map = {"data_width": WEIGHTS_DATA_WIDTH, "slot_width": slot_width, "layers": slots}
+            json.dump(weights_map, file, indent=2)
+        return [image_file, map_file]
+
+    def generate(
+        self, layers, convert_function, force=False, keep_going=False, profile=False
+    ):
+        """
+        Converts the layers with the convert function in a process pool and
+        returns a summary of the generation: the list of jobs, with the status
+        (done, skipped, failed or cancelled), file, duration, memory and error
+        of each one, the list of files of the done and skipped jobs and the
+        total duration. The first failure cancels the remaining jobs and
+        raises GenerationError, unless keep_going is set. With profile set,
+        the workers time each elaboration phase and the profile files are
+        written in the output path (see write_profile).
+        """
         from multiprocessing import Pool
+        from time import perf_counter
         import os
 
+        start = perf_counter()
         self.logger.info("Starting network convertion...")
         cores = round(os.cpu_count() * 4 / 4)
         self.logger.info(f"Multiprocessing: {cores} cpus...")
 
-        pool = Pool(processes=cores)
+        # jobs whose hash did not change since the last build are skipped
+        manifest = BuildManifest(self.output_path)
+        job_hashes = {}
+        records = {}
+        jobs = []
+        for layer in layers:
+            job_key = manifest.job_key(layer)
+            job_hash = manifest.job_hash(layer, convert_function)
+            if not force and manifest.is_up_to_date(layer, job_hash):
+                self.logger.info(f"{layer['filename']} is up to date, skipping...")
+                records[job_key] = job_record(
+                    layer, "skipped", file=manifest.jobs[job_key]["file"]
+                )
+                continue
+            job_hashes[job_key] = job_hash
+            jobs.append(layer)
+
+        # the biggest jobs are submitted first, limited by the memory budget
+        cost_model = CostModel(f"{self.output_path}/{STATS_FILE}")
+        scheduler = JobScheduler(cost_model, cores, self.memory_budget)
+
+        def job_done(layer, result):
+            job_hash = job_hashes[manifest.job_key(layer)]
+            manifest.update(layer, job_hash, result["file"])
+
+        pool = Pool(processes=cores, maxtasksperchild=self.max_tasks_per_worker)
         for i in range(cores):
             pool.apply_async(func=worker_healthcheck)
 
-        for i in range(len(layers)):
-            layer = layers[i]
-            layer_class = layer["class"]
-            layer_args = layer["args"]
-            path = layer["path"]
-            name = layer["filename"]
-
-            pool.apply_async(
-                func=worker_process,
-                args=([layer_class, str(path), str(name), convert_function]),
-                kwds=layer_args,
+        try:
+            job_records = scheduler.run(
+                pool,
+                jobs,
+                worker_process,
+                args=lambda layer: [
+                    layer["class"],
+                    str(layer["path"]),
+                    str(layer["filename"]),
+                    convert_function,
+                    profile,
+                ],
+                kwds=lambda layer: layer["args"],
+                callback=job_done,
+                keep_going=keep_going,
             )
+        except BaseException:
+            pool.terminate()
+            pool.join()
+            raise
+        # the scheduler already terminated the pool when it cancelled jobs
         pool.close()
         pool.join()
 
+        if profile:
+            write_profile(self.output_path, job_records)
+        for layer, record in zip(jobs, job_records):
+            record.pop("events", None)
+            records[manifest.job_key(layer)] = record
+        manifest.save()
+        cost_model.record(
+            [
+                {"layer": layer, "duration": job["duration"], "memory": job["memory"]}
+                for layer, job in zip(jobs, job_records)
+                if job["status"] == "done"
+            ]
+        )
+
+        summary = {"jobs": [records[manifest.job_key(layer)] for layer in layers]}
+        summary["files"] = [
+            job["file"] for job in summary["jobs"] if job["status"] in ("done", "skipped")
+        ]
+        summary["duration"] = perf_counter() - start
+        counts = {}
+        for job in summary["jobs"]:
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        self.logger.info(f"Generation finished in {summary['duration']:.2f}s: {counts}")
+
+        if counts.get("failed") and not keep_going:
+            raise GenerationError(summary)
+        # the image of the weights loaded by the host in the weight memories
+        summary["weights_image"] = self.write_weights_image()
+        return summary
+
 
 def worker_healthcheck():
     import logging
@@ -199,13 +776,70 @@ def worker_healthcheck():
     logger.info(f"Worker healthcheck: PID {os.getpid()}")
 
 
-def worker_process(layer_class, path, name, convert_function, **kwargs):
+def reset_peak_memory():
+    """
+    Resets the peak resident memory of the process (VmHWM, only in Linux),
+    so the peak read after a job is the one of that job and not the largest
+    one of the previous jobs of the worker.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def peak_memory():
+    """
+    Returns the peak resident memory of the process in megabytes, since the
+    last reset_peak_memory where it can be reset.
+    """
+    import resource
+
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def worker_process(layer_class, path, name, convert_function, profile=False, **kwargs):
+    from time import perf_counter
+
+    reset_peak_memory()
+    if profile:
+        profiler = enable_profiling()
+        profiler.job = name
+    start = perf_counter()
     try:
+        if "weights_store" in kwargs:
+            # map the weights of this part from the shared weights store
+            kwargs.update(
+                resolve_weight_slices(
+                    kwargs.pop("weights_store"),
+                    kwargs.pop("weights_slice"),
+                    kwargs.pop("variables_slice"),
+                )
+            )
         unit = layer_class(**kwargs)
-        convert_function(unit, path, name)
+        file = convert_function(unit, path, name)
+        result = {
+            "file": file,
+            "duration": perf_counter() - start,
+            "memory": peak_memory(),
+            "pid": os.getpid(),
+        }
+        if profile:
+            result["events"] = profiler.collect()
+        return result
     except Exception as e:
-        unit.logger.critical(e, exc_info=True)
-        raise
+        logging.getLogger("Worker").critical(e, exc_info=True)
+        # hwt exceptions keep references to netlist objects that can not be
+        # unpickled by the pool, which would stop its result handler thread
+        raise RuntimeError(f"{e.__class__.__name__}: {e}") from None
 
 
 if __name__ == '__main__':
@@ -0,0 +1,390 @@
+import logging
+
+from .utils import print_info
+from .buffer_layer import buffer_layer_padding
+from .conv_layer import WEIGHTS_DATA_WIDTH, weight_memory_map
+from .layer_controller import LayerController, layer_schedule
+
+from hwt.code import If, Concat
+from hwt.hdl.typeShortcuts import vec
+from hwt.hdl.types.bits import Bits
+from hwt.interfaces.std import Signal, VectSignal
+from hwt.synthesizer.unit import Unit
+from hwt.synthesizer.hObjList import HObjList
+
+# enables of each kind of layer, the ones of the conv and max pool layers are
+# driven by their LayerController
+STAGE_ENABLES = {
+    "ConvLayer": ["en_window", "en_mult", "en_sum", "en_channel", "en_batch", "en_act"],
+    "MaxPoolLayer": ["en_pool"],
+    "BufferLayer": ["en"],
+}
+
+
+def stream_stage(layer):
+    """
+    This function returns the stage of the stream of a layer returned by
+    NetworkParser.parse_network: its entity, the bits of its input and
+    output, the clock cycles from its input to its output and, for the conv
+    and max pool layers, the schedule of their enables. The conv layers with
+    weight_memory also have the address width of their avalon slave.
+    """
+    args = layer["args"]
+    kind = layer["class"].__name__
+    width = args.get("width", 16)
+    stage = {"name": layer["filename"], "kind": kind, "layer_id": args["layer_id"]}
+    if kind == "ConvLayer":
+        # the buffer layers form 3x3 windows, not the 4x4 tiles of the
+        # Winograd units
+        if args.get("winograd"):
+            raise ValueError(f"Winograd layer not supported by the stream: {layer['filename']}")
+        # the folded layers give the filters of each window in several cycles
+        if args.get("filter_folding", 1) > 1:
+            raise ValueError(f"Folded layer not supported by the stream: {layer['filename']}")
+        size = args["size"] ** 2
+        # the parts requantize the codes of a previous layer in another format
+        input_format = args.get("input_format") or (width,)
+        input_width = size * args["channels"] * (1 if args["bin_input"] else input_format[0])
+        output_width = args["filters"] * (1 if args["bin_output"] else width)
+        stage.update(layer_schedule(layer))
+        if args.get("weight_memory"):
+            stage["weights_address_width"] = weight_memory_map(**args)["address_width"]
+    elif kind == "MaxPoolLayer":
+        width = 1 if args["binary"] else width
+        input_width = 4 * width * args["filters"]
+        output_width = width * args["filters"]
+        stage.update(layer_schedule(layer))
+    elif kind == "BufferLayer":
+        input_width = (1 if args["binary"] else width) * args["channels"]
+        output_width = args["size"] ** 2 * input_width
+        stage["latency"] = 1
+        # the padding columns and rows streamed after each row and frame of
+        # the square feature map
+        stage["image_width"] = args["image_width"]
+        stage["padding"] = buffer_layer_padding(args["size"], args.get("stride", 1))
+    else:
+        raise ValueError(f"Layer not supported by the stream: {kind}")
+    stage.update({"input_width": input_width, "output_width": output_width})
+    return stage
+
+
+def stream_stages(layers):
+    """
+    This function returns the stages of the stream of a network, one for
+    each layer entity (the parts of the conv layers are inside their top
+    entities). The output of each stage must have the width of the input of
+    the next one, a buffer layer forms the windows of the layers after it
+    from the feature map and the padding streamed by NetworkTop.
+    """
+    # the controllers drive the enables of the layers in the stream
+    layers = [layer for layer in layers if layer["class"].__name__ != "LayerController"]
+    stages = [
+        stream_stage(layer)
+        for layer in layers
+        if layer["class"].__name__ != "ConvLayer" or layer["args"].get("top_entity")
+    ]
+    for stage, next_stage in zip(stages, stages[1:]):
+        if stage["output_width"] != next_stage["input_width"]:
+            raise ValueError(
+                f"The {stage['output_width']} bits output of {stage['name']} do not "
+                f"match the {next_stage['input_width']} bits input of {next_stage['name']}"
+            )
+    return stages
+
+
+# empty entity with the ports of a layer, each layer is generated in its own
+# file and only the top entity is written
+class StreamStage(Unit):
+    def __init__(
+        self,
+        name="",
+        kind="ConvLayer",
+        input_width=1,
+        output_width=1,
+        weights_address_width=0,
+        **kwargs,
+    ):
+        self.kind = kind
+        self.input_width = input_width
+        self.output_width = output_width
+        self.weights_address_width = weights_address_width
+
+        super().__init__()
+        self._hdl_module_name = name
+        self._name = name
+
+    def _declr(self):
+        self.clk = Signal()
+        self.rst = Signal()
+        for enable in STAGE_ENABLES[self.kind]:
+            setattr(self, enable, Signal())
+        self.input = VectSignal(self.input_width)
+        self.output = VectSignal(self.output_width)._m()
+        if self.kind == "BufferLayer":
+            self.valid = Signal()._m()
+        if self.weights_address_width:
+            self.avs_weights_address = VectSignal(self.weights_address_width)
+            self.avs_weights_write = Signal()
+            self.avs_weights_writedata = VectSignal(WEIGHTS_DATA_WIDTH)
+
+    def _impl(self):
+        self.output(
+            self._sig(
+                name="dummy_signal",
+                def_val=1,
+                dtype=Bits(self.output_width, force_vector=True),
+            )
+        )
+        if self.kind == "BufferLayer":
+            self.valid(1)
+
+
+class NetworkTop(Unit):
+    """
+    .. hwt-schematic::
+    """
+
+    def __init__(self, stages=[], top_entity=True, units=None, **kwargs):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.stages = stages
+        # the layers of the stages instead of their empty entities, to
+        # simulate the whole stream
+        self.units = units
+        self.input_width = stages[0]["input_width"]
+        self.output_width = stages[-1]["output_width"]
+        # the output fifo of each stage has room for the values in flight in
+        # its pipeline, plus the cycles to return a credit, so the stage takes
+        # an input every cycle while the next one reads its outputs
+        self.depths = [stage["latency"] + 2 for stage in stages]
+        # the avalon slave of the weight memories has a slot for each layer
+        # with weight_memory, as large as the largest one (the layout of
+        # NetworkParser.write_weights_image)
+        self.weights_stages = [
+            i for i, stage in enumerate(stages) if stage.get("weights_address_width")
+        ]
+        self.slot_width = max(
+            [stages[i]["weights_address_width"] for i in self.weights_stages], default=0
+        )
+        self.weights_address_width = self.slot_width + (len(self.weights_stages) - 1).bit_length()
+        self.top_entity = True
+        print_info(self, **kwargs)
+        super().__init__()
+
+    def _declr(self):
+        self.clk = Signal()
+        self.rst = Signal()
+        self.input = VectSignal(self.input_width)
+        self.input_valid = Signal()
+        self.input_ready = Signal()._m()
+        self.output = VectSignal(self.output_width)._m()
+        self.output_valid = Signal()._m()
+        self.output_ready = Signal()
+        if self.weights_stages:
+            self.avs_weights_address = VectSignal(self.weights_address_width)
+            self.avs_weights_write = Signal()
+            self.avs_weights_writedata = VectSignal(WEIGHTS_DATA_WIDTH)
+
+        if self.units is not None:
+            self.stage_units = HObjList(self.units)
+        else:
+            self.stage_units = HObjList(
+                StreamStage(
+                    name=stage["name"],
+                    kind=stage["kind"],
+                    input_width=stage["input_width"],
+                    output_width=stage["output_width"],
+                    weights_address_width=stage.get("weights_address_width", 0),
+                )
+                for stage in self.stages
+            )
+        # the controllers are generated in their own files as the layers
+        self.controllers = HObjList(
+            LayerController(
+                kind=stage["kind"],
+                enables=stage["enables"],
+                latency=stage["latency"],
+                layer_id=stage["layer_id"],
+                log_level=self.log_level + 1,
+            )
+            for stage in self.stages
+            if "enables" in stage
+        )
+
+        name = "NetworkTop"
+        self._hdl_module_name = name
+        self._name = name
+
+    def __extend(self, bit, bits, name):
+        # the extended bits are signals, the serializer does not keep the
+        # order of the concatenations inside the additions
+        extended = self._sig(name=name, dtype=Bits(bit_length=bits, force_vector=True))
+        extended(Concat(vec(0, bits - 1), bit))
+        return extended
+
+    def __credits(self, i, fire, returned):
+        # free places of the output fifo of a stage, taken by each input and
+        # returned when the next stage reads the fifo or a value is dropped
+        depth = self.depths[i]
+        credits_width = Bits(bit_length=depth.bit_length(), force_vector=True)
+        credits = self._sig(name=f"credits_{i}", dtype=credits_width)
+        taken = self.__extend(fire, depth.bit_length(), f"taken_{i}")
+        available = credits
+        for k, bit in enumerate(returned):
+            update = self._sig(name=f"credits_update_{i}_{k}", dtype=credits_width)
+            update(available + self.__extend(bit, depth.bit_length(), f"returned_{i}_{k}"))
+            available = update
+        If(self.rst, credits(depth)).Else(
+            If(self.clk._onRisingEdge(), credits(available - taken))
+        )
+        return ~credits._eq(0)
+
+    def __fifo(self, i, data, push, pop):
+        # first word fall through fifo, the head is read from the memory
+        depth = self.depths[i]
+        data_width = Bits(bit_length=self.stages[i]["output_width"], force_vector=True)
+        pointer_width = Bits(bit_length=max(depth - 1, 1).bit_length(), force_vector=True)
+        count_width = Bits(bit_length=depth.bit_length(), force_vector=True)
+        memory = self._sig(name=f"fifo_{i}", dtype=data_width[depth])
+        write_pointer = self._sig(name=f"write_pointer_{i}", dtype=pointer_width)
+        read_pointer = self._sig(name=f"read_pointer_{i}", dtype=pointer_width)
+        count = self._sig(name=f"count_{i}", dtype=count_width)
+
+        def step(pointer):
+            return If(pointer._eq(depth - 1), pointer(0)).Else(pointer(pointer + 1))
+
+        If(self.clk._onRisingEdge(), If(push, memory[write_pointer](data)))
+        If(self.rst, write_pointer(0), read_pointer(0), count(0)).Else(
+            If(
+                self.clk._onRisingEdge(),
+                If(push, step(write_pointer)),
+                If(pop, step(read_pointer)),
+                If(push & ~pop, count(count + 1)).Elif(pop & ~push, count(count - 1)),
+            )
+        )
+        head = self._sig(name=f"head_{i}", dtype=data_width)
+        head(memory[read_pointer])
+        return head, ~count._eq(0)
+
+    def __padding(self, i, fire):
+        # the columns and rows of the padding streamed after each row and
+        # frame of the feature map of a buffer layer, its pixels are not read
+        # from the previous stage
+        stage = self.stages[i]
+        image_width = stage["image_width"]
+        last = image_width + stage["padding"] - 1
+        counter_width = Bits(bit_length=max(last, 1).bit_length(), force_vector=True)
+        column = self._sig(name=f"pad_column_{i}", dtype=counter_width)
+        row = self._sig(name=f"pad_row_{i}", dtype=counter_width)
+        If(self.rst, column(0), row(0)).Else(
+            If(
+                self.clk._onRisingEdge(),
+                If(
+                    fire,
+                    If(
+                        column._eq(last),
+                        column(0),
+                        If(row._eq(last), row(0)).Else(row(row + 1)),
+                    ).Else(column(column + 1)),
+                ),
+            )
+        )
+        padding = self._sig(name=f"padding_{i}")
+        padding((column >= image_width) | (row >= image_width))
+        return padding
+
+    def __map_weights(self):
+        # the slot of each layer is above its addresses, the writes to the
+        # addresses of a slot out of its layer are ignored
+        address = self.avs_weights_address
+        for slot, i in enumerate(self.weights_stages):
+            unit = self.stage_units[i]
+            width = unit.weights_address_width
+            write = self.avs_weights_write
+            if width < self.weights_address_width:
+                write = write & address[self.weights_address_width : width]._eq(
+                    slot << (self.slot_width - width)
+                )
+            unit.avs_weights_write(write)
+            unit.avs_weights_address(address[width:0])
+            unit.avs_weights_writedata(self.avs_weights_writedata)
+
+    def _impl(self):
+        data = self.input
+        valid = self.input_valid
+        pops = [self._sig(name=f"pop_{i}") for i in range(len(self.stages))]
+        controllers = iter(self.controllers)
+
+        for i, stage in enumerate(self.stages):
+            unit = self.stage_units[i]
+            unit.clk(self.clk)
+            unit.rst(self.rst)
+            unit.input(data)
+
+            fire = self._sig(name=f"fire_{i}")
+            padding = None
+            if stage.get("padding"):
+                padding = self.__padding(i, fire)
+                valid = valid | padding
+            if stage["kind"] == "BufferLayer":
+                # the windows out of the stride are dropped
+                unit.en(fire)
+                output_valid = unit.valid
+                fired = self._sig(name=f"fired_{i}")
+                If(self.rst, fired(0)).Else(If(self.clk._onRisingEdge(), fired(fire)))
+                dropped = self._sig(name=f"dropped_{i}")
+                dropped(fired & ~unit.valid)
+                returned = [pops[i], dropped]
+            else:
+                # each input starts a window in the controller of the layer
+                controller = next(controllers)
+                controller.clk(self.clk)
+                controller.rst(self.rst)
+                controller.start(fire)
+                for enable in STAGE_ENABLES[stage["kind"]]:
+                    getattr(unit, enable)(getattr(controller, enable))
+                output_valid = controller.valid
+                returned = [pops[i]]
+            ready = self.__credits(i, fire, returned)
+            fire(valid & ready)
+
+            # the previous stage reads its fifo when this one takes an input,
+            # except for the pixels of the padding
+            if i == 0:
+                self.input_ready(ready if padding is None else ready & ~padding)
+            else:
+                pops[i - 1](fire if padding is None else fire & ~padding)
+            data, valid = self.__fifo(i, unit.output, output_valid, pops[i])
+
+        if self.weights_stages:
+            self.__map_weights()
+        pops[-1](valid & self.output_ready)
+        self.output(data)
+        self.output_valid(valid)
+
+
+if __name__ == "__main__":
+    from sys import argv
+    from utils import to_vhdl, get_std_logger
+
+    if len(argv) > 1:
+        path = argv[1]
+
+        get_std_logger()
+        enables = {
+            "en_window": 0,
+            "en_mult": 0,
+            "en_sum": 1,
+            "en_channel": 2,
+            "en_batch": 2,
+            "en_act": 2,
+        }
+        stages = [
+            {"name": "BufferLayerL0", "kind": "BufferLayer", "layer_id": 0, "input_width": 48},
+            {"name": "ConvLayerL1", "kind": "ConvLayer", "layer_id": 1, "input_width": 432},
+        ]
+        stages[0].update({"output_width": 432, "latency": 1})
+        stages[1].update({"output_width": 256, "latency": 2, "enables": enables})
+        unit = NetworkTop(stages=stages)
+        to_vhdl(unit, path, name="NetworkTop")
+    else:
+        print("file.py <outputpath>")
@@ -0,0 +1,114 @@
+from math import ceil, log2
+
+from .utils import csd_digits
+
+
+def adder_tree_levels(inputs=9):
+    """
+    This function returns the number of adder levels of a balanced tree over
+    the given number of inputs.
+    """
+    return ceil(log2(inputs)) if inputs > 1 else 0
+
+
+def adder_tree_latency(inputs=9, pipeline=0):
+    """
+    This function returns the clock cycles of an AdderTree: one register
+    every pipeline levels, without a register after the last level.
+    """
+    if not pipeline:
+        return 0
+    return max(adder_tree_levels(inputs) - 1, 0) // pipeline
+
+
+def adder_tree_shape(inputs=9, width=16, pipeline=0, output_width=None, saturate=False):
+    """
+    This function returns the levels of an AdderTree as a list of dicts with
+    the number of adders, the number of signals, their bit width and if they
+    are registered, following the same steps as AdderTree._impl. Each level
+    is one bit wider than the previous one. The trees that saturate their
+    output keep all the bits of the sums, the others stop at the output
+    width, the upper bits of the sums do not change the lower ones.
+    """
+    levels = []
+    n_levels = adder_tree_levels(inputs)
+    max_width = width + n_levels
+    if output_width is not None and not saturate:
+        max_width = max(width, output_width)
+    n_signals = inputs
+    for level in range(1, n_levels + 1):
+        adders = n_signals // 2
+        n_signals = adders + n_signals % 2
+        registered = bool(pipeline) and level % pipeline == 0 and level < n_levels
+        levels.append(
+            {
+                "adders": adders,
+                "signals": n_signals,
+                "width": min(width + level, max_width),
+                "registered": registered,
+            }
+        )
+    return levels
+
+
+def constant_multiplier_terms(coefficient=0, width=16, lower_output_bit=None):
+    """
+    This function returns the shifts and signs of the terms of a
+    ConstantMultiplier: the canonical signed digits of the coefficient as
+    FixedPointMultiplier extends it (its width - 1 lower bits, sign extended
+    from the bit width - 2 to 2 * width - 1 bits) up to the last bit of the
+    product.
+    """
+    if lower_output_bit is None:
+        lower_output_bit = int(width - width / 2)
+    data_b = coefficient & (2 ** (width - 1) - 1)
+    if (data_b >> (width - 2)) & 1:
+        data_b += (2 ** (width - 1) - 1) << (width - 1)
+    return csd_digits(data_b, lower_output_bit + width - 1)
+
+
+def constant_multiplier_latency(
+    coefficients=[], width=16, lower_output_bit=None, adder_pipeline=0
+):
+    """
+    This function returns the clock cycles of the ConstantMultipliers of a
+    set of coefficients, the cycles of the one with the deepest adder tree.
+    The outputs of the others are delayed to this latency, so all the
+    products of a unit are aligned.
+    """
+    latency = 0
+    for coefficient in coefficients:
+        terms = constant_multiplier_terms(int(coefficient), width, lower_output_bit)
+        tree_inputs = len(terms) + (1 if any(digit < 0 for _, digit in terms) else 0)
+        latency = max(latency, adder_tree_latency(tree_inputs, adder_pipeline))
+    return latency
+
+
+def multi_channel_conv_unit_latency(
+    channels=3, size=9, binary=True, adder_pipeline=0, multiplier_latency=None, winograd=False
+):
+    """
+    This function returns the clock cycles of a MultiChannelConvUnit from its
+    inputs to its output: the adder tree of its conv units, the multipliers
+    and the product and output registers of the non binary ones and the
+    tree of the channels. The Winograd units only have the product and
+    output registers.
+    """
+    if winograd and not binary:
+        return 2 + adder_tree_latency(channels, adder_pipeline)
+    latency = adder_tree_latency(size, adder_pipeline)
+    if not binary:
+        if multiplier_latency is None:
+            multiplier_latency = adder_tree_latency(15, adder_pipeline)
+        latency += multiplier_latency + 2
+    return latency + adder_tree_latency(channels, adder_pipeline)
+
+
+def kernel_rom_latency(kernel_rom=False, weight_memory=False):
+    """
+    This function returns the clock cycles added to a conv layer by the roms
+    (or the weight memories) of its coefficients: they read their words one
+    cycle after their address, so the input windows of the parts are
+    registered.
+    """
+    return int(bool(kernel_rom or weight_memory))
@@ -0,0 +1,164 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+PROFILE_FILE = "profile.json"
+TRACE_FILE = "profile_trace.json"
+UNIT_PHASES = ["__init__", "_declr", "_impl"]
+
+
+class Profiler:
+    """
+    Records the duration of the elaboration phases of the current process as
+    chrome trace events. Nested phases are kept in a stack so each event also
+    has its self time, without the time spent in the phases inside it.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.stack = []
+        self.job = None
+
+    @contextmanager
+    def phase(self, name, category):
+        start = time.time_ns() // 1000
+        self.stack.append(0)
+        try:
+            yield
+        finally:
+            duration = time.time_ns() // 1000 - start
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += duration
+            self.events.append(
+                {
+                    "name": f"{category}.{name}",
+                    "cat": name,
+                    "ph": "X",
+                    "ts": start,
+                    "dur": duration,
+                    "pid": os.getpid(),
+                    "tid": 0,
+                    "args": {
+                        "job": self.job,
+                        "class": category,
+                        "phase": name,
+                        "self": duration - children,
+                    },
+                }
+            )
+
+    def collect(self):
+        events = self.events
+        self.events = []
+        return events
+
+
+_profiler = None
+
+
+def _all_subclasses(cls):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _all_subclasses(subclass)
+
+
+def _wrap_method(cls, method_name, category, phase):
+    method = cls.__dict__.get(method_name)
+    if method is None:
+        return
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        with _profiler.phase(phase, category):
+            return method(*args, **kwargs)
+
+    setattr(cls, method_name, wrapper)
+
+
+def enable_profiling():
+    """
+    This function instruments the constructor, _declr and _impl of every hwt
+    unit of the components package, the hwt to_rtl function and the write of
+    the store managers, and returns the profiler of the current process. It
+    only instruments the classes in the first call of each process.
+    """
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+    _profiler = Profiler()
+
+    from hwt.synthesizer import utils as synthesizer_utils
+    from hwt.synthesizer.unit import Unit
+    from hwt.serializer.store_manager import SaveToFilesFlat
+    from . import store_managers
+
+    package = __name__.rsplit(".", 1)[0]
+    for cls in set(_all_subclasses(Unit)):
+        if cls.__module__.startswith(package):
+            for phase in UNIT_PHASES:
+                _wrap_method(cls, phase, cls.__name__, phase)
+
+    # save_file imports to_rtl from the hwt module in each call
+    _wrap_method(synthesizer_utils, "to_rtl", "hwt", "to_rtl")
+    for store_manager in [SaveToFilesFlat, store_managers.SaveTopEntity]:
+        _wrap_method(store_manager, "write", store_manager.__name__, "write")
+    return _profiler
+
+
+def write_profile(output_path=".", jobs=[]):
+    """
+    This function merges the events recorded by the workers and writes the
+    profile json, with the time of each phase per job and per unit class and
+    the peak memory of each worker, and a chrome trace file with one process
+    per worker (open it in chrome://tracing or https://ui.perfetto.dev).
+    Each job is a record returned by generate with the events and pid of the
+    worker.
+    """
+    events = []
+    profile = {"jobs": {}, "classes": {}, "workers": {}}
+    for job in jobs:
+        # failed and cancelled jobs do not return their events
+        if job["pid"] is None:
+            continue
+        job_events = job.get("events") or []
+        events += job_events
+
+        phases = {}
+        for event in job_events:
+            phase = event["args"]["phase"]
+            phases[phase] = phases.get(phase, 0) + event["args"]["self"] / 1e6
+
+            classes = profile["classes"].setdefault(event["args"]["class"], {})
+            total = classes.setdefault(phase, {"count": 0, "total": 0.0, "self": 0.0})
+            total["count"] += 1
+            total["total"] += event["dur"] / 1e6
+            total["self"] += event["args"]["self"] / 1e6
+
+        profile["jobs"][job["name"]] = {
+            "pid": job["pid"],
+            "duration": job["duration"],
+            "phases": phases,
+        }
+        worker = profile["workers"].setdefault(str(job["pid"]), {"max_rss": 0.0})
+        worker["max_rss"] = max(worker["max_rss"], job["memory"] or 0.0)
+
+    # name the processes of the trace and show the peak memory of the workers
+    for pid, worker in profile["workers"].items():
+        events.append(
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": int(pid),
+                "args": {"name": f"Worker {pid} (max rss {worker['max_rss']:.0f}MB)"},
+            }
+        )
+
+    os.makedirs(output_path, exist_ok=True)
+    with open(f"{output_path}/{PROFILE_FILE}", "w") as stream:
+        json.dump(profile, stream, indent=2)
+    with open(f"{output_path}/{TRACE_FILE}", "w") as stream:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, stream)
+    return profile
@@ -0,0 +1,648 @@
+import logging
+import os
+
+import numpy as np
+import yaml
+
+from .pipeline import (
+    adder_tree_latency,
+    adder_tree_shape,
+    constant_multiplier_latency,
+    constant_multiplier_terms,
+    kernel_rom_latency,
+    multi_channel_conv_unit_latency,
+)
+from .utils import prune_conv_kernels, quantize_conv_weights, read_floats
+from .weight_store import build_layer_index, open_weight_store, weight_store_current
+
+RESOURCE_KEYS = [
+    "FixedPointMultiplier",
+    "ConstantMultiplier",
+    "ConcatValues",
+    "ConvUnit",
+    "BinConvUnit",
+    "WinogradConvUnit",
+    "MultiChannelConvUnit",
+    "MaxPoolUnit",
+    "adders",
+    "adder_bits",
+    "multipliers",
+    "xnor_gates",
+    "comparators",
+    "register_bits",
+    "memory_bits",
+    "constant_bits",
+]
+
+
+def _resources(**counts):
+    resources = dict.fromkeys(RESOURCE_KEYS, 0)
+    resources.update(counts)
+    return resources
+
+
+def _add(resources, other, times=1):
+    for key, value in other.items():
+        resources[key] += value * times
+    return resources
+
+
+def adder_tree_resources(inputs=9, width=16, pipeline=0, output_width=None, saturate=False):
+    """
+    This function counts the resources of an AdderTree: the inputs - 1 adders
+    of its levels, one bit wider in each level (up to the output width unless
+    the output saturates), and the registers of the pipelined levels with
+    the valid bits that enable them.
+    """
+    resources = _resources()
+    for level in adder_tree_shape(inputs, width, pipeline, output_width, saturate):
+        resources["adders"] += level["adders"]
+        resources["adder_bits"] += level["adders"] * level["width"]
+        if level["registered"]:
+            resources["register_bits"] += level["signals"] * level["width"]
+    # the enable is the valid bit of the first registered level
+    resources["register_bits"] += max(adder_tree_latency(inputs, pipeline) - 1, 0)
+    return resources
+
+
+def fixed_point_multiplier_resources(width=16, adder_pipeline=0):
+    """
+    This function counts the resources of a FixedPointMultiplier: 15
+    ConcatValues partial products of 2 * width - 1 bits summed by an adder
+    tree, and the registers that delay the product sign (and their valid
+    bits) when the tree is pipelined.
+    """
+    latency = adder_tree_latency(15, adder_pipeline)
+    resources = _resources(
+        FixedPointMultiplier=1,
+        ConcatValues=15,
+        register_bits=latency + max(latency - 1, 0),
+    )
+    return _add(resources, adder_tree_resources(15, 2 * width - 1, adder_pipeline, 2 * width - 1))
+
+
+def constant_multiplier_resources(
+    coefficient=0, width=16, lower_output_bit=None, adder_pipeline=0, latency=0
+):
+    """
+    This function counts the resources of a ConstantMultiplier: the adder
+    tree of the terms of the canonical signed digits of its coefficient (and
+    of the constant of its negative terms) of lower_output_bit + width - 1
+    bits, without any multiplier, and the registers that delay the sum to
+    the latency of the unit, the sign and its valid bits.
+    """
+    if lower_output_bit is None:
+        lower_output_bit = int(width - width / 2)
+    term_width = lower_output_bit + width - 1
+    terms = constant_multiplier_terms(coefficient, width, lower_output_bit)
+    tree_inputs = len(terms) + (1 if any(digit < 0 for _, digit in terms) else 0)
+    tree_latency = adder_tree_latency(tree_inputs, adder_pipeline)
+    latency = max(latency, tree_latency)
+    resources = _resources(
+        ConstantMultiplier=1,
+        register_bits=(latency - tree_latency) * term_width + latency + max(latency - 1, 0),
+    )
+    if tree_inputs > 1:
+        _add(resources, adder_tree_resources(tree_inputs, term_width, adder_pipeline, term_width))
+    return resources
+
+
+def conv_unit_resources(
+    size=9, width=16, adder_pipeline=0, kernels=None, lower_output_bit=None, multiplier_latency=None
+):
+    """
+    This function counts the resources of a ConvUnit: one FixedPointMultiplier
+    (or one ConstantMultiplier for each one of the given kernel codes) and
+    one product register per kernel element, the adder tree of the products
+    saturated to their width and the output register.
+    """
+    resources = _resources(ConvUnit=1, register_bits=(size + 1) * width)
+    # the valid bit of the products enables the pipelined tree
+    resources["register_bits"] += min(adder_tree_latency(size, adder_pipeline), 1)
+    if kernels is None:
+        _add(resources, fixed_point_multiplier_resources(width, adder_pipeline), size)
+    else:
+        if multiplier_latency is None:
+            multiplier_latency = constant_multiplier_latency(
+                kernels, width, lower_output_bit, adder_pipeline
+            )
+        for code in kernels:
+            _add(
+                resources,
+                constant_multiplier_resources(
+                    int(code), width, lower_output_bit, adder_pipeline, multiplier_latency
+                ),
+            )
+    return _add(resources, adder_tree_resources(size, width, adder_pipeline, width, True))
+
+
+def bin_conv_unit_resources(size=9, width=16, adder_pipeline=0):
+    """
+    This function counts the resources of a BinConvUnit: one XNOR per kernel
+    element, the popcount tree over their bits, the subtraction of the size
+    from the doubled count and the multiplication of the sum by the kernel
+    absolute value. Only the pipelined trees have registers.
+    """
+    resources = _resources(
+        BinConvUnit=1, xnor_gates=size, multipliers=1, adders=1, adder_bits=width
+    )
+    return _add(resources, adder_tree_resources(size, 1, adder_pipeline, size.bit_length()))
+
+
+def winograd_conv_unit_resources(width=16):
+    """
+    This function counts the resources of a WinogradConvUnit: the 32 adders
+    of the tile transform, the 16 products of the transformed tile and
+    kernel with their registers, the 24 adders of the output transform and
+    the output register.
+    """
+    tile_width = width + 2
+    product_width = 2 * width + 6
+    return _resources(
+        WinogradConvUnit=1,
+        adders=56,
+        adder_bits=32 * tile_width + 24 * (product_width + 4),
+        multipliers=16,
+        register_bits=16 * product_width + 4 * width,
+    )
+
+
+def multi_channel_conv_unit_resources(
+    channels=3,
+    size=9,
+    width=16,
+    binary=True,
+    bin_output=False,
+    adder_pipeline=0,
+    fold_batch_norm=False,
+    winograd=False,
+    kernels=None,
+    active_channels=None,
+    shared_units=False,
+    lower_output_bit=None,
+    multiplier_latency=None,
+):
+    """
+    This function counts the resources of a MultiChannelConvUnit: one conv
+    unit per active channel (all of them by default, none when the binary
+    units are shared by the conv layer), the channel adder tree with the
+    registers that delay it to the latency of the tree of all the channels,
+    the batch normalization multiplier (unless it is folded into the
+    kernels) and adder and, for non binary outputs, the adder of the
+    negative values shift. The conv units have constant multipliers when
+    the kernel codes of each channel are given. The batch and accumulator
+    registers are not clocked in the current implementation. With Winograd
+    units, the channel tree and the batch normalization are repeated for
+    each of the 4 outputs of the tile.
+    """
+    if active_channels is None:
+        active_channels = range(channels)
+    if kernels is not None and multiplier_latency is None:
+        multiplier_latency = constant_multiplier_latency(
+            [code for i in active_channels for code in kernels[i]],
+            width,
+            lower_output_bit,
+            adder_pipeline,
+        )
+
+    resources = _resources(MultiChannelConvUnit=1)
+    tile = 4 if winograd and not binary else 1
+    for i in active_channels:
+        if shared_units:
+            continue
+        if binary:
+            _add(resources, bin_conv_unit_resources(size, width, adder_pipeline))
+        elif winograd:
+            _add(resources, winograd_conv_unit_resources(width))
+        else:
+            _add(
+                resources,
+                conv_unit_resources(
+                    size,
+                    width,
+                    adder_pipeline,
+                    None if kernels is None else kernels[i],
+                    lower_output_bit,
+                    multiplier_latency,
+                ),
+            )
+    if active_channels:
+        tree_inputs = len(active_channels)
+        tree = adder_tree_resources(tree_inputs, width, adder_pipeline, width, True)
+        delay = adder_tree_latency(channels, adder_pipeline)
+        delay -= adder_tree_latency(tree_inputs, adder_pipeline)
+        tree["register_bits"] += delay * width
+        _add(resources, tree, tile)
+
+    adders = 1 if bin_output else 2
+    resources["adders"] += tile * adders
+    resources["adder_bits"] += tile * adders * width
+    if binary or not fold_batch_norm:
+        resources["multipliers"] += tile
+    return resources
+
+
+def max_pool_unit_resources(width=16):
+    """
+    This function counts the resources of a MaxPoolUnit: the 3 comparators of
+    the 2x2 window and the output register.
+    """
+    return _resources(MaxPoolUnit=1, comparators=3, register_bits=width)
+
+
+def conv_layer_resources(
+    size=3,
+    width=16,
+    channels=3,
+    filters=16,
+    binary=False,
+    bin_input=False,
+    bin_output=False,
+    parallelism=8,
+    adder_pipeline=0,
+    fold_batch_norm=False,
+    winograd=False,
+    filter_folding=1,
+    kernel_rom=False,
+    weight_memory=False,
+    constant_kernels=False,
+    prune_kernels=False,
+    codes=None,
+    lower_output_bit=None,
+    multiplier_latency=None,
+):
+    """
+    This function counts the resources of all the parts of a conv layer. Each
+    filter is a MultiChannelConvUnit with its kernel, ssi and bn ports driven
+    by constants, without the ssi port when it is folded into the kernels.
+    The Winograd kernels are the 16 transformed elements of width + 4 bits.
+    With filter_folding, each unit computes that many filters and their
+    coefficients are read from roms (counted as constant bits) with the
+    filter select delayed along the pipeline of each part. With kernel_rom
+    or weight_memory, the coefficients are memory bits and the input window
+    of each part is registered. The constant_kernels and prune_kernels
+    layers are counted from the codes of each part (see
+    quantize_conv_weights): the conv units have one ConstantMultiplier per
+    kernel code, without kernel ports, and the units removed by
+    prune_conv_kernels are not counted, the shared binary units once per
+    part. Without codes, they are counted as the other layers.
+    """
+    fold_batch_norm = fold_batch_norm and not binary
+    winograd = winograd and not binary and size == 3
+    folded = filter_folding > 1
+    constant_kernels = constant_kernels and not binary and not winograd and not folded
+    prune_kernels = prune_kernels and not winograd and not folded
+    if codes is None:
+        constant_kernels = prune_kernels = False
+    kernel_size = size * size
+    filters = int(filters / parallelism) * parallelism
+    units = int(filters / filter_folding)
+
+    resources = _resources()
+    unit_args = {
+        "channels": channels,
+        "size": kernel_size,
+        "width": width,
+        "binary": binary,
+        "bin_output": bin_output,
+        "adder_pipeline": adder_pipeline,
+        "fold_batch_norm": fold_batch_norm,
+        "winograd": winograd,
+    }
+    # conv units driven by the kernel ports of the multi channel conv units
+    kernel_units = filters * channels
+    if constant_kernels or prune_kernels:
+        kernel_units = 0
+        for part_codes in codes:
+            kernels = np.asarray(part_codes["kernel"], dtype=np.int64)
+            pruning = None
+            if prune_kernels:
+                pruning = prune_conv_kernels(part_codes, binary=binary, width=width)
+            for i in range(len(kernels)):
+                active_channels = None if pruning is None else pruning["active"][i]
+                _add(
+                    resources,
+                    multi_channel_conv_unit_resources(
+                        kernels=kernels[i].tolist() if constant_kernels else None,
+                        active_channels=active_channels,
+                        shared_units=prune_kernels and binary,
+                        lower_output_bit=lower_output_bit,
+                        multiplier_latency=multiplier_latency,
+                        **unit_args,
+                    ),
+                )
+                if not constant_kernels and not binary:
+                    kernel_units += channels if pruning is None else len(active_channels)
+            if prune_kernels and binary:
+                # the binary conv units of the part, shared by its filters
+                shared = len(pruning["units"])
+                _add(resources, bin_conv_unit_resources(kernel_size, width, adder_pipeline), shared)
+                kernel_units += shared
+    else:
+        _add(resources, multi_channel_conv_unit_resources(**unit_args), units)
+    if filter_folding > 1:
+        latency = multi_channel_conv_unit_latency(
+            channels, kernel_size, binary, adder_pipeline, winograd=winograd
+        )
+        resources["register_bits"] += parallelism * (filter_folding - 1).bit_length() * latency
+
+    if binary:
+        kernel_bits = kernel_units * (width + kernel_size)
+    elif winograd:
+        kernel_bits = kernel_units * 16 * (width + 4)
+    else:
+        kernel_bits = kernel_units * kernel_size * width
+    coefficients = 1 if fold_batch_norm else 2
+    coefficient_bits = kernel_bits + filters * coefficients * width
+    if kernel_rom or weight_memory:
+        resources["memory_bits"] += coefficient_bits
+        window = 16 if winograd else kernel_size
+        resources["register_bits"] += parallelism * channels * window * (1 if bin_input else width)
+    else:
+        resources["constant_bits"] += coefficient_bits
+    return resources
+
+
+def max_pool_layer_resources(width=16, filters=0, binary=False):
+    return _add(_resources(), max_pool_unit_resources(1 if binary else width), filters)
+
+
+def buffer_layer_resources(
+    width=16, channels=0, image_width=416, size=3, binary=False, stride=1
+):
+    """
+    This function counts the resources of a BufferLayer: the size - 1 line
+    memories of the pixels of a row and its padding, the registers of the
+    window, the column and row counters with their adders and comparators,
+    the comparators of the padding and the phases of the stride.
+    """
+    pixel_width = (1 if binary else width) * channels
+    if size == 1 and stride == 1:
+        return _resources(register_bits=pixel_width + 1)
+    padding = (size - 1) // 2 if stride == 1 else 0
+    row_length = image_width + padding
+    counter_width = max(row_length - 1, 1).bit_length()
+    resources = _resources(
+        adders=2,
+        adder_bits=2 * counter_width,
+        comparators=2 + (size - 1) + (4 if padding else 0),
+        register_bits=size * size * pixel_width + 2 * counter_width + 1,
+        memory_bits=(size - 1) * row_length * pixel_width,
+    )
+    if stride > 1:
+        phase_width = max(stride - 1, 1).bit_length()
+        _add(resources, _resources(adders=2, adder_bits=2 * phase_width, comparators=4))
+        resources["register_bits"] += 2 * phase_width
+    return resources
+
+
+def layer_controller_resources(latency=0):
+    """
+    This function counts the resources of a LayerController: one valid bit
+    for each cycle of the pipeline of its layer, the last enables of a conv
+    layer are set in the cycle of its output.
+    """
+    return _resources(register_bits=latency)
+
+
+def network_top_resources(stages=[]):
+    """
+    This function counts the resources of a NetworkTop: the output fifo of
+    each stage (latency + 2 values), its pointers and counters, its credit
+    counter and, for the buffer layers, the valid bit of the window (the
+    valid bits of the other layers are in their controllers).
+    """
+    resources = _resources()
+    for stage in stages:
+        depth = stage["latency"] + 2
+        count_width = depth.bit_length()
+        pointer_width = max(depth - 1, 1).bit_length()
+        # the buffer layers also return the credits of the dropped windows
+        buffer = stage["kind"] == "BufferLayer"
+        credit_adders = 3 if buffer else 2
+        _add(
+            resources,
+            _resources(
+                adders=credit_adders + 3,
+                adder_bits=(credit_adders + 1) * count_width + 2 * pointer_width,
+                comparators=2,
+                register_bits=int(buffer) + 2 * count_width + 2 * pointer_width,
+                memory_bits=depth * stage["output_width"],
+            ),
+        )
+    return resources
+
+
+def _network_weights(network={}):
+    """
+    This function returns the float weights, biases, scale, mean and
+    variance of a network config: the arrays of its weights store (mapped
+    in memory, see open_weight_store) or of its pickle files, mapping the
+    store converted from them by the parser while it is current. Returns
+    None when they are not found.
+    """
+    weights_store_file = network.get("weights_store_path")
+    if weights_store_file:
+        if not os.path.exists(weights_store_file):
+            return None
+        return open_weight_store(file_path=weights_store_file)
+
+    names = ["weights", "biases", "scale", "mean", "variance"]
+    paths = [network.get(f"{name}_path") for name in names]
+    if not all(path and os.path.exists(path) for path in paths):
+        return None
+    # the store converted from the pickle files by the parser, if any
+    sources = {name: os.path.abspath(path) for name, path in zip(names, paths)}
+    weights_store_file = f"{network.get('output_path', '.')}/weights_store.ywst"
+    if weight_store_current(weights_store_file, sources):
+        return open_weight_store(file_path=weights_store_file)
+    return {name: read_floats(file_path=path) for name, path in zip(names, paths)}
+
+
+def _conv_layer_codes(weights={}, parts=[], layer={}, width=16, channels=3, filters=16):
+    """
+    This function quantizes the coefficients of each part of a conv layer as
+    its ConvLayer does (see quantize_conv_weights), from the slices of the
+    weights of each part returned by build_layer_index.
+    """
+    binary = layer["binary"]
+    process_filters = int(filters / layer.get("parallelism", 8))
+    codes = []
+    for part in parts:
+        weights_index, weights_offset = part["weights"]
+        variables_index, variables_offset = part["variables"]
+        codes.append(
+            quantize_conv_weights(
+                weights=weights["weights"][weights_index:weights_offset],
+                biases=weights["biases"][variables_index:variables_offset],
+                mean=weights["mean"][variables_index:variables_offset],
+                scale=weights["scale"][variables_index:variables_offset],
+                variance=weights["variance"][variables_index:variables_offset],
+                filters=process_filters,
+                channels=channels,
+                size=layer["size"] ** 2,
+                width=width,
+                binary=binary,
+                fold_batch_norm=layer.get("fold_batch_norm", False) and not binary,
+            )
+        )
+    return codes
+
+
+def estimate_resources(network_file="", width=16):
+    """
+    This function estimates the resources of a network from its config file
+    alone, walking the layer groups in the same way as NetworkParser and
+    counting the units each class would instantiate, without elaborating
+    anything. The conv layers have the width of their config (the widths
+    chosen by the fixed_point option of the parser depend on the weights and
+    are not estimated). The kernels of the constant_kernels and
+    prune_kernels layers are quantized from the weights of the network to
+    count their constant multipliers and their pruned units, these layers
+    are counted as the other ones when the weights are not found. Returns a
+    dict with the resources of each layer and the total.
+    """
+    logger = logging.getLogger("ResourceEstimator")
+    with open(network_file) as stream:
+        network = yaml.load(stream, Loader=yaml.FullLoader)
+
+    channels = network["channels"]
+    layers = []
+    total = _resources()
+    index = 0
+    # the max pool layers have the width of the previous conv layer
+    layer_width = width
+    # the buffer layers have the width of the feature map
+    image_width = network["width"]
+    # output bits and latency of each layer in the stream of the top entity
+    stages = []
+
+    # the weights are only read for the layers specialized for their kernels
+    weights = None
+    specialized = any(
+        layer.get("constant_kernels") or layer.get("prune_kernels")
+        for group in network["layer_groups"]
+        for layer in group["layers"]
+    )
+    if specialized:
+        weights = _network_weights(network)
+        if weights is None:
+            logger.warning(
+                "The weights of the network were not found, the constant_kernels and "
+                "prune_kernels layers are estimated with all their units"
+            )
+    layer_index = build_layer_index(channels, network["layer_groups"])
+
+    for group in network["layer_groups"]:
+        filters = group["filters"]
+        # channels of the feature map before the first conv layer
+        feature_channels = channels
+        for position, layer in enumerate(group["layers"]):
+            if layer["type"] == "conv_layer":
+                name = f"ConvLayerL{index}"
+                kind = "ConvLayer"
+                layer_width = layer.get("width", width)
+                feature_channels = filters
+                adder_pipeline = layer.get("adder_pipeline", 0)
+                codes = None
+                multiplier_latency = None
+                if weights is not None and (
+                    layer.get("constant_kernels") or layer.get("prune_kernels")
+                ):
+                    codes = _conv_layer_codes(
+                        weights, layer_index[index], layer, layer_width, channels, filters
+                    )
+                    # the parser aligns the constant multipliers of the layer
+                    if layer.get("constant_kernels") and not layer["binary"] and adder_pipeline:
+                        kernels = np.concatenate([np.unique(part["kernel"]) for part in codes])
+                        multiplier_latency = constant_multiplier_latency(
+                            np.unique(kernels), layer_width, None, adder_pipeline
+                        )
+                resources = conv_layer_resources(
+                    size=layer["size"],
+                    width=layer_width,
+                    channels=channels,
+                    filters=filters,
+                    binary=layer["binary"],
+                    bin_input=layer["bin_input"],
+                    bin_output=layer["bin_output"],
+                    parallelism=layer.get("parallelism", 8),
+                    adder_pipeline=adder_pipeline,
+                    fold_batch_norm=layer.get("fold_batch_norm", False),
+                    winograd=layer.get("winograd", False),
+                    filter_folding=layer.get("filter_folding", 1),
+                    kernel_rom=layer.get("kernel_rom", False),
+                    weight_memory=layer.get("weight_memory", False),
+                    constant_kernels=layer.get("constant_kernels", False),
+                    prune_kernels=layer.get("prune_kernels", False),
+                    codes=codes,
+                    multiplier_latency=multiplier_latency,
+                )
+                latency = multi_channel_conv_unit_latency(
+                    channels,
+                    layer["size"] ** 2,
+                    layer["binary"],
+                    adder_pipeline,
+                    multiplier_latency,
+                    winograd=layer.get("winograd", False),
+                ) + kernel_rom_latency(layer.get("kernel_rom", False), layer.get("weight_memory", False))
+                tile = 4 if layer.get("winograd") else 1
+                units = filters // layer.get("filter_folding", 1)
+                output_width = tile * units * (1 if layer["bin_output"] else layer_width)
+            elif layer["type"] == "max_pool_layer":
+                name = f"MaxPoolLayerL{index}"
+                kind = "MaxPoolLayer"
+                resources = max_pool_layer_resources(layer_width, filters, layer["binary"])
+                image_width //= 2
+                latency = 1
+                output_width = filters * (1 if layer["binary"] else layer_width)
+            elif layer["type"] == "buffer_layer":
+                name = f"BufferLayerL{index}"
+                kind = "BufferLayer"
+                size = layer["scattering"]
+                # the windows before a max pool layer have a stride of 2
+                following = group["layers"][position + 1 : position + 2]
+                stride = 2 if [item["type"] for item in following] == ["max_pool_layer"] else 1
+                resources = buffer_layer_resources(
+                    layer_width, feature_channels, image_width, size, layer["binary"], stride
+                )
+                latency = 1
+                pixel_width = feature_channels * (1 if layer["binary"] else layer_width)
+                output_width = size * size * pixel_width
+            else:
+                logger.warning(f"Layer type not estimated: {layer['type']}")
+                index += 1
+                continue
+
+            layers.append({"name": name, "type": layer["type"], "resources": resources})
+            _add(total, resources)
+            stages.append(
+                {"name": name, "kind": kind, "latency": latency, "output_width": output_width}
+            )
+            index += 1
+        channels = filters
+
+    if network.get("layer_controllers") or network.get("stream_top"):
+        for stage in stages:
+            if stage["kind"] != "BufferLayer":
+                resources = layer_controller_resources(stage["latency"])
+                name = f"{stage['name']}Controller"
+                layers.append({"name": name, "type": "layer_controller", "resources": resources})
+                _add(total, resources)
+    if network.get("stream_top"):
+        resources = network_top_resources(stages)
+        layers.append({"name": "NetworkTop", "type": "stream_top", "resources": resources})
+        _add(total, resources)
+    return {"layers": layers, "total": total}
+
+
+def print_resources(estimate):
+    columns = [key for key in RESOURCE_KEYS if estimate["total"][key]]
+    rows = [(layer["name"], layer["resources"]) for layer in estimate["layers"]]
+    rows.append(("Total", estimate["total"]))
+
+    # one column per layer, one row per resource
+    size = max([16] + [len(name) + 2 for name, _ in rows])
+    print(f"{'':22s}" + "".join(f"{name:>{size}s}" for name, _ in rows))
+    for key in columns:
+        print(f"{key:22s}" + "".join(f"{resources[key]:{size}d}" for _, resources in rows))
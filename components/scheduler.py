@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import threading
+from time import perf_counter
+
+STATS_FILE = "generation_stats.json"
+STATS_RUNS = 20
+
+# seconds and megabytes per unit of work of each kind of job, they are only
+# used until some run statistics are recorded in the output path
+DEFAULT_TIME_COEFFICIENTS = {
+    "ConvLayer": 5e-3,
+    "ConvLayer_binary": 5e-4,
+    "ConvLayer_top": 1e-2,
+    "MaxPoolLayer": 2e-3,
+}
+DEFAULT_MEMORY_COEFFICIENTS = {
+    "ConvLayer": 0.5,
+    "ConvLayer_binary": 0.05,
+    "ConvLayer_top": 1.0,
+    "MaxPoolLayer": 0.1,
+}
+DEFAULT_TIME_COEFFICIENT = 1e-3
+DEFAULT_MEMORY_COEFFICIENT = 0.1
+
+
+def job_kind(layer):
+    """
+    This function returns the kind of a job, used to select the coefficients
+    of the cost model: the unit class name plus _top for top entities and
+    _binary for binary layers.
+    """
+    args = layer["args"]
+    kind = layer["class"].__name__
+    if args.get("top_entity", False):
+        kind += "_top"
+    elif args.get("binary", False):
+        kind += "_binary"
+    return kind
+
+
+def job_work(layer):
+    """
+    This function returns the amount of work of a job: the number of
+    instantiated kernel taps (filters x channels x kernel size) for conv
+    layers parts, the number of parts for top entities and the number of
+    filters for the others.
+    """
+    args = layer["args"]
+    if args.get("top_entity", False):
+        return args.get("parallelism", 1)
+    return args.get("filters", 1) * args.get("channels", 1) * args.get("size", 1) ** 2
+
+
+class CostModel:
+    """
+    Linear model of the elaboration time and memory of each kind of job. The
+    coefficients are fitted from the statistics recorded by the previous
+    runs in the output path.
+    """
+
+    def __init__(self, stats_file=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.stats_file = stats_file
+        self.time_coefficients = dict(DEFAULT_TIME_COEFFICIENTS)
+        self.memory_coefficients = dict(DEFAULT_MEMORY_COEFFICIENTS)
+        self.runs = []
+
+        if stats_file and os.path.exists(stats_file):
+            with open(stats_file) as stream:
+                self.runs = json.load(stream).get("runs", [])
+            self.calibrate()
+
+    def calibrate(self):
+        # least squares fit through the origin for each kind of job
+        fits = {}
+        for run in self.runs:
+            for job in run["jobs"]:
+                fit = fits.setdefault(job["kind"], [0.0, 0.0, 0.0])
+                fit[0] += job["work"] * job["work"]
+                fit[1] += job["work"] * job["duration"]
+                fit[2] += job["work"] * job["memory"]
+
+        for kind, (work_square, time_product, memory_product) in fits.items():
+            if work_square > 0:
+                self.time_coefficients[kind] = time_product / work_square
+                self.memory_coefficients[kind] = memory_product / work_square
+        self.logger.debug(f"Calibrated time coefficients {self.time_coefficients}")
+
+    def estimate_time(self, layer):
+        kind = job_kind(layer)
+        coefficient = self.time_coefficients.get(kind, DEFAULT_TIME_COEFFICIENT)
+        return coefficient * job_work(layer)
+
+    def estimate_memory(self, layer):
+        kind = job_kind(layer)
+        coefficient = self.memory_coefficients.get(kind, DEFAULT_MEMORY_COEFFICIENT)
+        return coefficient * job_work(layer)
+
+    def record(self, jobs):
+        """
+        Appends a run to the statistics file. Each job is a dict with the
+        layer dict and the duration (seconds) and memory (megabytes) measured
+        by the worker.
+        """
+        run = {
+            "jobs": [
+                {
+                    "name": job["layer"]["filename"],
+                    "kind": job_kind(job["layer"]),
+                    "work": job_work(job["layer"]),
+                    "duration": job["duration"],
+                    "memory": job["memory"],
+                }
+                for job in jobs
+            ]
+        }
+        self.runs = (self.runs + [run])[-STATS_RUNS:]
+        self.calibrate()
+
+        if self.stats_file:
+            temp_file_path = f"{self.stats_file}.tmp"
+            with open(temp_file_path, "w") as stream:
+                json.dump({"runs": self.runs}, stream, indent=2)
+            os.replace(temp_file_path, self.stats_file)
+
+
+class JobScheduler:
+    """
+    Submits the generation jobs to a process pool in longest processing time
+    first order. No more jobs than processes are in flight and, when a memory
+    budget (megabytes) is set, a job waits until the estimated memory of the
+    running jobs plus its own fits in the budget. A job bigger than the
+    budget runs alone.
+    """
+
+    def __init__(self, cost_model, processes=1, memory_budget=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.cost_model = cost_model
+        self.processes = processes
+        self.memory_budget = memory_budget
+
+    def order(self, layers):
+        return sorted(layers, key=self.cost_model.estimate_time, reverse=True)
+
+    def run(self, pool, layers, func, args, kwds, callback=None, keep_going=False):
+        """
+        Runs func for each layer in the pool, args and kwds are functions
+        returning the positional and keyword arguments of a layer, and func
+        returns a dict with the file, duration and memory of the job. The
+        callback is called with the layer and the func result of each job
+        that succeeds, and the job fails when the callback raises. Unless
+        keep_going is set, no more jobs are submitted after the first
+        failure, the pool is terminated and the jobs not finished by then
+        are reported as cancelled.
+
+        Returns a list with one record per layer, with the status (done,
+        failed or cancelled), file, duration, memory and error of the job.
+        """
+        condition = threading.Condition()
+        state = {"jobs": 0, "memory": 0.0, "failed": False}
+        records = {}
+        total = len(layers)
+        estimates = {id(layer): self.cost_model.estimate_time(layer) for layer in layers}
+        progress = {"done": 0, "estimate": 0.0, "start": perf_counter()}
+
+        def report(layer, record):
+            progress["done"] += 1
+            progress["estimate"] += estimates[id(layer)]
+            elapsed = perf_counter() - progress["start"]
+            remaining = total - progress["done"]
+            remaining_estimate = sum(estimates.values()) - progress["estimate"]
+            eta = elapsed / max(progress["estimate"], 1e-9) * remaining_estimate
+            duration = record["duration"] or 0.0
+            self.logger.info(
+                f"[{progress['done']}/{total}] {layer['filename']} {record['status']} "
+                f"in {duration:.2f}s, {remaining} remaining, ETA {eta:.0f}s"
+            )
+
+        def finish(layer, memory, result=None, error=None):
+            if error is None and callback is not None:
+                # an exception here would be lost in the result thread of the
+                # pool and the job would never be released, so it fails the job
+                try:
+                    callback(layer, result)
+                except Exception as e:
+                    error = e
+            record = job_record(layer, "done" if error is None else "failed")
+            if result is not None:
+                record.update(result)
+            if error is not None:
+                record["error"] = repr(error)
+                self.logger.error(f"{layer['filename']} failed: {error!r}")
+            with condition:
+                state["jobs"] -= 1
+                state["memory"] -= memory
+                records[id(layer)] = record
+                if error is not None and not keep_going:
+                    state["failed"] = True
+                report(layer, record)
+                condition.notify_all()
+
+        def fits(memory):
+            if state["failed"]:
+                return True
+            if state["jobs"] >= self.processes:
+                return False
+            if self.memory_budget is None or state["jobs"] == 0:
+                return True
+            return state["memory"] + memory <= self.memory_budget
+
+        for layer in self.order(layers):
+            memory = self.cost_model.estimate_memory(layer)
+            self.logger.debug(
+                f"Scheduling {layer['filename']}: "
+                f"{estimates[id(layer)]:.2f}s {memory:.0f}MB"
+            )
+            with condition:
+                condition.wait_for(lambda: fits(memory))
+                if state["failed"]:
+                    break
+                state["jobs"] += 1
+                state["memory"] += memory
+
+            pool.apply_async(
+                func=func,
+                args=args(layer),
+                kwds=kwds(layer),
+                callback=lambda result, layer=layer, memory=memory: finish(
+                    layer, memory, result=result
+                ),
+                error_callback=lambda error, layer=layer, memory=memory: finish(
+                    layer, memory, error=error
+                ),
+            )
+
+        with condition:
+            condition.wait_for(lambda: state["jobs"] == 0 or state["failed"])
+            running = state["jobs"] > 0
+        if running:
+            # the records are taken after stopping the pool (out of the lock,
+            # its result thread may be waiting for it), so a job finishing in
+            # the meantime is recorded as done, as in the manifest
+            pool.terminate()
+            pool.join()
+        with condition:
+            return [
+                records.get(id(layer), job_record(layer, "cancelled"))
+                for layer in layers
+            ]
+
+
+def job_record(layer, status, file=None):
+    return {
+        "name": layer["filename"],
+        "path": layer["path"],
+        "status": status,
+        "file": file,
+        "duration": None,
+        "memory": None,
+        "pid": None,
+        "error": None,
+    }
+
+
+class GenerationError(RuntimeError):
+    """
+    Raised by NetworkParser.generate when a job fails, the summary of the
+    generation is kept in the summary attribute.
+    """
+
+    def __init__(self, summary):
+        failed = [job["name"] for job in summary["jobs"] if job["status"] == "failed"]
+        super().__init__(f"Generation failed: {', '.join(failed)}")
+        self.summary = summary
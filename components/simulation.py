@@ -0,0 +1,1270 @@
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from time import perf_counter
+
+import numpy as np
+
+from . import golden_model
+
+# time of half a clock period and of the settle time after each input write
+HALF_PERIOD = 5
+SETTLE_TIME = 2
+
+
+def _resize(value, dtype):
+    # wrap the bits of a basic simulator value to the width of dtype
+    mask = dtype.all_mask()
+    vld_mask = mask if value._is_full_valid() else 0
+    val = value.val & mask
+    if dtype.signed:
+        val = golden_model.to_signed(val, dtype.bit_length()).item()
+    return dtype._from_py(val, vld_mask)
+
+
+def _operand(value):
+    val = value.val & value._dtype.all_mask()
+    if value._dtype.signed:
+        return golden_model.to_signed(val, value._dtype.bit_length()).item()
+    return val
+
+
+@contextmanager
+def simulator_workarounds():
+    """
+    This context manager works around the bugs of the basic simulator that
+    make the simulation model disagree with the generated VHDL, and restores
+    the original functions on exit:
+
+    * hwt 3.4 serializes the sign casts of the simulation model as
+      ``cast_sign(<sign of the operand>)``, which returns the operand
+      unchanged (hwt/serializer/simModel/value.py).
+    * pyMathBitPrecise 1.0 ``bitsArithOp__val`` mirrors the negative
+      overflows of the signed sums around the largest value (the smallest
+      value minus two gives the largest plus one).
+    * pyMathBitPrecise 1.0 ``Bits3val.__mul__`` types the product with the
+      width of the first operand, while hwt types it with the width of both
+      operands and signed when any of them is signed.
+    * pyMathBitPrecise 1.0 ``Bits3val._concat`` ors the sign extension of a
+      negative second value into the bits of the first one.
+    * pycocotb 1.1 keeps only the last value a process writes to a signal,
+      so the processes that write slices of the same signal (as ConcatValues
+      and the truncation of the products) lose all but the last slice. The
+      generated model is built with a proxy that accumulates the slice
+      writes and the simulator applies them in order.
+    """
+    from hdlConvertorAst.translate._verilog_to_basic_hdl_sim_model.utils import (
+        hdl_call,
+        hdl_getattr,
+    )
+    from hwt.hdl.operatorDefs import AllOps
+    from hwt.serializer.simModel.value import ToHdlAstSimModel_value
+    from pyMathBitPrecise import bits3t
+    from pycocotb.basic_hdl_simulator import proxy
+
+    originals = [
+        (ToHdlAstSimModel_value, "as_hdl_Operator", ToHdlAstSimModel_value.as_hdl_Operator),
+        (bits3t, "bitsArithOp__val", bits3t.bitsArithOp__val),
+        (bits3t.Bits3val, "__mul__", bits3t.Bits3val.__mul__),
+        (bits3t.Bits3val, "_concat", bits3t.Bits3val._concat),
+        (proxy, "BasicRtlSimProxy", proxy.BasicRtlSimProxy),
+    ]
+    as_hdl_operator, _, operand_width_mul, unmasked_concat, _ = [
+        original for _, _, original in originals
+    ]
+    sign_casts = [AllOps.BitsAsSigned, AllOps.BitsAsUnsigned, AllOps.BitsAsVec]
+
+    def sign_cast_operator(self, op):
+        operand = op.operands[0]
+        signed = bool(op.result._dtype.signed)
+        if op.operator not in sign_casts or bool(operand._dtype.signed) == signed:
+            return as_hdl_operator(self, op)
+        sign = self.TRUE if signed else self.FALSE
+        return hdl_call(hdl_getattr(self.as_hdl_Value(operand), "cast_sign"), [sign])
+
+    def wrapping_arith_op(self, other, evalFn):
+        if isinstance(other, int):
+            other = self._dtype.from_py(other)
+        result = self.__copy__()
+        result.val = evalFn(self.val, other.val)
+        valid = self._is_full_valid() and other._is_full_valid()
+        result.vld_mask = self._dtype.all_mask() if valid else 0
+        return _resize(result, self._dtype)
+
+    def full_width_mul(self, other):
+        if not isinstance(other, bits3t.Bits3val):
+            return operand_width_mul(self, other)
+        width = self._dtype.bit_length() + other._dtype.bit_length()
+        signed = bool(self._dtype.signed or other._dtype.signed)
+        product_dtype = bits3t.Bits3t(width + 1, True)
+        valid = self._is_full_valid() and other._is_full_valid()
+        vld_mask = product_dtype.all_mask() if valid else 0
+        product = _operand(self) * _operand(other)
+        return _resize(product_dtype._from_py(product, vld_mask), bits3t.Bits3t(width, signed))
+
+    def masked_concat(self, other):
+        self, other = self.__copy__(), other.__copy__()
+        self.val = self.val & self._dtype.all_mask()
+        other.val = other.val & other._dtype.all_mask()
+        return unmasked_concat(self, other)
+
+    ToHdlAstSimModel_value.as_hdl_Operator = sign_cast_operator
+    bits3t.bitsArithOp__val = wrapping_arith_op
+    bits3t.Bits3val.__mul__ = full_width_mul
+    bits3t.Bits3val._concat = masked_concat
+    proxy.BasicRtlSimProxy = _slice_writes_proxy(proxy.BasicRtlSimProxy)
+    try:
+        yield
+    finally:
+        for owner, name, original in originals:
+            setattr(owner, name, original)
+
+
+def _slice_writes_proxy(proxy_cls):
+    # the proxy of the generated models, accumulates the slice writes of a
+    # process (the assignments with the indexes of the destination)
+    class SliceWritesProxy(proxy_cls):
+        __slots__ = ["_val_next"]
+
+        @property
+        def val_next(self):
+            return self._val_next
+
+        @val_next.setter
+        def val_next(self, value):
+            pending = getattr(self, "_val_next", None)
+            if value is None or pending is None or len(value) != 3:
+                self._val_next = value
+            elif isinstance(pending, list):
+                pending.append(value)
+            else:
+                self._val_next = [pending, value]
+
+    return SliceWritesProxy
+
+
+def _simulator_class():
+    """
+    This function returns the simulator class used by the harness, which
+    applies in order the slice writes accumulated by the proxy of
+    simulator_workarounds.
+    """
+    from hwt.simulator.rtlSimulator import BasicRtlSimulatorWithSignalRegisterMethods
+    from pycocotb.basic_hdl_simulator.sim_utils import valueHasChanged
+
+    class SliceWritesUpdater:
+        def __init__(self, updaters):
+            self.updaters = updaters
+
+        def __call__(self, current_value):
+            value = current_value.__copy__()
+            for updater in self.updaters:
+                _, value = updater(value)
+            return (valueHasChanged(current_value, value), value)
+
+    class SliceWritesSimulator(BasicRtlSimulatorWithSignalRegisterMethods):
+        def _mkUpdater(self, newValue):
+            if not isinstance(newValue, list):
+                return super()._mkUpdater(newValue)
+            updaters = [super(SliceWritesSimulator, self)._mkUpdater(v) for v in newValue]
+            return (
+                SliceWritesUpdater([updater for updater, _ in updaters]),
+                updaters[0][1],
+            )
+
+    return SliceWritesSimulator
+
+
+def _unit_class(kind):
+    from .adder_tree import AdderTree
+    from .bin_conv_unit import BinConvUnit
+    from .buffer_layer import BufferLayer
+    from .constant_multiplier import ConstantMultiplier
+    from .conv_layer import ConvLayer
+    from .conv_unit import ConvUnit
+    from .fixed_point_multiplier import FixedPointMultiplier
+    from .layer_controller import LayerController
+    from .max_pool_unit import MaxPoolUnit
+    from .multi_channel_conv_unit import MultiChannelConvUnit
+    from .winograd_conv_unit import WinogradConvUnit
+
+    return {
+        "AdderTree": AdderTree,
+        "ConstantMultiplier": ConstantMultiplier,
+        "FixedPointMultiplier": FixedPointMultiplier,
+        "ConvUnit": ConvUnit,
+        "BinConvUnit": BinConvUnit,
+        "MultiChannelConvUnit": MultiChannelConvUnit,
+        "MaxPoolUnit": MaxPoolUnit,
+        "BufferLayer": BufferLayer,
+        "LayerController": LayerController,
+        "WinogradConvUnit": WinogradConvUnit,
+        "ConvLayer": ConvLayer,
+    }[kind]
+
+
+def corner_codes(bits=16):
+    """
+    This function returns the corner values of a fixed point code: zero, one,
+    the largest and smallest values, all ones and the single bits around the
+    sign and around the lower output bit of the products.
+    """
+    lower_output_bit = int(bits - bits / 2)
+    values = {0, 1, 2 ** bits - 1, 2 ** (bits - 1), 2 ** (bits - 1) - 1, 2 ** bits - 2}
+    values |= {2 ** (bits - 1) + 1, 2 ** lower_output_bit}
+    if bits > 1:
+        values |= {2 ** (bits - 2), 2 ** (bits - 2) - 1, 2 ** (lower_output_bit - 1)}
+    return sorted({value & (2 ** bits - 1) for value in values})
+
+
+def random_codes(rng, shape, bits=16, corner_ratio=0.25):
+    """
+    This function returns random codes of the given number of bits, with
+    about corner_ratio of them taken from the corner values.
+    """
+    codes = rng.integers(0, 2 ** bits, shape, dtype=np.int64)
+    corners = np.asarray(corner_codes(bits), dtype=np.int64)
+    use_corner = rng.random(shape) < corner_ratio
+    return np.where(use_corner, rng.choice(corners, shape), codes)
+
+
+def _pack(values, bits):
+    # concatenate the last axes of each vector, the first element in the
+    # least significant bits
+    rows = np.asarray(values, dtype=np.int64).reshape(len(values), -1)
+    return [sum(int(v) << (bits * i) for i, v in enumerate(row)) for row in rows]
+
+
+def _layer_weights(params, seed=0):
+    # the float weights of a conv layer part, the same ones for the unit and
+    # its stimuli
+    rng = np.random.default_rng(seed)
+    filters = params.get("filters", 4)
+    weights = rng.normal(0, 0.3, filters * params.get("channels", 3) * params.get("size", 3) ** 2)
+    # the filters of zero_filters have zero kernels, all their conv units are
+    # removed by prune_kernels
+    weights = weights.reshape(filters, -1)
+    weights[params.get("zero_filters", [])] = 0
+    weights = weights.flatten()
+    return {
+        "weights": weights.tolist(),
+        "biases": rng.normal(0, 0.1, filters).tolist(),
+        "mean": rng.normal(0, 0.1, filters).tolist(),
+        "scale": rng.uniform(0.5, 1.5, filters).tolist(),
+        "variance": rng.uniform(0.5, 1.5, filters).tolist(),
+    }
+
+
+def _network_layers(params, path, seed=0):
+    # the layers of a streamed network of two groups: a conv layer of two
+    # parts and a max pool of the square feature map, then a conv layer whose
+    # weights are scaled by scale, so the parser gives it another format
+    import yaml
+
+    from .network_parser import NetworkParser
+    from .weight_store import build_layer_index, write_weight_store
+
+    channels = params.get("channels", 1)
+    conv = {"type": "conv_layer", "size": 3, "bin_input": False, "bin_output": False}
+    if params.get("adder_pipeline"):
+        conv["adder_pipeline"] = params["adder_pipeline"]
+    buffer = {"type": "buffer_layer", "scattering": 3, "binary": False}
+    first_layers = [buffer, {**conv, "parallelism": 2, "binary": False}]
+    first_layers.append({"type": "buffer_layer", "scattering": 2, "binary": False})
+    first_layers.append({"type": "max_pool_layer", "binary": False})
+    last_conv = {**conv, "parallelism": 1, "binary": params.get("binary", False)}
+    groups = [
+        {"filters": params["filters"][0], "layers": first_layers},
+        {"filters": params["filters"][1], "layers": [buffer, last_conv]},
+    ]
+
+    rng = np.random.default_rng(seed)
+    index = build_layer_index(channels, groups)
+    last_part = index[max(index)][-1]
+    weights = rng.normal(0, 0.3, last_part["weights"][1] + 1)
+    weights[index[max(index)][0]["weights"][0] :] *= params.get("scale", 1)
+    variables = last_part["variables"][1] + 1
+    arrays = {
+        "weights": weights,
+        "biases": rng.normal(0, 0.1, variables),
+        "mean": rng.normal(0, 0.1, variables),
+        "scale": rng.uniform(0.5, 1.5, variables),
+        "variance": rng.uniform(0.5, 1.5, variables),
+    }
+    write_weight_store(f"{path}/weights.ywst", arrays, index)
+    config = {
+        "weights_store_path": f"{path}/weights.ywst",
+        "output_path": f"{path}/generated",
+        "width": params.get("image_width", 6),
+        "channels": channels,
+        "layer_groups": groups,
+        "fixed_point": {"error_budget": 0.01, "widths": [16]},
+        "stream_top": True,
+    }
+    with open(f"{path}/config.yaml", "w") as config_file:
+        yaml.dump(config, config_file)
+    return NetworkParser(f"{path}/config.yaml").parse_network()
+
+
+def network_stimuli(params, vectors, rng, path):
+    """
+    This function returns the NetworkTop of a small streamed network, with
+    the real layers of its stages, the pixels of the frames streamed into it
+    and the outputs of golden_model.run_network over each frame. The frames
+    are random codes in the format of the first conv layer, about vectors
+    pixels in all.
+    """
+    from .buffer_layer import BufferLayer
+    from .conv_layer import ConvLayer
+    from .max_pool_layer import MaxPoolLayer
+    from .network_top import NetworkTop
+    from .weight_store import resolve_weight_slices
+
+    layers = _network_layers(params, path)
+    stages = layers[-1]["args"]["stages"]
+    # each conv layer streams through one part with all its filters, the
+    # outputs of the parts are concatenated in the same order
+    units = []
+    parts = []
+    for layer in layers:
+        args = dict(layer["args"])
+        kind = layer["class"].__name__
+        if kind == "ConvLayer" and not args.get("top_entity"):
+            parts.append(
+                resolve_weight_slices(
+                    args.pop("weights_store"), args.pop("weights_slice"), args.pop("variables_slice")
+                )
+            )
+        elif kind == "ConvLayer":
+            weights = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+            parts = []
+            args.update({"top_entity": False, "parallelism": 1, "process_id": 0})
+            units.append(ConvLayer(log_level=2, **args, **weights))
+        elif kind in ["BufferLayer", "MaxPoolLayer"]:
+            layer_class = {"BufferLayer": BufferLayer, "MaxPoolLayer": MaxPoolLayer}[kind]
+            units.append(layer_class(log_level=2, **args))
+    unit = NetworkTop(stages=stages, units=units, log_level=2)
+
+    image_width = params.get("image_width", 6)
+    channels = params.get("channels", 1)
+    frames = max(1, vectors // image_width ** 2)
+    feature_maps = random_codes(rng, (frames, image_width, image_width, channels), 16)
+    pixels = _pack(feature_maps.reshape(-1, channels), 16)
+    outputs = [golden_model.run_network(layers, feature_map) for feature_map in feature_maps]
+    bits = stages[-1]["output_width"] // outputs[0].shape[-1]
+    expected = [_pack(output.reshape(-1, output.shape[-1]), bits) for output in outputs]
+    return unit, pixels, sum(expected, [])
+
+
+def unit_stimuli(kind, params, vectors, rng):
+    """
+    This function generates the stimuli of a unit. It returns the values of
+    each input port, the values of each output port expected by the golden
+    model, the constant control ports and the number of clock cycles from
+    the inputs to the outputs.
+    """
+    width = params.get("width", 16)
+    size = params.get("size", 9)
+    lower_output_bit = params.get("lower_output_bit")
+
+    if kind == "AdderTree":
+        from .pipeline import adder_tree_latency
+
+        n_inputs = params.get("inputs", 9)
+        inputs = random_codes(rng, (vectors, n_inputs), width)
+        expected = golden_model.adder_tree(
+            inputs,
+            width,
+            params.get("signed", False),
+            params.get("output_width"),
+            params.get("saturate", False),
+        )
+        ports = {"input": _pack(inputs, width)}
+        # only the pipelined trees have a clock, a reset and an enable
+        if not adder_tree_latency(n_inputs, params.get("pipeline", 0)):
+            return ports, {"output": expected}, {}, 0
+        # random enables, the registers keep the sum of the last vector with
+        # the enable set, the outputs before the first one are not modeled
+        enables = rng.integers(0, 2, vectors)
+        loaded = np.maximum.accumulate(np.where(enables == 1, np.arange(vectors), -1))
+        expected = np.asarray([expected[i] if i >= 0 else None for i in loaded], dtype=object)
+        ports["en"] = enables.tolist()
+        return ports, {"output": expected}, {"rst": 0}, 0
+
+    if kind == "FixedPointMultiplier":
+        from .pipeline import adder_tree_latency
+
+        param_a = random_codes(rng, vectors, width)
+        param_b = random_codes(rng, vectors, width)
+        expected = golden_model.fixed_point_multiplier(
+            param_a, param_b, width, lower_output_bit
+        )
+        ports = {"param_a": param_a.tolist(), "param_b": param_b.tolist()}
+        # the pipelined multipliers have an enable of their operands
+        controls = {"rst": 0}
+        if adder_tree_latency(15, params.get("adder_pipeline", 0)):
+            controls["en"] = 1
+        return ports, {"product": expected}, controls, 0
+
+    if kind == "ConstantMultiplier":
+        from .pipeline import constant_multiplier_latency
+
+        param_a = random_codes(rng, vectors, width)
+        expected = golden_model.fixed_point_multiplier(
+            param_a, params.get("coefficient", 0), width, lower_output_bit
+        )
+        ports = {"param_a": param_a.tolist()}
+        controls = {"rst": 0}
+        latency = constant_multiplier_latency(
+            [params.get("coefficient", 0)], width, lower_output_bit, params.get("adder_pipeline", 0)
+        )
+        if max(latency, params.get("latency", 0)):
+            controls["en"] = 1
+        return ports, {"product": expected}, controls, 0
+
+    if kind == "ConvUnit":
+        inputs = random_codes(rng, (vectors, size), width)
+        if "kernels" in params:
+            # the kernels of the unit are constants of its multipliers
+            kernels = np.broadcast_to(np.asarray(params["kernels"]), (vectors, size))
+        else:
+            kernels = random_codes(rng, (vectors, size), width)
+        expected = golden_model.conv_unit(inputs, kernels, width, lower_output_bit)
+        ports = {"input": _pack(inputs, width)}
+        if "kernels" not in params:
+            ports.update({f"kernel_{i}": kernels[:, i].tolist() for i in range(size)})
+        controls = {"rst": 0, "en_window": 1, "en_mult": 1, "en_sum": 1}
+        return ports, {"output": expected}, controls, 2
+
+    if kind == "WinogradConvUnit":
+        from .utils import winograd_kernels
+
+        inputs = random_codes(rng, (vectors, 16), width)
+        # the transforms of random 3x3 kernels
+        kernels = winograd_kernels(random_codes(rng, (vectors, 9), width), width)
+        expected = golden_model.winograd_conv_unit(inputs, kernels, width, lower_output_bit)
+        ports = {"input": _pack(inputs, width)}
+        ports.update({f"kernel_{i}": kernels[:, i].tolist() for i in range(16)})
+        controls = {"rst": 0, "en_mult": 1, "en_sum": 1}
+        return ports, {"output": np.asarray(_pack(expected, width), dtype=object)}, controls, 2
+
+    if kind == "BinConvUnit":
+        bin_input = params.get("bin_input", False)
+        input_width = 1 if bin_input else width
+        inputs = random_codes(rng, (vectors, size), input_width)
+        kernel_abs = random_codes(rng, vectors, width)
+        kernel_sig = rng.integers(0, 2 ** size, vectors, dtype=np.int64)
+        expected = golden_model.bin_conv_unit(
+            inputs, kernel_abs, kernel_sig, width, bin_input, lower_output_bit
+        )
+        ports = {
+            "input": _pack(inputs, input_width),
+            "kernel_abs": kernel_abs.tolist(),
+            "kernel_sig": kernel_sig.tolist(),
+        }
+        # en_mult enables the registers of the pipelined popcount trees
+        return ports, {"output": expected}, {"rst": 0, "en_mult": 1}, 0
+
+    if kind == "MultiChannelConvUnit":
+        channels = params.get("channels", 3)
+        binary = params.get("binary", True)
+        bin_input = params.get("bin_input", False)
+        input_width = 1 if bin_input else width
+        # the Winograd units take 4x4 tiles and the transforms of the kernels
+        winograd = params.get("winograd", False) and not binary
+        window = 16 if winograd else size
+        inputs = random_codes(rng, (vectors, channels, window), input_width)
+        ssi_coef = random_codes(rng, vectors, width)
+        bn_coef = random_codes(rng, vectors, width)
+        constant_kernels = "kernels" in params and not binary
+        if winograd:
+            from .utils import winograd_kernels
+
+            kernels = winograd_kernels(random_codes(rng, (vectors, channels, 9), width), width)
+        elif constant_kernels:
+            kernels = np.broadcast_to(
+                np.asarray(params["kernels"]), (vectors, channels, size)
+            )
+        else:
+            kernels = random_codes(rng, (vectors, channels, size), width)
+        kernel_abs = random_codes(rng, (vectors, channels), width)
+        kernel_sig = rng.integers(0, 2 ** size, (vectors, channels), dtype=np.int64)
+        # the removed channels are the ones with zero kernels
+        active_channels = params.get("active_channels", range(channels))
+        removed = [i for i in range(channels) if i not in active_channels]
+        if binary:
+            kernel_abs[:, removed] = 0
+        else:
+            kernels = np.array(kernels)
+            kernels[:, removed] = 0
+        # the ssi coefficient of the non binary units can be folded into the
+        # kernels, they have no ssi port
+        fold_batch_norm = params.get("fold_batch_norm", False) and not binary
+        ports = {"input": _pack(inputs, input_width), "bn_coef": bn_coef.tolist()}
+        if not fold_batch_norm:
+            ports["ssi_coef"] = ssi_coef.tolist()
+        if params.get("shared_units", False):
+            # the outputs of the conv units are driven in the ports
+            conv_outputs = random_codes(rng, (vectors, channels), width)
+            conv_outputs[:, removed] = 0
+            expected = golden_model.batch_activation(
+                golden_model.channel_adder_tree(conv_outputs, width),
+                None if fold_batch_norm else ssi_coef,
+                bn_coef,
+                width,
+                params.get("bin_output", False),
+                lower_output_bit,
+            )
+            signed_outputs = golden_model.to_signed(conv_outputs, width)
+            for i in active_channels:
+                ports[f"conv_output_{i}"] = signed_outputs[:, i].tolist()
+            active_channels = []
+        else:
+            expected = golden_model.multi_channel_conv_unit(
+                inputs,
+                ssi_coef,
+                bn_coef,
+                kernels=kernels,
+                kernel_abs=kernel_abs,
+                kernel_sig=kernel_sig,
+                width=width,
+                binary=binary,
+                bin_input=bin_input,
+                bin_output=params.get("bin_output", False),
+                lower_output_bit=lower_output_bit,
+                fold_batch_norm=fold_batch_norm,
+                winograd=winograd,
+            )
+        if winograd:
+            output_width = 1 if params.get("bin_output", False) else width
+            expected = np.asarray(_pack(expected, output_width), dtype=object)
+        for i in active_channels:
+            if binary:
+                ports[f"kernel_abs_{i}"] = kernel_abs[:, i].tolist()
+                ports[f"kernel_sig_{i}"] = kernel_sig[:, i].tolist()
+            elif not constant_kernels:
+                for j in range(window):
+                    ports[f"kernel_{i*window+j}"] = kernels[:, i, j].tolist()
+        controls = {
+            "rst": 0,
+            "en_window": 1,
+            "en_mult": 1,
+            "en_sum": 1,
+            "en_channel": 1,
+            "en_batch": 1,
+            "en_act": 1,
+        }
+        # the conv units register the products and their sum
+        return ports, {"output": expected}, controls, 0 if binary else 2
+
+    if kind == "MaxPoolUnit":
+        binary = params.get("binary", False)
+        inputs = random_codes(rng, (vectors, 4), width)
+        expected = golden_model.max_pool_unit(inputs, width, binary)
+        ports = {"input": _pack(inputs, width)}
+        return ports, {"output": expected}, {"rst": 0, "en_pool": 1}, 1
+
+    if kind == "BufferLayer":
+        from .buffer_layer import buffer_layer_padding
+
+        binary = params.get("binary", False)
+        pixel_width = 1 if binary else width
+        channels = params.get("channels", 1)
+        image_width = params.get("image_width", 416)
+        size = params.get("size", 3)
+        stride = params.get("stride", 1)
+        # the first vector resets the counters of the stream, the next ones
+        # are the pixels of square feature maps in row major order with the
+        # columns and rows of the padding, random values the layer replaces
+        # by zeros
+        padding = buffer_layer_padding(size, stride)
+        frame = (image_width + padding) ** 2
+        frames = -(-(vectors - 1) // frame)
+        rows = image_width + padding
+        stream = random_codes(rng, (frames, rows, rows, channels), pixel_width)
+        feature_maps = stream[:, :image_width, :image_width]
+        pixels = stream.reshape(-1, channels)[: vectors - 1]
+        # the windows of the zero padded feature maps are read one cycle
+        # after the pixels whose valid is set
+        valid = golden_model.buffer_layer_valid(image_width, image_width, size, stride)
+        valid = np.tile(valid.ravel(), frames)[: vectors - 1]
+        windows = np.concatenate(
+            [
+                golden_model.buffer_layer(feature_map, size, stride).reshape(-1, channels * size ** 2)
+                for feature_map in feature_maps
+            ]
+        )
+        output = np.full(vectors, None, dtype=object)
+        output[1:][valid == 1] = _pack(windows[: np.sum(valid)], pixel_width)
+        ports = {"rst": [1] + [0] * len(pixels), "input": [0] + _pack(pixels, pixel_width)}
+        expected = {"output": output, "valid": np.concatenate([[0], valid])}
+        return ports, expected, {"en": 1}, 1
+
+    if kind == "LayerController":
+        # random windows after the reset of the first vector, the outputs are
+        # read after the clock edge, the registered ones one cycle later
+        start = [0] + rng.integers(0, 2, vectors - 1).tolist()
+        enables = params.get("enables", {})
+        latency = params.get("latency", 0)
+        outputs = golden_model.layer_controller(start + [0], enables, latency)
+        cycles = dict(enables, valid=latency)
+        expected = {
+            name: values[1:] if cycles[name] else values[:-1] for name, values in outputs.items()
+        }
+        ports = {"rst": [1] + [0] * (vectors - 1), "start": start}
+        return ports, expected, {}, 1
+
+    if kind == "ConvLayer":
+        from .conv_layer import ConvLayer
+        from .pipeline import kernel_rom_latency, multi_channel_conv_unit_latency
+        from .utils import quantize_conv_weights, winograd_kernels
+
+        # a part of a conv layer, the windows stream one per cycle with random
+        # filter selects and the outputs are read after the latency of its
+        # units (the first ones are not compared)
+        channels = params.get("channels", 3)
+        filters = params.get("filters", 4)
+        size = params.get("size", 3) ** 2
+        binary = params.get("binary", False)
+        bin_input = params.get("bin_input", False)
+        input_width = 1 if bin_input else width
+        output_width = 1 if params.get("bin_output", False) else width
+        winograd = params.get("winograd", False) and not binary and size == 9
+        fold_batch_norm = params.get("fold_batch_norm", False) and not binary
+        folding = params.get("filter_folding", 1)
+        units = int(filters / folding)
+        weight_memory = params.get("weight_memory", False)
+        weights = _layer_weights(params)
+        words = []
+        if weight_memory:
+            # the parts with weight memories are loaded with other weights
+            # through their avalon slave in the first vectors, when their
+            # image takes at most half of them
+            reloaded = _layer_weights(params, seed=1)
+            words = ConvLayer(log_level=2, **params, **reloaded).weight_words().tolist()
+            if len(words) <= vectors // 2:
+                weights = reloaded
+            else:
+                words = []
+        codes = quantize_conv_weights(
+            filters=filters,
+            channels=channels,
+            size=size,
+            width=width,
+            binary=binary,
+            integer_portion=params.get("integer_portion"),
+            decimal_portion=params.get("decimal_portion"),
+            fold_batch_norm=fold_batch_norm,
+            **weights,
+        )
+        kernels = codes["kernel"]
+        if winograd:
+            kernels = winograd_kernels(kernels, width)
+        inputs = random_codes(rng, (vectors, 1, channels, 16 if winograd else size), input_width)
+        layer_inputs = inputs
+        input_format = params.get("input_format")
+        if input_format is not None and not bin_input:
+            # the codes of a previous layer in another format, requantized by
+            # the part to the format of the layer
+            layer_format = golden_model.layer_format(params, width)
+            inputs = random_codes(rng, inputs.shape, input_format[0])
+            layer_inputs = golden_model.rescale_codes(inputs, input_format, layer_format)
+            input_width = input_format[0]
+        outputs = golden_model.multi_channel_conv_unit(
+            layer_inputs,
+            codes["ssi"],
+            codes["bn"],
+            kernels=kernels,
+            kernel_abs=codes["kernel"][..., 0],
+            kernel_sig=codes["kernel_sig"],
+            width=width,
+            binary=binary,
+            bin_input=bin_input,
+            bin_output=params.get("bin_output", False),
+            lower_output_bit=params.get("decimal_portion"),
+            fold_batch_norm=fold_batch_norm,
+            winograd=winograd,
+        )
+        select = rng.integers(0, folding, vectors)
+        outputs = np.stack([outputs[i, s * units : (s + 1) * units] for i, s in enumerate(select)])
+        latency = multi_channel_conv_unit_latency(
+            channels, size, binary, params.get("adder_pipeline", 0), winograd=winograd
+        )
+        latency += kernel_rom_latency(params.get("kernel_rom", False), weight_memory)
+        delay = max(latency - 1, 0)
+        expected = [None] * delay + _pack(outputs, output_width)[: vectors - delay]
+        ports = {"input": _pack(inputs, input_width)}
+        if folding > 1:
+            ports["filter_select"] = select.tolist()
+        if weight_memory:
+            # the windows of the vectors of the writes are not compared
+            loaded = len(words)
+            for i in range(delay, min(delay + loaded, vectors)):
+                expected[i] = None
+            ports["avs_weights_write"] = [1] * loaded + [0] * (vectors - loaded)
+            ports["avs_weights_address"] = list(range(loaded)) + [0] * (vectors - loaded)
+            ports["avs_weights_writedata"] = words + [0] * (vectors - loaded)
+        controls = {
+            "rst": 0,
+            "en_window": 1,
+            "en_mult": 1,
+            "en_sum": 1,
+            "en_channel": 1,
+            "en_batch": 1,
+            "en_act": 1,
+        }
+        return ports, {"output": np.asarray(expected, dtype=object)}, controls, 1
+
+    raise ValueError(f"Unit not supported by the simulation harness: {kind}")
+
+
+def simulate(unit, ports, outputs, controls=None, cycles=0):
+    """
+    This function simulates a unit with the hwt basic simulator. Each vector
+    writes the values of the input ports, runs the given number of clock
+    cycles and reads the output ports. Returns the values read from each
+    output port, None for the values with invalid bits. The unit is built
+    and simulated inside simulator_workarounds.
+    """
+    from hwt.simulator.shortcuts import reconnectUnitSignalsToModel
+    from pycocotb.hdlSimulator import HdlSimulator
+    from pycocotb.triggers import Timer, WaitCombStable, WaitWriteOnly
+
+    vectors = len(next(iter(ports.values())))
+    results = {name: [] for name in outputs}
+
+    def signal(name):
+        return getattr(unit, name)._sigInside
+
+    def driver():
+        yield WaitWriteOnly()
+        for name, value in (controls or {}).items():
+            signal(name).write(value)
+        if cycles:
+            signal("clk").write(0)
+
+        for i in range(vectors):
+            yield Timer(SETTLE_TIME)
+            yield WaitWriteOnly()
+            for name, values in ports.items():
+                signal(name).write(values[i])
+
+            for _ in range(cycles):
+                yield Timer(HALF_PERIOD)
+                yield WaitWriteOnly()
+                signal("clk").write(1)
+                yield Timer(HALF_PERIOD)
+                yield WaitWriteOnly()
+                signal("clk").write(0)
+
+            yield Timer(SETTLE_TIME)
+            yield WaitCombStable()
+            for name in outputs:
+                value = signal(name).read()
+                full_mask = 2 ** value._dtype.bit_length() - 1
+                valid = value.vld_mask == full_mask
+                results[name].append(int(value.val) & full_mask if valid else None)
+
+    until = vectors * (2 * SETTLE_TIME + 2 * HALF_PERIOD * cycles) + 1
+    with simulator_workarounds():
+        rtl_simulator = _simulator_class().build(
+            unit, unique_name=f"{unit._name}_{os.getpid()}", build_dir=None
+        )()
+        hdl_simulator = HdlSimulator(rtl_simulator)
+        reconnectUnitSignalsToModel(unit, rtl_simulator)
+        hdl_simulator.run(until=until, extraProcesses=[driver()])
+    return results
+
+
+def simulate_stream(unit, pixels, outputs_count, max_cycles):
+    """
+    This function simulates a NetworkTop with the hwt basic simulator: after
+    a reset cycle, each cycle offers the next pixel of the stream, takes it
+    when input_ready is set and reads the outputs whose output_valid is set,
+    always taking them, until the given number of outputs or cycles. Returns
+    the outputs read, None for the ones with invalid bits or not read.
+    """
+    from hwt.simulator.shortcuts import reconnectUnitSignalsToModel
+    from pycocotb.hdlSimulator import HdlSimulator
+    from pycocotb.triggers import Timer, WaitCombStable, WaitWriteOnly
+
+    results = []
+
+    def signal(name):
+        return getattr(unit, name)._sigInside
+
+    def read(name):
+        value = signal(name).read()
+        full_mask = 2 ** value._dtype.bit_length() - 1
+        return int(value.val) & full_mask if value.vld_mask == full_mask else None
+
+    def clock():
+        yield Timer(HALF_PERIOD)
+        yield WaitWriteOnly()
+        signal("clk").write(1)
+        yield Timer(HALF_PERIOD)
+        yield WaitWriteOnly()
+        signal("clk").write(0)
+
+    def driver():
+        yield WaitWriteOnly()
+        signal("clk").write(0)
+        signal("rst").write(1)
+        signal("input").write(0)
+        signal("input_valid").write(0)
+        signal("output_ready").write(1)
+        yield from clock()
+
+        position = 0
+        for _ in range(max_cycles):
+            if len(results) >= outputs_count:
+                break
+            yield Timer(SETTLE_TIME)
+            yield WaitWriteOnly()
+            signal("rst").write(0)
+            signal("input").write(pixels[min(position, len(pixels) - 1)])
+            signal("input_valid").write(int(position < len(pixels)))
+            yield Timer(SETTLE_TIME)
+            yield WaitCombStable()
+            if position < len(pixels) and read("input_ready"):
+                position += 1
+            if read("output_valid"):
+                results.append(read("output"))
+            yield from clock()
+
+    until = (max_cycles + 1) * (2 * SETTLE_TIME + 2 * HALF_PERIOD) + 1
+    with simulator_workarounds():
+        rtl_simulator = _simulator_class().build(
+            unit, unique_name=f"{unit._name}_{os.getpid()}", build_dir=None
+        )()
+        hdl_simulator = HdlSimulator(rtl_simulator)
+        reconnectUnitSignalsToModel(unit, rtl_simulator)
+        hdl_simulator.run(until=until, extraProcesses=[driver()])
+    return results + [None] * (outputs_count - len(results))
+
+
+def run_shard(kind, params, vectors=100, seed=0):
+    """
+    This function elaborates and simulates a unit with a shard of random and
+    corner case stimuli and compares its outputs with the golden model.
+    Returns a dict with the number of vectors and mismatches, the first
+    mismatches found and the error raised by the elaboration, if any.
+    """
+    start = perf_counter()
+    result = {
+        "kind": kind,
+        "params": params,
+        "seed": seed,
+        "vectors": vectors,
+        "mismatches": 0,
+        "examples": [],
+        "error": None,
+    }
+    try:
+        rng = np.random.default_rng(seed)
+        if kind == "NetworkTop":
+            # the frames are streamed through the layers and their outputs
+            # compared in the order they are read
+            with tempfile.TemporaryDirectory() as path:
+                unit, pixels, values = network_stimuli(params, vectors, rng, path)
+                output = simulate_stream(unit, pixels, len(values), 4 * len(pixels) + 100)
+            expected = {"output": np.array(values, dtype=object)}
+            ports, outputs = {}, {"output": output}
+        else:
+            ports, expected, controls, cycles = unit_stimuli(kind, params, vectors, rng)
+            if kind == "ConvLayer":
+                unit = _unit_class(kind)(log_level=2, **params, **_layer_weights(params))
+            else:
+                unit = _unit_class(kind)(log_level=2, **params)
+            # the units with adder trees count the registers of their
+            # pipelines, the windows of a controller and of a conv layer
+            # start in consecutive cycles
+            if kind not in ["LayerController", "ConvLayer"]:
+                cycles = getattr(unit, "latency", cycles)
+            outputs = simulate(unit, ports, list(expected), controls, cycles)
+    except Exception as e:
+        logging.getLogger("Simulation").debug(f"{kind} {params} failed", exc_info=True)
+        result["error"] = f"{e.__class__.__name__}: {str(e).splitlines()[0]}"
+        result["duration"] = perf_counter() - start
+        return result
+
+    for name, values in expected.items():
+        for i, (simulated, modeled) in enumerate(zip(outputs[name], values.tolist())):
+            # the outputs of the windows before the first one are not modeled
+            if modeled is not None and simulated != modeled:
+                result["mismatches"] += 1
+                if len(result["examples"]) < 5:
+                    result["examples"].append(
+                        {
+                            "port": name,
+                            "inputs": {port: ports[port][i] for port in ports},
+                            "simulated": simulated,
+                            "expected": modeled,
+                        }
+                    )
+    result["duration"] = perf_counter() - start
+    return result
+
+
+def _run_shard(task):
+    return run_shard(**task)
+
+
+def _shard_cost(task):
+    # the multipliers of the conv units dominate the simulation time
+    params = task["params"]
+    if task["kind"] == "NetworkTop":
+        # the multipliers of both conv layers, with a window for each pixel
+        filters = params["filters"]
+        return 9 * (params.get("channels", 1) + filters[1]) * filters[0] * task["vectors"]
+    multipliers = params.get("channels", 1) * params.get("size", 1)
+    if task["kind"] == "ConvLayer":
+        multipliers *= params.get("size", 3) * int(
+            params.get("filters", 4) / params.get("filter_folding", 1)
+        )
+    if task["kind"] in ["BinConvUnit", "MaxPoolUnit"] or params.get("binary", False):
+        multipliers = 1
+    return multipliers * task["vectors"]
+
+
+def default_cases():
+    """
+    This function returns the unit configurations of the default regression:
+    the units and sizes instantiated by the conv, max pool and buffer layers.
+    """
+    cases = [
+        ("AdderTree", {"inputs": 9, "width": 16}),
+        ("AdderTree", {"inputs": 25, "width": 8, "signed": True, "pipeline": 2}),
+        ("AdderTree", {"inputs": 7, "width": 16, "signed": True, "output_width": 16}),
+        ("AdderTree", {"inputs": 9, "width": 8, "signed": True, "output_width": 8, "saturate": True}),
+        ("AdderTree", {"inputs": 25, "width": 4, "output_width": 6, "saturate": True, "pipeline": 1}),
+        ("FixedPointMultiplier", {"width": 16}),
+        ("FixedPointMultiplier", {"width": 16, "adder_pipeline": 1}),
+        ("ConvUnit", {"size": 9, "width": 16}),
+        ("ConvUnit", {"size": 1, "width": 16}),
+        ("ConvUnit", {"size": 25, "width": 16}),
+        ("ConvUnit", {"size": 9, "width": 16, "adder_pipeline": 2}),
+        ("BinConvUnit", {"size": 9, "width": 16}),
+        ("BinConvUnit", {"size": 1, "width": 16}),
+        ("BinConvUnit", {"size": 49, "width": 16}),
+        ("BinConvUnit", {"size": 9, "width": 16, "bin_input": True}),
+        ("BinConvUnit", {"size": 9, "width": 16, "adder_pipeline": 1}),
+        ("MaxPoolUnit", {"width": 16}),
+        ("MaxPoolUnit", {"width": 1, "binary": True}),
+        ("BufferLayer", {"width": 16, "channels": 2, "image_width": 7, "size": 3}),
+        ("BufferLayer", {"width": 16, "channels": 3, "image_width": 6, "size": 2}),
+        ("BufferLayer", {"width": 16, "channels": 2, "image_width": 5, "size": 1}),
+        ("BufferLayer", {"width": 8, "channels": 2, "image_width": 7, "size": 2, "stride": 2}),
+        ("BufferLayer", {"width": 8, "channels": 1, "image_width": 9, "size": 3, "stride": 2}),
+        ("BufferLayer", {"channels": 16, "image_width": 13, "size": 3, "binary": True}),
+        ("LayerController", {"kind": "MaxPoolLayer", "enables": {"en_pool": 0}, "latency": 1}),
+    ]
+    # zero, powers of two, both signs, the bit that extends the sign of the
+    # magnitude and long runs of ones
+    for coefficient in [0, 1, 0x0100, 0x8100, 0x4000, 0x7FFF, 0x8D5A, 0xFFFF]:
+        cases.append(("ConstantMultiplier", {"coefficient": coefficient, "width": 16}))
+    cases.append(
+        ("ConstantMultiplier", {"coefficient": 0x2B6D, "width": 16, "adder_pipeline": 1})
+    )
+    cases.append(("ConstantMultiplier", {"coefficient": 0xA5, "width": 8, "latency": 2}))
+    kernels = [0, 0x0100, 0x8100, 0x4000, 0x7FFF, 0x8D5A, 0x0003, 0x2B6D, 0xFFFF]
+    cases.append(("ConvUnit", {"size": 9, "width": 16, "kernels": kernels}))
+    cases.append(
+        ("ConvUnit", {"size": 9, "width": 16, "kernels": kernels, "adder_pipeline": 1})
+    )
+    # schedules of a conv layer with combinational and pipelined trees
+    for enables, latency in [
+        ({"en_mult": 0, "en_sum": 1, "en_channel": 2, "en_batch": 2, "en_act": 2}, 2),
+        ({"en_mult": 2, "en_sum": 5, "en_channel": 8, "en_batch": 8, "en_act": 8}, 8),
+        ({"en_mult": 0, "en_sum": 2, "en_channel": 3, "en_batch": 3, "en_act": 3}, 3),
+    ]:
+        enables = {"en_window": 0, **enables}
+        cases.append(("LayerController", {"enables": enables, "latency": latency}))
+
+    for channels in [1, 2, 3, 5, 8]:
+        for binary in [False, True]:
+            for bin_output in [False, True]:
+                params = {"channels": channels, "size": 9, "width": 16}
+                params.update({"binary": binary, "bin_output": bin_output})
+                cases.append(("MultiChannelConvUnit", params))
+    cases.append(
+        ("MultiChannelConvUnit", {"channels": 3, "size": 1, "width": 16, "binary": False})
+    )
+    # packed binary inputs
+    for bin_output in [False, True]:
+        params = {"channels": 4, "size": 9, "width": 16, "binary": True, "bin_input": True}
+        cases.append(("MultiChannelConvUnit", {**params, "bin_output": bin_output}))
+    cases.append(("BinConvUnit", {"size": 25, "width": 8, "bin_input": True}))
+    for binary in [False, True]:
+        params = {"channels": 5, "size": 9, "width": 16, "binary": binary}
+        cases.append(("MultiChannelConvUnit", {**params, "adder_pipeline": 1}))
+    params = {"channels": 3, "size": 9, "width": 16, "binary": False, "adder_pipeline": 2}
+    params["kernels"] = [kernels, kernels[::-1], kernels[1::2] + kernels[::2]]
+    cases.append(("MultiChannelConvUnit", params))
+    # units with the channels of zero kernels removed, their channel trees
+    # are delayed to the latency of the tree of all the channels
+    for binary in [False, True]:
+        params = {"channels": 5, "size": 9, "width": 16, "binary": binary}
+        cases.append(("MultiChannelConvUnit", {**params, "active_channels": [1, 2, 4]}))
+        params.update({"active_channels": [0, 3], "adder_pipeline": 1})
+        cases.append(("MultiChannelConvUnit", params))
+    params = {"channels": 3, "size": 9, "width": 16, "binary": False}
+    cases.append(("MultiChannelConvUnit", {**params, "active_channels": []}))
+    # the ssi coefficient folded into the kernels
+    for bin_output in [False, True]:
+        params = {"channels": 3, "size": 9, "width": 16, "binary": False}
+        cases.append(
+            ("MultiChannelConvUnit", {**params, "bin_output": bin_output, "fold_batch_norm": True})
+        )
+    for bin_output in [False, True]:
+        params = {"channels": 5, "size": 9, "width": 16, "binary": True}
+        params.update({"bin_output": bin_output, "shared_units": True})
+        cases.append(("MultiChannelConvUnit", {**params, "active_channels": [0, 1, 3, 4]}))
+    # the F(2x2, 3x3) tiles of the winograd layers
+    cases.append(("WinogradConvUnit", {"width": 16}))
+    cases.append(("WinogradConvUnit", {"width": 8, "lower_output_bit": 4}))
+    params = {"channels": 3, "size": 9, "width": 16, "binary": False, "winograd": True}
+    cases.append(("MultiChannelConvUnit", params))
+    params = {"channels": 2, "size": 9, "width": 8, "binary": False, "winograd": True}
+    params.update({"bin_output": True, "adder_pipeline": 1, "fold_batch_norm": True})
+    cases.append(("MultiChannelConvUnit", params))
+    # conv layer parts streaming a window per cycle, with units that compute
+    # several filters in sequence
+    cases.append(("ConvLayer", {"channels": 2, "filters": 4, "width": 16}))
+    params = {"channels": 2, "filters": 4, "width": 16, "filter_folding": 2}
+    cases.append(("ConvLayer", params))
+    cases.append(("ConvLayer", {**params, "adder_pipeline": 1, "fold_batch_norm": True}))
+    cases.append(("ConvLayer", {**params, "winograd": True}))
+    params = {"channels": 2, "filters": 6, "width": 16, "binary": True, "filter_folding": 3}
+    cases.append(("ConvLayer", {**params, "adder_pipeline": 1}))
+    cases.append(("ConvLayer", {**params, "bin_output": True}))
+    # and with their coefficients in the synchronous roms of kernel_rom
+    cases.append(("ConvLayer", {"channels": 2, "filters": 4, "width": 16, "kernel_rom": True}))
+    params = {"channels": 2, "filters": 4, "width": 16, "filter_folding": 2, "kernel_rom": True}
+    cases.append(("ConvLayer", {**params, "winograd": True}))
+    params = {"channels": 2, "filters": 6, "width": 16, "binary": True, "filter_folding": 3}
+    cases.append(("ConvLayer", {**params, "adder_pipeline": 1, "kernel_rom": True}))
+    # and with weight memories loaded with other weights through their slave
+    cases.append(("ConvLayer", {"channels": 2, "filters": 4, "width": 16, "weight_memory": True}))
+    params = {"channels": 1, "filters": 2, "width": 16, "filter_folding": 2, "weight_memory": True}
+    cases.append(("ConvLayer", {**params, "winograd": True}))
+    params = {"channels": 2, "filters": 6, "width": 16, "binary": True, "filter_folding": 3}
+    cases.append(("ConvLayer", {**params, "adder_pipeline": 1, "weight_memory": True}))
+    # and with the units of a zero filter removed by prune_kernels
+    params = {"channels": 2, "filters": 2, "width": 16, "prune_kernels": True, "zero_filters": [0]}
+    cases.append(("ConvLayer", params))
+    cases.append(("ConvLayer", {**params, "binary": True}))
+    # the inputs of a layer after one in another fixed point format, shifted
+    # right and saturated, shifted left and sign extended, and saturated by
+    # a left shift of the same width
+    params = {"channels": 2, "filters": 4, "width": 8, "integer_portion": 3, "decimal_portion": 4}
+    cases.append(("ConvLayer", {**params, "input_format": (16, 4, 11)}))
+    params = {"channels": 2, "filters": 4, "width": 16, "integer_portion": 4, "decimal_portion": 11}
+    cases.append(("ConvLayer", {**params, "input_format": (8, 1, 6)}))
+    params = {"channels": 2, "filters": 6, "width": 16, "binary": True, "filter_folding": 3}
+    cases.append(("ConvLayer", {**params, "kernel_rom": True, "input_format": (16, 5, 10)}))
+    # whole frames streamed through NetworkTop, with the padding of its
+    # buffer layers and a last conv layer in another format
+    params = {"image_width": 6, "channels": 1, "filters": (2, 2), "scale": 40}
+    cases.append(("NetworkTop", {**params, "adder_pipeline": 1}))
+    cases.append(("NetworkTop", {**params, "channels": 2, "filters": (2, 4), "binary": True}))
+    return cases
+
+
+def _part_codes(args):
+    # the codes of a conv layer part and the datapath params of its units
+    from .golden_model import layer_format
+    from .utils import quantize_conv_weights
+    from .weight_store import resolve_weight_slices
+
+    weights = resolve_weight_slices(
+        args["weights_store"], args["weights_slice"], args["variables_slice"]
+    )
+    width, integer_portion, decimal_portion = layer_format(args)
+    codes = quantize_conv_weights(
+        filters=args["filters"],
+        channels=args["channels"],
+        size=args["size"] ** 2,
+        width=width,
+        binary=args["binary"],
+        integer_portion=integer_portion,
+        decimal_portion=decimal_portion,
+        fold_batch_norm=args.get("fold_batch_norm", False),
+        **weights,
+    )
+    params = {"size": args["size"] ** 2, "width": width}
+    if args.get("decimal_portion") is not None:
+        params["lower_output_bit"] = args["decimal_portion"]
+    if args.get("adder_pipeline"):
+        params["adder_pipeline"] = args["adder_pipeline"]
+    return codes, params
+
+
+def _part_cases(args):
+    # the units of the first part of a layer that depend on its weights:
+    # the first conv unit with constant kernels, the other ones only differ
+    # in their constants, and the first unit with removed channels
+    from .utils import prune_conv_kernels
+
+    cases = []
+    codes, params = _part_codes(args)
+    if args.get("constant_kernels") and not args["binary"]:
+        cases.append(("ConvUnit", {**params, "kernels": codes["kernel"][0, 0].tolist()}))
+    if args.get("prune_kernels"):
+        pruning = prune_conv_kernels(codes, args["binary"], params["width"])
+        params.update({"channels": args["channels"], "binary": args["binary"]})
+        params["bin_input"] = args["bin_input"]
+        params.update({"bin_output": args["bin_output"], "shared_units": args["binary"]})
+        if args.get("fold_batch_norm"):
+            params["fold_batch_norm"] = True
+        for active in pruning["active"]:
+            if len(active) < args["channels"] or args["binary"]:
+                cases.append(("MultiChannelConvUnit", {**params, "active_channels": active}))
+                break
+    return cases
+
+
+def network_cases(network_file=""):
+    """
+    This function returns the unit configurations instantiated by the layers
+    of a network config, with the width and fixed point format chosen by the
+    parser and the adder pipeline of each layer, without repetitions.
+    """
+    from .network_parser import NetworkParser
+
+    cases = []
+    for layer in NetworkParser(network_file).parse_network():
+        args = layer["args"]
+        if layer["class"].__name__ == "ConvLayer" and not args.get("top_entity"):
+            if args.get("constant_kernels") or args.get("prune_kernels"):
+                if not args["process_id"]:
+                    cases += _part_cases(args)
+            continue
+        if layer["class"].__name__ == "ConvLayer":
+            datapath = {"width": args.get("width", 16)}
+            if args.get("decimal_portion") is not None:
+                datapath["lower_output_bit"] = args["decimal_portion"]
+            if args.get("adder_pipeline"):
+                datapath["adder_pipeline"] = args["adder_pipeline"]
+            size = args["size"] ** 2
+            if args["binary"]:
+                params = {"size": size, **datapath, "bin_input": args["bin_input"]}
+                cases.append(("BinConvUnit", params))
+            elif args.get("winograd"):
+                params = {key: datapath[key] for key in datapath if key != "adder_pipeline"}
+                cases.append(("WinogradConvUnit", params))
+            else:
+                cases.append(("FixedPointMultiplier", dict(datapath)))
+                params = {"size": size, **datapath, "bin_input": args["bin_input"]}
+                cases.append(("ConvUnit", params))
+            params = {"channels": args["channels"], "size": size, **datapath}
+            params.update({"binary": args["binary"], "bin_input": args["bin_input"]})
+            params["bin_output"] = args["bin_output"]
+            if args.get("fold_batch_norm"):
+                params["fold_batch_norm"] = True
+            if args.get("winograd"):
+                params["winograd"] = True
+            cases.append(("MultiChannelConvUnit", params))
+            folding = args.get("filter_folding", 1)
+            memories = folding > 1 or args.get("kernel_rom") or args.get("weight_memory")
+            if memories or args.get("input_format"):
+                # the roms, the filter selects and the requantization of the
+                # inputs of a part with two units
+                params = {key: args[key] for key in ["channels", "size", "binary", "bin_input"]}
+                params.update({"bin_output": args["bin_output"], "width": datapath["width"]})
+                for key in ["integer_portion", "decimal_portion", "adder_pipeline"]:
+                    if args.get(key) is not None:
+                        params[key] = args[key]
+                for key in ["fold_batch_norm", "winograd", "kernel_rom", "weight_memory"]:
+                    if args.get(key):
+                        params[key] = True
+                if args.get("input_format"):
+                    params["input_format"] = tuple(args["input_format"])
+                params["filters"] = 2 * folding
+                if folding > 1:
+                    params["filter_folding"] = folding
+                cases.append(("ConvLayer", params))
+        elif layer["class"].__name__ == "MaxPoolLayer":
+            binary = args["binary"]
+            params = {"width": 1 if binary else args.get("width", 16), "binary": binary}
+            cases.append(("MaxPoolUnit", params))
+        elif layer["class"].__name__ == "BufferLayer":
+            params = {"channels": args["channels"], "image_width": args["image_width"]}
+            params.update({"size": args["size"], "binary": args["binary"]})
+            params["stride"] = args.get("stride", 1)
+            if not args["binary"]:
+                params["width"] = args.get("width", 16)
+            cases.append(("BufferLayer", params))
+        elif layer["class"].__name__ == "LayerController":
+            params = {"kind": args["kind"], "enables": args["enables"]}
+            params["latency"] = args["latency"]
+            cases.append(("LayerController", params))
+
+    unique_cases = []
+    for case in cases:
+        if case not in unique_cases:
+            unique_cases.append(case)
+    return unique_cases
+
+
+def run_regression(cases=None, vectors=1000, shard_size=250, processes=None, seed=0):
+    """
+    This function splits the stimuli of each unit configuration in shards
+    and simulates them in a process pool. Returns one summary per case with
+    the number of vectors, mismatches, first mismatches, errors and the
+    simulation time of all its shards.
+    """
+    from multiprocessing import Pool
+
+    logger = logging.getLogger("Simulation")
+    if cases is None:
+        cases = default_cases()
+
+    tasks = []
+    for case_id, (kind, params) in enumerate(cases):
+        for shard, offset in enumerate(range(0, vectors, shard_size)):
+            tasks.append(
+                {
+                    "kind": kind,
+                    "params": params,
+                    "vectors": min(shard_size, vectors - offset),
+                    "seed": seed + case_id * 1000 + shard,
+                }
+            )
+    # the slowest units first, so the pool is not left waiting for them
+    tasks.sort(key=_shard_cost, reverse=True)
+
+    summaries = {}
+    with Pool(processes=processes) as pool:
+        for result in pool.imap_unordered(_run_shard, tasks):
+            key = (result["kind"], repr(sorted(result["params"].items())))
+            summary = summaries.setdefault(
+                key,
+                {
+                    "kind": result["kind"],
+                    "params": result["params"],
+                    "vectors": 0,
+                    "mismatches": 0,
+                    "examples": [],
+                    "error": None,
+                    "duration": 0.0,
+                },
+            )
+            summary["duration"] += result["duration"]
+            if result["error"] is not None:
+                summary["error"] = result["error"]
+                continue
+            summary["vectors"] += result["vectors"]
+            summary["mismatches"] += result["mismatches"]
+            summary["examples"] += result["examples"][: 5 - len(summary["examples"])]
+            logger.info(
+                f"{result['kind']} {result['params']} shard {result['seed']}: "
+                f"{result['mismatches']} mismatches in {result['duration']:.2f}s"
+            )
+
+    return [
+        summaries[(kind, repr(sorted(params.items())))]
+        for kind, params in cases
+        if (kind, repr(sorted(params.items()))) in summaries
+    ]
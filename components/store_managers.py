@@ -0,0 +1,139 @@
+from hwt.serializer.store_manager import StoreManager, SaveToStream, SaveToFilesFlat
+
+
+class SaveTopEntity(StoreManager):
+    def __init__(self, serializer_cls=None, root="", entity=""):
+        super(SaveTopEntity, self).__init__(serializer_cls)
+        self.root = root
+        self.entity = entity
+        import os
+
+        os.makedirs(root, exist_ok=True)
+
+    def write(self, obj):
+        import os
+
+        name = obj.module_name.val
+        if name != self.entity:
+            return
+        f_name = name + self.serializer_cls.fileExtension
+        fp = os.path.join(self.root, f_name)
+        self.filepath = fp
+
+        with open(fp, 'w') as f:
+            s = SaveToStream(self.serializer_cls, f, self.filter, self.name_scope)
+            s.write(obj)
+
+
+class SaveToLanguages(StoreManager):
+    """
+    Store manager that writes each object of a single elaboration with the
+    serializer of each language in its own directory (only the top entity,
+    when it is set). The netlist is elaborated with the names of the vhdl
+    serializer (or of the first one without vhdl), so its files are the same
+    ones written by that serializer alone. Each other language resolves the
+    names that are its keywords in its own name scope (see language_names).
+    """
+
+    def __init__(self, serializer_classes=[], roots=[], entity=None):
+        extensions = [serializer_cls.fileExtension for serializer_cls in serializer_classes]
+        self.primary = extensions.index(".vhd") if ".vhd" in extensions else 0
+        super(SaveToLanguages, self).__init__(serializer_classes[self.primary])
+        if entity:
+            self.stores = [
+                SaveTopEntity(serializer_cls, root, entity)
+                for serializer_cls, root in zip(serializer_classes, roots)
+            ]
+        else:
+            self.stores = [
+                SaveToFilesFlat(serializer_cls, root, self.filter)
+                for serializer_cls, root in zip(serializer_classes, roots)
+            ]
+        # the ports of each module renamed in each language, for the
+        # instances of the module
+        self.port_names = [{} for serializer_cls in serializer_classes]
+
+    def write(self, obj):
+        from hdlConvertorAst.hdlAst import HdlModuleDef
+
+        for i, store in enumerate(self.stores):
+            if i == self.primary or not isinstance(obj, HdlModuleDef):
+                store.name_scope = self.name_scope
+                store.write(obj)
+                continue
+            renames = []
+            store.name_scope = language_names(
+                obj, store.serializer_cls, self.port_names[i], renames
+            )
+            try:
+                store.write(obj)
+            finally:
+                for item, attribute, name in reversed(renames):
+                    setattr(item, attribute, name)
+
+
+def language_names(module, serializer_cls, port_names, renames):
+    """
+    This function renames the ports, signals, processes and instances of an
+    elaborated module whose names are keywords of the language of the given
+    serializer, as the serializer would name them. The renamed ports of each
+    module are kept in port_names and used in the instances of the module.
+    The old names are appended to renames as (object, attribute, name) to
+    restore them after writing the module. Returns the name scope of the
+    module in that language.
+    """
+    from hdlConvertorAst.hdlAst import HdlCompInst, HdlIdDef
+    from hwt.hdl.block import HdlStatementBlock
+    from hdlConvertorAst.translate.common.name_scope import NameOccupiedErr
+
+    def resolve(name_scope, items):
+        occupied = []
+        for item, attribute in items:
+            try:
+                name_scope.register_name(getattr(item, attribute), item)
+            except NameOccupiedErr:
+                occupied.append((item, attribute))
+        for item, attribute in occupied:
+            name = getattr(item, attribute)
+            renames.append((item, attribute, name))
+            setattr(item, attribute, name_scope.checked_name(name, item))
+
+    top = serializer_cls.TO_HDL_AST.getBaseNameScope()
+    module_name = module.module_name.val
+
+    def module_scope():
+        return top.__class__(top, module_name, top.ignorecase)
+
+    # the ports are resolved on their own, so the instances of the module
+    # rename them in the same way
+    ports = [(port.getInternSig(), "name") for port in module.dec.ports]
+    old_ports = [item.name for item, attribute in ports]
+    resolve(module_scope(), ports)
+    port_names[module_name] = {
+        old: item.name for old, (item, attribute) in zip(old_ports, ports) if old != item.name
+    }
+
+    name_scope = module_scope()
+    items = ports + [(param, "name") for param in module.dec.params]
+    declarations = []
+    for obj in module.objs:
+        if isinstance(obj, HdlIdDef):
+            items.append((obj.origin, "name"))
+            declarations.append(obj)
+        elif isinstance(obj, HdlStatementBlock):
+            items.append((obj, "name"))
+        elif isinstance(obj, HdlCompInst):
+            items.append((obj.name, "val"))
+            names = port_names.get(obj.module_name.val, {})
+            for port in obj.port_map:
+                signal = port.getInternSig()
+                if signal.name in names:
+                    renames.append((signal, "name", signal.name))
+                    signal.name = names[signal.name]
+    resolve(name_scope, items)
+    # the declarations of the signals have the names of their signals
+    for declaration in declarations:
+        if declaration.name != declaration.origin.name:
+            renames.append((declaration, "name", declaration.name))
+            declaration.name = declaration.origin.name
+    return name_scope
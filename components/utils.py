@@ -1,28 +1,18 @@
-from hwt.serializer.store_manager import StoreManager, SaveToStream, SaveToFilesFlat
+# serializer of each language of to_hdl, imported when it is used
+HDL_SERIALIZERS = {
+    "vhdl": ("hwt.serializer.vhdl", "Vhdl2008Serializer"),
+    "verilog": ("hwt.serializer.verilog", "VerilogSerializer"),
+    "systemc": ("hwt.serializer.systemC", "SystemCSerializer"),
+}
 
 
-class SaveTopEntity(StoreManager):
-    def __init__(self, serializer_cls=None, root="", entity=""):
-        super(SaveTopEntity, self).__init__(serializer_cls)
-        self.root = root
-        self.entity = entity
-        import os
-
-        os.makedirs(root, exist_ok=True)
-
-    def write(self, obj):
-        import os
+def hdl_serializer(language="vhdl"):
+    import importlib
 
-        name = obj.module_name.val
-        if name != self.entity:
-            return
-        f_name = name + self.serializer_cls.fileExtension
-        fp = os.path.join(self.root, f_name)
-        self.filepath = fp
-
-        with open(fp, 'w') as f:
-            s = SaveToStream(self.serializer_cls, f, self.filter, self.name_scope)
-            s.write(obj)
+    if language not in HDL_SERIALIZERS:
+        raise ValueError(f"HDL language not supported: {language}")
+    module, name = HDL_SERIALIZERS[language]
+    return getattr(importlib.import_module(module), name)
 
 
 def read_floats(file_path=""):
@@ -84,6 +74,459 @@ def float2fixed(weights=[], integer_portion=4, decimal_portion=11):
     return fixed_weights
 
 
+def float2fixed_array(weights=[], integer_portion=4, decimal_portion=11):
+    """
+    Vectorized version of float2fixed. It receives an array (or any
+    sequence) of float values and returns a numpy int64 array with the same
+    shape holding the fixed point codes. The result is bit-for-bit identical
+    to float2fixed, including its saturation of out-of-range values, but the
+    whole array is converted in a few numpy operations instead of building
+    strings for each value.
+    """
+    import numpy as np
+
+    values = np.asarray(weights, dtype=np.float64)
+    if not np.all(np.isfinite(values)):
+        raise ValueError("float2fixed_array received a non finite value")
+
+    fixed_width = integer_portion + decimal_portion
+    max_value = 2 ** (fixed_width + 1)
+    negative = ~(values >= 0)
+
+    # integer and decimal parts exactly as computed by float2fixed, note that
+    # for negative values the decimal part is abs(w - int(abs(w)))
+    integer = np.trunc(np.abs(values))
+    decimal = np.abs(values - integer)
+
+    # float2fixed emits the first decimal bit only when int(2 * decimal) is 1
+    # and the remaining bits from the fractional part of 2 * decimal
+    if decimal_portion > 0:
+        first_bit = (np.floor(decimal * 2) == 1).astype(np.int64)
+        remaining = np.floor(
+            np.mod(decimal * 2.0 ** decimal_portion, 2.0 ** (decimal_portion - 1))
+        ).astype(np.int64)
+        fraction = (first_bit << (decimal_portion - 1)) | remaining
+    else:
+        fraction = np.zeros(values.shape, dtype=np.int64)
+
+    # positive values: the code is the concatenation of integer and decimal
+    # bits, saturated to 2 ** (n + 1) - 1 when greater than 2 ** (n + 1)
+    limit = 2 ** (integer_portion + 1)
+    positive_integer = np.minimum(integer, limit).astype(np.int64)
+    positive_code = (positive_integer << decimal_portion) | fraction
+    positive_code = np.where(
+        (integer > limit) | (positive_code > max_value), max_value - 1, positive_code
+    )
+
+    # negative values: two's complement of a string as wide as the integer
+    # part (at least integer_portion bits and at least one digit) concatenated
+    # to the decimal bits
+    _, integer_length = np.frexp(integer)
+    string_length = np.maximum(np.maximum(integer_length, integer_portion), 1)
+    complement = np.ldexp(1.0, string_length) - integer
+    in_range = complement <= 2 ** max(integer_portion, 1)
+    complement = np.where(in_range, complement, 0).astype(np.int64)
+    negative_value = (complement << decimal_portion) - fraction
+    negative_code = np.where(
+        in_range & (negative_value < 2 ** fixed_width),
+        negative_value + 2 ** fixed_width,
+        max_value,
+    )
+
+    return np.where(negative, negative_code, positive_code)
+
+
+def fixed2float_array(codes=[], integer_portion=4, decimal_portion=11):
+    """
+    This function converts fixed point codes (two's complement, with one sign
+    bit, integer_portion integer bits and decimal_portion decimal bits) back
+    to float values.
+    """
+    import numpy as np
+
+    width = integer_portion + decimal_portion + 1
+    codes = np.asarray(codes, dtype=np.int64) & (2 ** width - 1)
+    signed = codes - ((codes >> (width - 1)) << width)
+    return signed / 2.0 ** decimal_portion
+
+
+def fixed_point_format(width=16):
+    """
+    This function returns the integer and decimal portions of the fixed point
+    representation used by the conv layers of the given width.
+    """
+    return (4, 11) if width == 16 else (3, 4)
+
+
+def conv_coefficients(
+    weights=[],
+    biases=[],
+    mean=[],
+    scale=[],
+    variance=[],
+    filters=1,
+    channels=1,
+    size=9,
+    binary=False,
+    fold_batch_norm=False,
+):
+    """
+    This function computes the float coefficients of a conv layer part that
+    are driven in the ports of its multichannel conv units: ssi (scale /
+    sqrt(variance)) and bn (biases / ssi - mean) per filter, the kernel
+    values per filter, channel and kernel element (for binary layers, the
+    average of the kernel is the only element) and, for each filter and
+    channel, the kernel signs packed with the first weight as the most
+    significant bit. With fold_batch_norm, the kernels of the non binary
+    layers are multiplied by the ssi of their filter and ssi is one.
+    """
+    import numpy as np
+
+    weights = np.asarray(weights[: filters * channels * size], dtype=np.float64)
+    weights = weights.reshape(filters, channels, size)
+    scale = np.asarray(scale[:filters], dtype=np.float64)
+    variance = np.asarray(variance[:filters], dtype=np.float64)
+    mean = np.asarray(mean[:filters], dtype=np.float64)
+    biases = np.asarray(biases[:filters], dtype=np.float64)
+
+    ssi_coef = scale / np.sqrt(variance)
+    bn_coef = biases / ssi_coef - mean
+
+    if binary:
+        # sum the kernel values in order to keep the same rounding of sum()
+        sum_weights = np.zeros(weights.shape[:2])
+        for k in range(size):
+            sum_weights = sum_weights + weights[:, :, k]
+        kernel = (sum_weights / size)[:, :, np.newaxis]
+    else:
+        kernel = weights
+        if fold_batch_norm:
+            kernel = weights * ssi_coef[:, np.newaxis, np.newaxis]
+            ssi_coef = np.ones(filters)
+
+    sig_bits = (weights < 0).astype(np.int64)
+    sig_shifts = np.arange(size - 1, -1, -1, dtype=np.int64)
+    return {
+        "ssi": ssi_coef,
+        "bn": bn_coef,
+        "kernel": kernel,
+        "kernel_sig": np.sum(sig_bits << sig_shifts, axis=2),
+    }
+
+
+def quantize_conv_weights(
+    weights=[],
+    biases=[],
+    mean=[],
+    scale=[],
+    variance=[],
+    filters=1,
+    channels=1,
+    size=9,
+    width=16,
+    binary=False,
+    integer_portion=None,
+    decimal_portion=None,
+    fold_batch_norm=False,
+):
+    """
+    This function converts the float parameters of a conv layer part to the
+    fixed point codes driven in the ports of its multichannel conv units
+    (see conv_coefficients). Without integer and decimal portions, the
+    default format of the width is used. The codes out of the width of the
+    format are replaced by zero (the negative values truncated to zero) or
+    by the most negative code (the values below the range).
+    """
+    import numpy as np
+
+    if integer_portion is None or decimal_portion is None:
+        integer_portion, decimal_portion = fixed_point_format(width)
+    fixed_width = integer_portion + decimal_portion + 1
+
+    def convert(values):
+        codes = float2fixed_array(values, integer_portion, decimal_portion)
+        # float2fixed returns 2 ** width for the negative values truncated to
+        # zero and for the ones below the range, which do not fit in the ports
+        negative_limit = np.where(values < 0, 2 ** (fixed_width - 1), 0)
+        in_range = values > -(2 ** integer_portion)
+        fixed_codes = np.where(in_range, 0, negative_limit)
+        return np.where(codes == 2 ** fixed_width, fixed_codes, codes)
+
+    coefficients = conv_coefficients(
+        weights, biases, mean, scale, variance, filters, channels, size, binary, fold_batch_norm
+    )
+    return {
+        "ssi": convert(coefficients["ssi"]),
+        "bn": convert(coefficients["bn"]),
+        "kernel": convert(coefficients["kernel"]),
+        "kernel_sig": coefficients["kernel_sig"],
+    }
+
+
+def batch_norm_folding_error(
+    weights=[],
+    biases=[],
+    mean=[],
+    scale=[],
+    variance=[],
+    filters=1,
+    channels=1,
+    size=9,
+    width=16,
+    integer_portion=None,
+    decimal_portion=None,
+):
+    """
+    This function returns the requantization error of folding the batch
+    normalization of a non binary conv layer part into its kernels, as a
+    tuple with the relative errors (rms of the error over the rms of the
+    values) of the products of the kernels and ssi: the folded kernel codes
+    and the product of the kernel and ssi codes without folding.
+    """
+    import numpy as np
+
+    if integer_portion is None or decimal_portion is None:
+        integer_portion, decimal_portion = fixed_point_format(width)
+    parameters = {
+        "weights": weights,
+        "biases": biases,
+        "mean": mean,
+        "scale": scale,
+        "variance": variance,
+        "filters": filters,
+        "channels": channels,
+        "size": size,
+    }
+    values = conv_coefficients(fold_batch_norm=True, **parameters)["kernel"]
+    values_rms = float(np.sqrt(np.mean(values ** 2))) if values.size else 0.0
+
+    errors = []
+    for fold_batch_norm in [True, False]:
+        codes = quantize_conv_weights(
+            width=width,
+            integer_portion=integer_portion,
+            decimal_portion=decimal_portion,
+            fold_batch_norm=fold_batch_norm,
+            **parameters,
+        )
+        kernel = fixed2float_array(codes["kernel"], integer_portion, decimal_portion)
+        ssi = fixed2float_array(codes["ssi"], integer_portion, decimal_portion)
+        products = kernel * ssi[:, np.newaxis, np.newaxis]
+        error = float(np.sqrt(np.mean((products - values) ** 2))) if values.size else 0.0
+        errors.append(error / values_rms if values_rms else error)
+    return tuple(errors)
+
+
+def prune_conv_kernels(codes, binary=False, width=16):
+    """
+    This function finds the conv units of a conv layer part that can be
+    removed, from the codes returned by quantize_conv_weights. The output of
+    a unit is always zero when all the magnitudes of its kernel codes are
+    zero (the multipliers drop the sign of the zero products) or, in binary
+    layers, when its kernel_abs code is zero. In binary layers, the units of
+    the same channel with the same kernel_sig and kernel_abs in different
+    filters have the same output and are shared. Returns a dict with the
+    channels that keep a unit in each filter (active), the index of the
+    shared unit of each filter and channel (shared, -1 for the removed
+    ones), the filter and channel of each shared unit (units) and the number
+    of units, zero units and duplicate units.
+    """
+    import numpy as np
+
+    kernels = np.asarray(codes["kernel"], dtype=np.int64)
+    filters, channels = kernels.shape[:2]
+    if binary:
+        zero = kernels[:, :, 0] % 2 ** width == 0
+    else:
+        zero = np.all(kernels % 2 ** (width - 1) == 0, axis=2)
+
+    active = [[j for j in range(channels) if not zero[i, j]] for i in range(filters)]
+    shared = np.full((filters, channels), -1, dtype=np.int64)
+    units = []
+    unit_index = {}
+    for i in range(filters):
+        for j in active[i]:
+            if binary:
+                key = (j, int(codes["kernel_sig"][i, j]), int(kernels[i, j, 0]))
+            else:
+                key = (i, j)
+            if key not in unit_index:
+                unit_index[key] = len(units)
+                units.append((i, j))
+            shared[i, j] = unit_index[key]
+
+    n_zero = int(np.count_nonzero(zero))
+    return {
+        "active": active,
+        "shared": shared,
+        "units": units,
+        "total": filters * channels,
+        "zero": n_zero,
+        "duplicate": filters * channels - n_zero - len(units),
+    }
+
+
+def winograd_kernels(kernels=[], width=16):
+    """
+    This function returns the kernels of the Winograd F(2x2, 3x3) units from
+    the 3x3 kernel codes of a conv layer (kernel elements in row major order
+    in the last axis): the transform G g G^T of each kernel multiplied by 4,
+    so its 4x4 elements (row major in the last axis) are integer codes of
+    width + 4 bits without any rounding. G has the halves of the transform,
+    2G is computed instead.
+    """
+    import numpy as np
+
+    kernels = np.asarray(kernels, dtype=np.int64) & (2 ** width - 1)
+    kernels = kernels - ((kernels >> (width - 1)) << width)
+    kernels = kernels.reshape(kernels.shape[:-1] + (3, 3))
+    double_g = np.array([[2, 0, 0], [1, 1, 1], [1, -1, 1], [0, 0, 2]], dtype=np.int64)
+    transformed = double_g @ kernels @ double_g.T
+    return transformed.reshape(transformed.shape[:-2] + (16,)) & (2 ** (width + 4) - 1)
+
+
+def select_fixed_point_format(values=[], widths=[8, 16], error_budget=0.01):
+    """
+    This function chooses the fixed point format of a set of values. For
+    each width, from the narrowest, the integer portion is the smallest one
+    (at least one bit, as float2fixed needs for the negative values) that
+    represents the largest magnitude without saturation, and its relative
+    quantization error is the rms of the errors of truncating the values
+    toward zero over the rms of the values. The first width whose error is
+    within the error budget is returned as a tuple (width, integer_portion,
+    decimal_portion, error), the widest one when no width meets the budget
+    (with an infinite error when its largest value saturates).
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if not np.all(np.isfinite(values)):
+        raise ValueError("select_fixed_point_format received a non finite value")
+    if values.size == 0:
+        values = np.zeros(1)
+    max_value = float(np.max(np.abs(values)))
+    values_rms = float(np.sqrt(np.mean(values ** 2)))
+
+    fixed_format = None
+    for width in sorted(widths):
+        # largest code over the scale of each integer portion
+        integer_portion = 1
+        while integer_portion < width - 1:
+            if max_value <= (2 ** (width - 1) - 1) / 2 ** (width - 1 - integer_portion):
+                break
+            integer_portion += 1
+        decimal_portion = width - 1 - integer_portion
+
+        if max_value > 2 ** (width - 1) - 1:
+            # saturated even without decimal bits
+            error = float("inf")
+        else:
+            errors = np.trunc(values * 2 ** decimal_portion) / 2 ** decimal_portion - values
+            error = float(np.sqrt(np.mean(errors ** 2)))
+            error = error / values_rms if values_rms else error
+        fixed_format = (width, integer_portion, decimal_portion, error)
+        if error <= error_budget:
+            break
+    return fixed_format
+
+
+def csd_digits(value=0, bits=16):
+    """
+    This function returns the canonical signed digit recoding of a value
+    modulo 2 ** bits as a list of (shift, digit) tuples, with digits 1 or -1
+    and no two consecutive non zero digits. The digits at or above bits
+    are dropped, they do not change the products modulo 2 ** bits.
+    """
+    value = int(value) % 2 ** bits
+    digits = []
+    shift = 0
+    while value:
+        if value & 1:
+            digit = 2 - (value & 3)
+            value -= digit
+            if shift < bits:
+                digits.append((shift, digit))
+        value >>= 1
+        shift += 1
+    return digits
+
+
+def serialize_uniq_by(*attributes):
+    """
+    This function returns a class decorator that serializes one entity for
+    each value of the given attributes of the units, as serializeParamsUniq
+    does with the hwt params. The other units with the same values are
+    instances of this entity.
+    """
+
+    def serialize_decision(unit, priv):
+        key = tuple(getattr(unit, name) for name in attributes)
+        if priv is None:
+            priv = {}
+        if key in priv:
+            return False, priv, priv[key]
+        priv[key] = unit
+        return True, priv, None
+
+    def decorator(cls):
+        cls._serializeDecision = staticmethod(serialize_decision)
+        return cls
+
+    return decorator
+
+
+def memory_words(fields=[]):
+    """
+    This function packs the codes of the fields of a memory into its words:
+    each field is an array with one code for each address and its number of
+    bits, the first field in the least significant bits. The bits of all the
+    words are converted at once and the words are returned as hexadecimal
+    strings, from the address 0.
+    """
+    import numpy as np
+
+    bits = np.concatenate(
+        [
+            (np.asarray(codes, dtype=np.int64)[:, np.newaxis] >> np.arange(width)) & 1
+            for codes, width in fields
+        ],
+        axis=1,
+    )
+    # most significant digit first, padded with zeros to whole digits
+    padding = -bits.shape[1] % 4
+    bits = np.pad(bits, ((0, 0), (0, padding)))[:, ::-1]
+    digits = bits.reshape(len(bits), -1, 4) @ np.array([8, 4, 2, 1])
+    characters = np.array(list("0123456789ABCDEF"))[digits]
+    return ["".join(word) for word in characters]
+
+
+def write_memory_files(path=".", name="", words=[], width=1, extensions=(".mif", ".hex")):
+    """
+    This function writes the initialization files of a memory from its words
+    (see memory_words) with the given extensions: a Quartus memory
+    initialization file (.mif) and a file with one hexadecimal word per line
+    (.hex, read by $readmemh). Returns the paths of the written files.
+    """
+    import os
+
+    files = []
+    if ".mif" in extensions:
+        mif_file = os.path.join(path, f"{name}.mif")
+        lines = [f"{address} : {word};" for address, word in enumerate(words)]
+        with open(mif_file, "w") as file:
+            file.write(f"WIDTH={width};\nDEPTH={len(words)};\n\n")
+            file.write("ADDRESS_RADIX=UNS;\nDATA_RADIX=HEX;\n\nCONTENT BEGIN\n")
+            file.write("".join(f"    {line}\n" for line in lines))
+            file.write("END;\n")
+        files.append(mif_file)
+    if ".hex" in extensions:
+        hex_file = os.path.join(path, f"{name}.hex")
+        with open(hex_file, "w") as file:
+            file.write("".join(f"{word}\n" for word in words))
+        files.append(hex_file)
+    return files
+
+
 def print_info(self, **kwargs):
     self.process_id = kwargs.get("process_id", 0)
     self.layer_id = kwargs.get("layer_id", 0)
@@ -154,28 +597,95 @@ def to_systemc(unit=None, path=".", name=""):
     return file
 
 
+def to_hdl(unit=None, path=".", name="", languages=("vhdl", "systemc"), root=None):
+    """
+    This function elaborates the unit once and writes it in each one of the
+    given languages, in a directory per language: the path is moved inside
+    root/<language> when root is set (so each language has its own tree of
+    the network) or is path/<language> otherwise. Returns the file of the
+    first language.
+    """
+    import os
+
+    print("Converting hdl files... ", end="")
+    serializers = [hdl_serializer(language) for language in languages]
+    if root is None:
+        paths = [os.path.join(path, language) for language in languages]
+    else:
+        relative_path = os.path.relpath(path, root)
+        paths = [
+            os.path.normpath(os.path.join(root, language, relative_path))
+            for language in languages
+        ]
+    files = save_files(unit, serializers, paths, name)
+    print("Ok!")
+    return files[0]
+
+
+class HdlConverter:
+    """
+    Convert function of NetworkParser.generate that writes each job in all
+    the given languages with a single elaboration (see to_hdl), in a tree
+    per language inside root.
+    """
+
+    def __init__(self, languages=("vhdl", "systemc"), root="."):
+        for language in languages:
+            hdl_serializer(language)
+        self.languages = list(languages)
+        self.root = root
+
+    def __call__(self, unit=None, path=".", name=""):
+        return to_hdl(unit, path, name, self.languages, self.root)
+
+
+def _memories(unit):
+    # the units with their own save method in the hierarchy of a unit
+    for child in unit._units or []:
+        if hasattr(child, "save"):
+            yield child
+        else:
+            yield from _memories(child)
+
+
 def save_file(unit, serializer, path, name):
+    return save_files(unit, [serializer], [path], name)[0]
+
+
+def save_files(unit, serializers, paths, name):
+    from hwt.serializer.store_manager import SaveToFilesFlat
     from hwt.synthesizer.utils import to_rtl
+    from .store_managers import SaveToLanguages, SaveTopEntity
     import os
 
-    os.makedirs(path, exist_ok=True)
+    for path in paths:
+        os.makedirs(path, exist_ok=True)
     unit.logger.info(f"Worker healthcheck: PID {os.getpid()}")
 
-    file_extension = serializer.fileExtension
     unit.logger.info(
         f"Process {unit.process_id} Layer {unit.layer_id} "
         f"Unit {unit.unit_id} Channel {unit.channel_id} WRITER"
     )
-    unit.logger.info(f"Converting to {file_extension} in {path}/{name}{file_extension}")
-
-    if unit.top_entity:
-        store_manager = SaveTopEntity(serializer, path, name)
-        to_rtl(unit, store_manager)
-        return store_manager.filepath
+    for serializer, path in zip(serializers, paths):
+        file_extension = serializer.fileExtension
+        unit.logger.info(f"Converting to {file_extension} in {path}/{name}{file_extension}")
+
+    if len(serializers) > 1:
+        store_manager = SaveToLanguages(serializers, paths, name if unit.top_entity else None)
+    elif unit.top_entity:
+        store_manager = SaveTopEntity(serializers[0], paths[0], name)
     else:
-        store_manager = SaveToFilesFlat(serializer, path)
-        to_rtl(unit, store_manager)
-        # code = to_rtl_str(unit, serializer_cls=serializer)
-        # with open(f"{path}/{name}{file_extension}", "w") as file:
-        #     file.write(code)
-        return f"{path}/{name}{file_extension}"
+        store_manager = SaveToFilesFlat(serializers[0], paths[0])
+    to_rtl(unit, store_manager)
+    if unit.top_entity:
+        stores = getattr(store_manager, "stores", [store_manager])
+        return [store.filepath for store in stores]
+
+    files = []
+    for serializer, path in zip(serializers, paths):
+        # the entities of the roms are replaced by the ones that read their
+        # initialization files
+        for memory in _memories(unit):
+            memory.save(path, serializer.fileExtension)
+        files.append(f"{path}/{name}{serializer.fileExtension}")
+    return files
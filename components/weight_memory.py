@@ -0,0 +1,92 @@
+import logging
+
+from .utils import print_info
+
+from hwt.code import Concat, If
+from hwt.hdl.types.bits import Bits
+from hwt.interfaces.std import Signal, VectSignal
+from hwt.synthesizer.unit import Unit
+
+
+class WeightMemory(Unit):
+    """
+    .. hwt-schematic::
+    """
+
+    def __init__(self, words=None, width=1, stage=0, data_width=32, **kwargs):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        # hexadecimal words of each address at the power up (see memory_words)
+        self.words = [] if words is None else words
+        self.width = width
+        self.depth = len(self.words)
+        self.address_width = max(self.depth - 1, 1).bit_length()
+        # each word is written in beats of the data bus, the write address
+        # has the address of the word above the beat
+        self.data_width = data_width
+        self.beats = -(-width // data_width)
+        self.select_width = (self.depth - 1).bit_length()
+        self.beat_width = (self.beats - 1).bit_length()
+        self.write_address_width = max(self.select_width + self.beat_width, 1)
+        # stage of the pipeline of the conv layer part that reads the memory
+        self.stage = stage
+        self.top_entity = False
+
+        print_info(self, **kwargs)
+        super().__init__()
+
+    def _declr(self):
+        self.clk = Signal()
+        self.addr = VectSignal(self.address_width)
+        self.data = VectSignal(self.width)._m()
+        self.write = Signal()
+        self.write_address = VectSignal(self.write_address_width)
+        self.write_data = VectSignal(self.data_width)
+
+        name = f"WeightMemoryL{self.layer_id}P{self.process_id}S{self.stage}"
+        self._name = name
+        self._hdl_module_name = name
+
+    def _impl(self):
+        if self.select_width:
+            select = self.write_address[self.select_width + self.beat_width : self.beat_width]
+        else:
+            select = 0
+        values = []
+        for b in range(self.beats):
+            bits = min(self.data_width, self.width - b * self.data_width)
+            memory = self._sig(
+                name=f"memory_{b}",
+                dtype=Bits(bit_length=bits, force_vector=True)[self.depth],
+                def_val=[
+                    int(word, 16) >> (b * self.data_width) & (2 ** bits - 1)
+                    for word in self.words
+                ],
+            )
+            # the writes out of the words and beats of the memory are ignored,
+            # so the host writes the whole address space in one burst
+            write = self.write
+            if self.beat_width:
+                write = write & self.write_address[self.beat_width : 0]._eq(b)
+            if 2 ** self.select_width != self.depth:
+                write = write & (select < self.depth)
+            If(
+                self.clk._onRisingEdge(),
+                If(write, memory[select](self.write_data[bits:0])),
+            )
+            values.append(memory[self.addr])
+        data = values[0] if self.beats == 1 else Concat(*reversed(values))
+        If(self.clk._onRisingEdge(), self.data(data))
+
+
+if __name__ == "__main__":
+    from sys import argv
+    from utils import to_vhdl, get_std_logger
+
+    if len(argv) > 1:
+        path = argv[1]
+
+        get_std_logger()
+        unit = WeightMemory(words=["0123456789AB", "CDEF01234567"], width=48)
+        to_vhdl(unit, path)
+    else:
+        print("file.py <outputpath>")
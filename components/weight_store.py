@@ -0,0 +1,195 @@
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+WEIGHT_STORE_MAGIC = b"YWST"
+WEIGHT_STORE_VERSION = 1
+WEIGHT_STORE_ALIGNMENT = 64
+
+# magic, version and header length
+_PREAMBLE = struct.Struct("<4sIQ")
+
+# weight stores already mapped by this process
+_weight_stores = {}
+
+
+def build_layer_index(channels=3, layer_groups=[]):
+    """
+    This function walks the layer groups of a network config in the same way
+    as NetworkParser and returns, for each conv layer, the slices of the
+    weights and of the per filter variables (biases, scale, mean and
+    variance) used by each one of its parts.
+    """
+    layer_index = {}
+    weights_reference = 0
+    variables_reference = 0
+    index = 0
+
+    for group in layer_groups:
+        filters = group["filters"]
+        for layer in group["layers"]:
+            if layer["type"] == "conv_layer":
+                size = layer["size"]
+                parallelism = layer.get("parallelism", 8)
+                process_filters = int(filters / parallelism)
+                parts = []
+                for process_id in range(parallelism):
+                    weights_offset = (size ** 2) * channels * process_filters
+                    weights_offset += weights_reference
+                    variables_offset = process_filters + variables_reference
+                    parts.append(
+                        {
+                            "process_id": process_id,
+                            "weights": [weights_reference, weights_offset],
+                            "variables": [variables_reference, variables_offset],
+                        }
+                    )
+                    weights_reference = weights_offset + 1
+                    variables_reference = variables_offset + 1
+                layer_index[index] = parts
+            index += 1
+        channels = filters
+    return layer_index
+
+
+def write_weight_store(file_path="", arrays={}, layers=None, dtype="float64", sources=None):
+    """
+    This function writes a weight store file: a small json header with the
+    offset and dtype of each array (and optionally the per layer index built
+    by build_layer_index and the paths of the files the arrays were read
+    from) followed by the float arrays stored contiguously, each one aligned
+    to 64 bytes, so that they can be mapped in memory. The arrays are
+    float64 by default, the values of the pickle files, so their fixed point
+    codes are the same ones of the pickles.
+    """
+    header = {"arrays": {}, "layers": {}, "sources": sources or {}}
+    data = []
+    offset = 0
+    for name, values in arrays.items():
+        values = np.ascontiguousarray(values, dtype=dtype)
+        header["arrays"][name] = {
+            "dtype": values.dtype.str,
+            "offset": offset,
+            "length": len(values),
+        }
+        data.append((offset, values))
+        offset += values.nbytes
+        offset += -offset % WEIGHT_STORE_ALIGNMENT
+    if layers:
+        header["layers"] = {str(k): v for k, v in layers.items()}
+
+    header_bytes = json.dumps(header).encode()
+    data_start = _PREAMBLE.size + len(header_bytes)
+    data_start += -data_start % WEIGHT_STORE_ALIGNMENT
+
+    # write to a temporary file first, mappings of a previous version of the
+    # file are kept valid by replacing it instead of truncating it
+    temp_file_path = f"{file_path}.tmp"
+    with open(temp_file_path, "wb") as binary_stream:
+        binary_stream.write(
+            _PREAMBLE.pack(WEIGHT_STORE_MAGIC, WEIGHT_STORE_VERSION, len(header_bytes))
+        )
+        binary_stream.write(header_bytes)
+        for array_offset, values in data:
+            binary_stream.seek(data_start + array_offset)
+            binary_stream.write(values.tobytes())
+        binary_stream.truncate(data_start + offset)
+    os.replace(temp_file_path, file_path)
+
+
+class WeightStore:
+    """
+    Read only view of a weight store file. The file is mapped in memory and
+    each array is exposed as a numpy view over the mapping, so slicing an
+    array does not copy or load anything besides the touched pages.
+    """
+
+    def __init__(self, file_path=""):
+        self.file_path = file_path
+        self.__file = open(file_path, "rb")
+        self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_length = _PREAMBLE.unpack_from(self.__mmap, 0)
+        if magic != WEIGHT_STORE_MAGIC:
+            raise ValueError(f"{file_path} is not a weight store file")
+        if version != WEIGHT_STORE_VERSION:
+            raise ValueError(f"Weight store version {version} is not supported")
+
+        header_end = _PREAMBLE.size + header_length
+        header = json.loads(self.__mmap[_PREAMBLE.size : header_end].decode())
+        self.data_start = header_end + (-header_end % WEIGHT_STORE_ALIGNMENT)
+        self.arrays = header["arrays"]
+        self.layers = {int(k): v for k, v in header["layers"].items()}
+        self.sources = header.get("sources", {})
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __getitem__(self, name):
+        array = self.arrays[name]
+        return np.frombuffer(
+            self.__mmap,
+            dtype=np.dtype(array["dtype"]),
+            count=array["length"],
+            offset=self.data_start + array["offset"],
+        )
+
+    def close(self):
+        self.__mmap.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def weight_store_current(file_path="", sources={}):
+    """
+    This function returns whether the weight store file was converted from
+    the given source files (a dict with the path of each array) after their
+    last change, so it does not need to be converted again.
+    """
+    if not os.path.exists(file_path):
+        return False
+    modified = os.stat(file_path).st_mtime_ns
+    for path in sources.values():
+        if not os.path.exists(path) or os.stat(path).st_mtime_ns >= modified:
+            return False
+    with WeightStore(file_path=file_path) as store:
+        return store.sources == sources
+
+
+def open_weight_store(file_path=""):
+    """
+    This function returns the WeightStore of the file passed by the
+    parameters, mapping the file only the first time it is requested by the
+    current process.
+    """
+    status = os.stat(file_path)
+    key = (file_path, status.st_ino, status.st_mtime_ns)
+    if key not in _weight_stores:
+        _weight_stores[key] = WeightStore(file_path=file_path)
+    return _weight_stores[key]
+
+
+def resolve_weight_slices(weights_store="", weights_slice=(0, 0), variables_slice=(0, 0)):
+    """
+    This function receives a layer descriptor (the weights store path and
+    the slices of a conv layer part) and returns the numpy views of the
+    weights, biases, scale, mean and variance of the part.
+    """
+    store = open_weight_store(weights_store)
+    weights_index, weights_offset = weights_slice
+    variables_index, variables_offset = variables_slice
+    return {
+        "weights": store["weights"][weights_index:weights_offset],
+        "biases": store["biases"][variables_index:variables_offset],
+        "scale": store["scale"][variables_index:variables_offset],
+        "mean": store["mean"][variables_index:variables_offset],
+        "variance": store["variance"][variables_index:variables_offset],
+    }
@@ -0,0 +1,162 @@
+import logging
+
+from .utils import print_info, serialize_uniq_by
+
+from hwt.code import Concat, If
+from hwt.hdl.types.bits import Bits
+from hwt.interfaces.std import Signal, VectSignal
+from hwt.synthesizer.unit import Unit
+
+# rows of B^T and A^T of F(2x2, 3x3), the transforms of the tiles and of the
+# products (the one of the kernels, G, is applied by winograd_kernels)
+INPUT_TRANSFORM = [[1, 0, -1, 0], [0, 1, 1, 0], [0, -1, 1, 0], [0, 1, 0, -1]]
+OUTPUT_TRANSFORM = [[1, 1, 1, 0], [0, 1, -1, -1]]
+
+
+@serialize_uniq_by("layer_id")
+class WinogradConvUnit(Unit):
+    """
+    .. hwt-schematic::
+    """
+
+    def __init__(self, width=16, lower_output_bit=None, **kwargs):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.width = width
+        if lower_output_bit is None:
+            lower_output_bit = int(width - width / 2)
+        self.lower_output_bit = lower_output_bit
+        # the transforms of the tile add 4 values (2 bits), the ones of the
+        # kernels are 4 times G g G^T (4 bits) and the output transform adds
+        # 9 products (4 bits)
+        self.tile_width = width + 2
+        self.kernel_width = width + 4
+        self.product_width = self.tile_width + self.kernel_width
+        self.sum_width = self.product_width + 4
+        # clock cycles from the inputs to the outputs, with the product and
+        # output registers
+        self.latency = 2
+        self.top_entity = False
+
+        print_info(self, **kwargs)
+        super().__init__()
+
+    def _declr(self):
+        self.clk = Signal()
+        self.rst = Signal()
+        self.en_mult = Signal()
+        self.en_sum = Signal()
+        # 4x4 tile in row major order
+        self.input = VectSignal(self.width * 16)
+        for i in range(16):
+            setattr(self, f"kernel_{i}", VectSignal(self.kernel_width))
+        # 2x2 outputs in row major order
+        self.output = VectSignal(self.width * 4)._m()
+
+        name = f"WinogradConvUnitL{self.layer_id}"
+        self._name = name
+        self._hdl_module_name = name
+
+    def __extend(self, value, width, bits, name):
+        # two's complement sign extension, the sums are done with the width of
+        # their result
+        extended = self._sig(name=name, dtype=Bits(bit_length=bits, force_vector=True))
+        extended(Concat(*[value[width - 1]] * (bits - width), value))
+        return extended
+
+    def __transform(self, values, rows, bits, name):
+        # rows x values x rows^T with the adds and subtractions of the rows,
+        # values is a 4x4 list of signals of the given bits
+        def combine(terms, name):
+            # each row has a positive coefficient, it is the first term
+            terms = sorted(terms, key=lambda term: -term[0])
+            total = self._sig(name=name, dtype=Bits(bit_length=bits, force_vector=True))
+            value = terms[0][1]
+            for coefficient, term in terms[1:]:
+                value = value + term if coefficient > 0 else value - term
+            total(value)
+            return total
+
+        columns = [
+            [
+                combine(
+                    [(c, values[k][j]) for k, c in enumerate(row) if c], f"{name}_{i}_{j}_rows"
+                )
+                for j in range(4)
+            ]
+            for i, row in enumerate(rows)
+        ]
+        return [
+            [
+                combine([(c, columns[i][k]) for k, c in enumerate(row) if c], f"{name}_{i}_{j}")
+                for j, row in enumerate(rows)
+            ]
+            for i in range(len(rows))
+        ]
+
+    def _impl(self):
+        width = self.width
+        tile = [
+            [
+                self.__extend(
+                    self.input[width * (4 * r + c + 1) : width * (4 * r + c)],
+                    width,
+                    self.tile_width,
+                    f"tile_{r}_{c}",
+                )
+                for c in range(4)
+            ]
+            for r in range(4)
+        ]
+        tile = self.__transform(tile, INPUT_TRANSFORM, self.tile_width, "transformed_tile")
+
+        # the element-wise products of the transformed tile and kernel
+        products = []
+        for r in range(4):
+            row = []
+            for c in range(4):
+                operand = self._sig(
+                    name=f"operand_{r}_{c}", dtype=Bits(bit_length=self.tile_width, signed=True)
+                )
+                operand(tile[r][c]._convSign(True))
+                product = self._sig(
+                    name=f"product_{r}_{c}",
+                    dtype=Bits(bit_length=self.product_width, signed=True),
+                )
+                # signed product with the width of both operands
+                kernel = getattr(self, f"kernel_{4 * r + c}")
+                If(self.rst, product(0)).Else(
+                    If(
+                        self.clk._onRisingEdge(),
+                        If(self.en_mult, product(operand * kernel._convSign(True))),
+                    )
+                )
+                row.append(
+                    self.__extend(
+                        product, self.product_width, self.sum_width, f"extended_product_{r}_{c}"
+                    )
+                )
+            products.append(row)
+        sums = self.__transform(products, OUTPUT_TRANSFORM, self.sum_width, "sum")
+
+        # the sums are 4 times the ones of the windows, the outputs keep the
+        # width bits above the lower output bit
+        lower = self.lower_output_bit + 2
+        outputs = self._sig(name="outputs", dtype=Bits(bit_length=width * 4, force_vector=True))
+        outputs(Concat(*[sums[t // 2][t % 2][lower + width : lower] for t in reversed(range(4))]))
+        If(self.rst, self.output(0)).Else(
+            If(self.clk._onRisingEdge(), If(self.en_sum, self.output(outputs)))
+        )
+
+
+if __name__ == "__main__":
+    from sys import argv
+    from utils import to_vhdl, get_std_logger
+
+    if len(argv) > 1:
+        path = argv[1]
+
+        get_std_logger()
+        unit = WinogradConvUnit(width=16)
+        to_vhdl(unit, path)
+    else:
+        print("file.py <outputpath>")
@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from components.utils import float2fixed, float2fixed_array  # noqa: E402
+
+
+n_weights = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+formats = [(4, 11), (3, 4)]
+
+# weights with the same order of magnitude of the darknet ones plus a few
+# values out of range to exercise the saturation
+rng = np.random.default_rng(0)
+weights = rng.normal(0, 1, n_weights)
+weights[::1000] *= 40
+weight_list = weights.tolist()
+
+for integer_portion, decimal_portion in formats:
+    print(f"Q{integer_portion}.{decimal_portion} with {n_weights} weights")
+
+    start = time.perf_counter()
+    reference = float2fixed(weight_list, integer_portion, decimal_portion)
+    reference_time = time.perf_counter() - start
+    print(f"  float2fixed:       {reference_time:.3f}s")
+
+    start = time.perf_counter()
+    vectorized = float2fixed_array(weights, integer_portion, decimal_portion)
+    vectorized_time = time.perf_counter() - start
+    print(f"  float2fixed_array: {vectorized_time:.3f}s")
+
+    mismatches = np.count_nonzero(np.asarray(reference) != vectorized)
+    print(f"  speedup: {reference_time / vectorized_time:.1f}x")
+    print(f"  mismatches: {mismatches}")
+    if mismatches:
+        sys.exit(1)
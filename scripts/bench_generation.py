@@ -0,0 +1,217 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from components.network_parser import NetworkParser  # noqa: E402
+from components.utils import to_vhdl  # noqa: E402
+from components.weight_store import build_layer_index, write_weight_store  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "bench_generation_baseline.json")
+# slowdowns smaller than this (seconds) are noise in the smaller cases
+MIN_SLOWDOWN = 0.1
+
+FULL_GRID = {
+    "filters": [8, 16],
+    "channels": [3, 8],
+    "size": [1, 3],
+    "binary": [(False, False), (True, False), (True, True)],
+    "parallelism": [1, 2],
+}
+QUICK_GRID = {
+    "filters": [8],
+    "channels": [3],
+    "size": [1, 3],
+    "binary": [(False, False), (True, False), (True, True)],
+    "parallelism": [2],
+}
+
+
+def case_name(filters, channels, size, binary, bin_input, parallelism):
+    kind = "bin" if binary else "fix"
+    kind += "_binin" if bin_input else ""
+    return f"f{filters}_c{channels}_k{size}_{kind}_p{parallelism}"
+
+
+def write_case(path, filters, channels, size, binary, bin_input, parallelism):
+    """
+    Writes a synthetic weights store and the config of a network with one
+    conv layer followed by a max pool layer. The weights are kept away from
+    zero because float2fixed saturates tiny negative values out of range.
+    """
+    layer_groups = [
+        {
+            "filters": filters,
+            "layers": [
+                {
+                    "type": "conv_layer",
+                    "parallelism": parallelism,
+                    "size": size,
+                    "binary": binary,
+                    "bin_input": bin_input,
+                    "bin_output": False,
+                },
+                {"type": "max_pool_layer", "binary": False},
+            ],
+        }
+    ]
+    layer_index = build_layer_index(channels, layer_groups)
+    n_weights = layer_index[0][-1]["weights"][1]
+    n_variables = layer_index[0][-1]["variables"][1]
+
+    rng = np.random.default_rng(0)
+    signs = rng.choice([-1.0, 1.0], n_weights)
+    arrays = {
+        "weights": signs * rng.uniform(0.01, 1.0, n_weights),
+        "biases": rng.uniform(0.1, 1.0, n_variables),
+        "scale": rng.uniform(0.5, 1.0, n_variables),
+        "mean": np.zeros(n_variables),
+        "variance": rng.uniform(0.5, 1.0, n_variables),
+    }
+    store_path = f"{path}/weights.ywst"
+    write_weight_store(store_path, arrays, layer_index)
+
+    config = {
+        "weights_store_path": store_path,
+        "output_path": f"{path}/generated",
+        "width": 416,
+        "channels": channels,
+        "layer_groups": layer_groups,
+    }
+    config_path = f"{path}/config.yaml"
+    with open(config_path, "w") as stream:
+        yaml.dump(config, stream)
+    return config_path
+
+
+def run_case(config_path):
+    start = time.perf_counter()
+    net = NetworkParser(config_path)
+    layers = net.parse_network()
+    summary = net.generate(layers, to_vhdl, force=True, keep_going=True)
+    wall = time.perf_counter() - start
+
+    jobs = {job["name"]: job["duration"] for job in summary["jobs"] if job["duration"]}
+    return {
+        "wall": wall,
+        "jobs": jobs,
+        "memory": max([job["memory"] or 0.0 for job in summary["jobs"]] + [0.0]),
+        "failed": [job["name"] for job in summary["jobs"] if job["status"] == "failed"],
+    }
+
+
+def run_grid(grid, repeat=1):
+    results = {}
+    for filters, channels, size, (binary, bin_input), parallelism in itertools.product(
+        grid["filters"], grid["channels"], grid["size"], grid["binary"], grid["parallelism"]
+    ):
+        name = case_name(filters, channels, size, binary, bin_input, parallelism)
+        path = tempfile.mkdtemp(prefix=f"bench_{name}_")
+        try:
+            config_path = write_case(
+                path, filters, channels, size, binary, bin_input, parallelism
+            )
+            # keep the fastest run of each case to reduce the noise
+            runs = [run_case(config_path) for _ in range(repeat)]
+            result = min(runs, key=lambda run: run["wall"])
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+        results[name] = result
+        status = f"{len(result['failed'])} failed jobs" if result["failed"] else "ok"
+        print(
+            f"{name:28s} wall {result['wall']:7.2f}s "
+            f"jobs {sum(result['jobs'].values()):7.2f}s "
+            f"memory {result['memory']:7.1f}MB {status}"
+        )
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the list of regressions: cases slower than the baseline by more
+    than the threshold (ratio, 0.25 is 25%) and than MIN_SLOWDOWN in wall
+    time or in total job time, and cases with jobs failing that did not fail in the baseline.
+    The times of the baseline cases with failed jobs are not references, as
+    the failed jobs stop before writing their files.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        reference = baseline[name]
+        new_failures = set(result["failed"]) - set(reference["failed"])
+        if new_failures:
+            regressions.append(f"{name}: new failures {sorted(new_failures)}")
+        if reference["failed"]:
+            print(f"{name}: baseline with failed jobs, times not compared")
+            continue
+
+        measures = [
+            ("wall", result["wall"], reference["wall"]),
+            ("jobs", sum(result["jobs"].values()), sum(reference["jobs"].values())),
+        ]
+        for measure, value, reference_value in measures:
+            slowdown = value - reference_value
+            if slowdown > max(reference_value * threshold, MIN_SLOWDOWN):
+                regressions.append(
+                    f"{name}: {measure} time {value:.2f}s, "
+                    f"baseline {reference_value:.2f}s (+{value / reference_value - 1:.0%})"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the generation of synthetic networks"
+    )
+    parser.add_argument("--quick", action="store_true", help="run a smaller grid")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of each case")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file")
+    parser.add_argument(
+        "--threshold", type=float, default=None, help="allowed slowdown ratio"
+    )
+    parser.add_argument(
+        "--update-baseline", action="store_true", help="store the results as baseline"
+    )
+    args = parser.parse_args()
+
+    # the failures of the jobs are recorded in the results instead of logged
+    logging.disable(logging.CRITICAL)
+    results = run_grid(QUICK_GRID if args.quick else FULL_GRID, args.repeat)
+
+    baseline = {"threshold": 0.25, "cases": {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+    threshold = args.threshold if args.threshold is not None else baseline["threshold"]
+
+    if args.update_baseline:
+        # the cases with failed jobs are not stored, their times would be
+        # the references of the next runs
+        failed = [name for name, result in results.items() if result["failed"]]
+        baseline["cases"].update(
+            {name: result for name, result in results.items() if name not in failed}
+        )
+        with open(args.baseline, "w") as stream:
+            json.dump(baseline, stream, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        if failed:
+            print(f"Cases with failed jobs not stored: {', '.join(failed)}")
+            sys.exit(1)
+    else:
+        regressions = compare(results, baseline["cases"], threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {threshold:.0%} of the baseline")
@@ -1,4 +1,11 @@
+import os
 import pickle
+import sys
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from components.weight_store import build_layer_index, write_weight_store  # noqa: E402
 
 
 weights_path = "./tiny/tiny_weights.h"
@@ -13,15 +20,21 @@ bin_bn_mean_path = "./tiny/tiny_mean.pickle"
 bin_scale_path = "./tiny/tiny_scale.pickle"
 bin_biases_path = "./tiny/tiny_biases.pickle"
 
+# single file with all the arrays, the network config is optional and only
+# used to write the per layer index (python convert.py [config.yaml])
+weights_store_path = "./tiny/tiny_weights.ywst"
+network_file = sys.argv[1] if len(sys.argv) > 1 else None
+
 file_paths = [
-    (weights_path, bin_weights_path),
-    (bn_variance_path, bin_bn_variance_path),
-    (bn_mean_path, bin_bn_mean_path),
-    (scale_path, bin_scale_path),
-    (biases_path, bin_biases_path),
+    ("weights", weights_path, bin_weights_path),
+    ("variance", bn_variance_path, bin_bn_variance_path),
+    ("mean", bn_mean_path, bin_bn_mean_path),
+    ("scale", scale_path, bin_scale_path),
+    ("biases", biases_path, bin_biases_path),
 ]
 
-for text_file_path, bin_file_path in file_paths:
+arrays = {}
+for name, text_file_path, bin_file_path in file_paths:
     float_values = []
 
     with open(text_file_path, "r") as text_stream:
@@ -38,3 +51,12 @@ for text_file_path, bin_file_path in file_paths:
 
     with open(bin_file_path, "wb") as binary_stream:
         pickle.dump(float_values, binary_stream)
+    arrays[name] = float_values
+
+layers = None
+if network_file:
+    with open(network_file) as stream:
+        network = yaml.load(stream, Loader=yaml.FullLoader)
+    layers = build_layer_index(network["channels"], network["layer_groups"])
+
+write_weight_store(weights_store_path, arrays, layers)
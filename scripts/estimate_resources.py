@@ -0,0 +1,16 @@
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from components.resource_estimator import estimate_resources, print_resources  # noqa: E402
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        start = perf_counter()
+        estimate = estimate_resources(sys.argv[1])
+        duration = perf_counter() - start
+        print_resources(estimate)
+        print(f"Estimated in {duration * 1000:.1f}ms")
+    else:
+        print("estimate_resources.py <config.yaml>")
@@ -0,0 +1,53 @@
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from components.golden_model import input_format, run_network  # noqa: E402
+from components.network_parser import NetworkParser  # noqa: E402
+from components.utils import fixed2float_array, float2fixed_array  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the golden model of the generated datapath over a frame"
+    )
+    parser.add_argument("config", help="network config file")
+    parser.add_argument("--input", help="npy file with a float frame (height, width, channels)")
+    parser.add_argument("--output", help="npy file to save the output codes")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random frame")
+    args = parser.parse_args()
+
+    net = NetworkParser(args.config)
+    # the parser halves the width of the network in each max pool layer
+    width = net.width
+    layers = net.parse_network()
+    _, integer_portion, decimal_portion = input_format(layers)
+
+    if args.input:
+        frame = np.load(args.input)
+    else:
+        rng = np.random.default_rng(args.seed)
+        frame = rng.uniform(0.0, 1.0, (width, width, net.input_channels))
+    feature_map = float2fixed_array(frame, integer_portion, decimal_portion)
+
+    times = {"last": perf_counter()}
+
+    def report(layer, output, fixed_format):
+        now = perf_counter()
+        values = fixed2float_array(output, *fixed_format[1:])
+        print(
+            f"{layer['filename']:16s} {str(output.shape):18s} "
+            f"{now - times['last']:7.2f}s mean {values.mean():8.4f} "
+            f"min {values.min():8.4f} max {values.max():8.4f}"
+        )
+        times["last"] = now
+
+    start = perf_counter()
+    output = run_network(layers, feature_map, callback=report)
+    print(f"Frame {frame.shape} in {perf_counter() - start:.2f}s")
+
+    if args.output:
+        np.save(args.output, output)
@@ -0,0 +1,42 @@
+import argparse
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from components.simulation import default_cases, network_cases, run_regression  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Simulate the units and compare their outputs with the golden model"
+    )
+    parser.add_argument("config", nargs="?", help="network config file, the units of its layers")
+    parser.add_argument("--vectors", type=int, default=1000, help="stimuli of each unit")
+    parser.add_argument("--shard-size", type=int, default=250, help="stimuli of each job")
+    parser.add_argument("--processes", type=int, default=None, help="workers of the pool")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the stimuli")
+    args = parser.parse_args()
+
+    cases = network_cases(args.config) if args.config else default_cases()
+    start = perf_counter()
+    summaries = run_regression(
+        cases,
+        vectors=args.vectors,
+        shard_size=args.shard_size,
+        processes=args.processes,
+        seed=args.seed,
+    )
+
+    failed = False
+    for summary in summaries:
+        params = ", ".join(f"{name}={value}" for name, value in summary["params"].items())
+        if summary["error"] is not None:
+            status = f"ERROR {summary['error']}"
+        else:
+            status = f"{summary['mismatches']}/{summary['vectors']} mismatches"
+        print(f"{summary['kind']:21s} {params:60s} {summary['duration']:7.2f}s {status}")
+        for example in summary["examples"]:
+            print(f"    {example}")
+        failed = failed or summary["mismatches"] > 0 or summary["error"] is not None
+    print(f"Regression in {perf_counter() - start:.2f}s")
+    sys.exit(1 if failed else 0)